@@ -0,0 +1,525 @@
+"""
+Benchmarks for the validator's WorldCat, MARC database and MARC reading code, kept out of the library modules.
+
+Run one from the top folder of the repository by name:
+
+    python -m benchmarks.run_benchmarks api_session [-n 500]
+    python -m benchmarks.run_benchmarks marc_db RECORDS
+    python -m benchmarks.run_benchmarks marc_file_reader [FILE] [--records 200000]
+    python -m benchmarks.run_benchmarks mrk_record [--rounds 20000]
+    python -m benchmarks.run_benchmarks marc_fields [--records 5000]
+    python -m benchmarks.run_benchmarks marcxml_to_mrk [FILE ...] [--rounds 2000]
+
+Each benchmark prints its timings; add -h after the name to see its options.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+import threading
+import http.server
+import tracemalloc
+from typing import Callable
+
+import pymarc
+import bookops_worldcat
+
+from crl_lib.api_rate_limiter import RateLimiter
+from crl_lib.local_marc_db import LocalMarcDb
+from crl_lib.marc_fields import (
+    MarcField,
+    MarcFields,
+    MarcFieldsExtractor,
+    WorldCatMarcFields,
+    stringify_marc_data,
+)
+from crl_lib.marc_file_reader import MarcFileReader
+from crl_lib.marc_utilities import get_field_subfield, get_fields_subfields
+from crl_lib.marcxml_to_mrk import SAMPLE_MARCXML, marcxml_to_mrk_records
+from crl_lib.mrk_record import MrkRecord
+from crl_lib.wc_api import WcApi
+
+# The lookups MrkProcessRunner and Line583Validator make on a typical LHR
+MRK_RECORD_LOOKUPS = [
+    ("001", None), ("004", None), ("852", "a"), ("852", "b"), ("035", "a"), ("583", "a"), ("583", "c"),
+    ("583", "f"), ("561", "3"), ("561", "a"), ("561", "5"), ("866", "a"), ("867", "a"), ("868", "a"),
+]
+
+
+def time_it(run: Callable[[], object]) -> float:
+    """Call run once, and return how many seconds it took."""
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+def make_sample_worldcat_record(number: int, brief: bool = False) -> str:
+    """
+    A made-up WorldCat serial record with OCLC number number, of about the size and shape of a real one. A brief
+    record has just the leader, 001 and 245.
+    """
+    if brief:
+        return "=LDR  00000cas a2200000 a 4500\n=001  {}\n=245  00$aTitle {}".format(number, number)
+    return "\n".join(
+        [
+            "=LDR  02345cas a2200589 i 4500",
+            "=001  {}".format(number),
+            "=003  OCoLC",
+            "=005  20230101123456.0",
+            "=008  800101c19809999nyuqr p       0   a0eng c",
+            "=010  \\\\$a   80012345 $zsn 79001234",
+            "=019  \\\\$a{}$a{}".format(number + 1, number + 2),
+            "=022  0\\$a1234-567X$l1234-567X$21",
+            "=035  \\\\$a(OCoLC){}$z(OCoLC){}".format(number, number + 1),
+            "=040  \\\\$aDLC$beng$erda$cDLC$dOCL$dNSD$dOCLCQ$dCQ$.$dUKMGB$dOCLCF$dOCLCO",
+            "=042  \\\\$apcc$ansdp",
+            "=050  00$aQA1$b.J68",
+            "=082  04$a510/.5$223",
+            "=210  0\\$aJ. stud.",
+            "=222  \\0$aJournal of studies",
+            "=245  00$aJournal of studies number {} /$cSociety of Studies.".format(number),
+            "=246  13$aStudies journal",
+            "=264  \\1$aNew York :$bSociety of Studies,$c1980-",
+            "=300  \\\\$avolumes :$billustrations ;$c28 cm",
+            "=310  \\\\$aQuarterly",
+            "=336  \\\\$atext$btxt$2rdacontent",
+            "=337  \\\\$aunmediated$bn$2rdamedia",
+            "=338  \\\\$avolume$bnc$2rdacarrier",
+            "=362  1\\$aBegan with v. 1, no. 1 (Jan. 1980).",
+            "=500  \\\\$aTitle from cover.",
+            "=588  \\\\$aDescription based on: v. 1.",
+            "=650  \\0$aMathematics$vPeriodicals.",
+            "=650  \\7$aMathematics.$2fast$0(OCoLC)fst01012163",
+            "=651  \\0$aUnited States$xStudies$vPeriodicals.",
+            "=710  2\\$aSociety of Studies.",
+            "=776  08$iOnline version:$tJournal of studies$x1234-5678$w(OCoLC){}".format(number + 3),
+            "=780  00$tJournal of old studies$x2345-6789$w(OCoLC){}".format(number - 1),
+            "=856  40$uhttp://example.org/{}$zAvailable online".format(number),
+            "=938  \\\\$aEBSCOhost$bEBSC$n{}".format(number),
+        ]
+    )
+
+
+def make_sample_lhr(number: int) -> str:
+    """A made-up local holdings record (LHR) with holdings and retention fields, numbered number."""
+    return "\n".join(
+        [
+            "=LDR  00000cy  a22000003  4500",
+            "=001  {}".format(number),
+            "=004  ocm{:08d}".format(number),
+            "=008  1001010u||||8|||4001aueng0000000",
+            "=035  \\\\$a(OCoLC){}".format(number),
+            "=245  00$aJournal of studies number {} : $bcafé edition".format(number),
+            "=852  01$aCRL$bmain$hJournal of Studies",
+            "=866  41$av.1(1950)-v.{}({})$zSome issues missing".format(number % 70 + 1, 1950 + number % 70),
+            "=867  41$av.1-v.3 suppl.",
+            "=583  1\\$acommitted to retain$c20200101$d20351231$fCRL$fPAPR$uhttps://example.org$5CRL",
+            "=561  \\\\$3v.1-v.3$aGift of somebody$5CRL",
+        ]
+    )
+
+
+def make_sample_mrk_file(file_location: str, record_count: int) -> None:
+    """Write an MRK file of made-up LHRs with Windows line endings, and a Latin-1 line in every hundredth record."""
+    with open(file_location, "wb") as fout:
+        for number in range(1, record_count + 1):
+            record = (make_sample_lhr(number).replace("\n", "\r\n") + "\r\n").encode("utf8")
+            if number % 100 == 1:
+                record += "=500  \\\\$aNote in Latin-1: café\r\n".encode("latin-1")
+            fout.write(record + b"\r\n")
+
+
+class _StandInApiHandler(http.server.BaseHTTPRequestHandler):
+    """Answers token and bib requests like the OCLC servers do."""
+
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, which Nagle would delay on a kept-alive connection
+    disable_nagle_algorithm = True
+    marcxml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<record xmlns="http://www.loc.gov/MARC21/slim"><leader>00000cas a2200000 a 4500</leader>'
+        '<controlfield tag="001">1</controlfield></record>'
+    )
+
+    def do_POST(self) -> None:
+        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=20)
+        body = json.dumps(
+            {
+                "access_token": "tk_stand_in",
+                "token_type": "bearer",
+                "expires_at": expires_at.strftime("%Y-%m-%d %H:%M:%SZ"),
+            }
+        )
+        self._send(body, "application/json")
+
+    def do_GET(self) -> None:
+        self._send(self.marcxml, "application/marcxml+xml")
+
+    def _send(self, body: str, content_type: str) -> None:
+        encoded_body = body.encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded_body)))
+        self.end_headers()
+        self.wfile.write(encoded_body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def run_api_session_benchmark(args: argparse.Namespace) -> None:
+    """
+    Compare per-request latency of a new MetadataSession for every OCLC against WcApi's long-lived session, using a
+    stand-in API server on localhost.
+    """
+    request_count = args.n
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _StandInApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server_url = "http://127.0.0.1:{}".format(server.server_address[1])
+
+    class StandInToken(bookops_worldcat.WorldcatAccessToken):
+        def _token_url(self) -> str:
+            return server_url + "/token"
+
+    class StandInWcApi(WcApi):
+        def get_token(self) -> None:
+            self.token = StandInToken(key="key", secret="secret", scopes="WorldCatMetadataAPI")
+
+        def _create_session(self) -> bookops_worldcat.MetadataSession:
+            session = super()._create_session()
+            session.BASE_URL = server_url + "/worldcat"
+            return session
+
+    # the stand-in server doesn't need protecting from us
+    wc_api = StandInWcApi(api_key="key", api_secret="secret", rate_limiter=RateLimiter(requests_per_second=1e9))
+    wc_api.check_token()
+
+    def use_new_sessions() -> None:
+        for oclc_number in range(1, request_count + 1):
+            with bookops_worldcat.MetadataSession(authorization=wc_api.token) as session:
+                session.BASE_URL = server_url + "/worldcat"
+                session.bib_get(oclc_number)
+
+    def use_long_lived_session() -> None:
+        for oclc_number in range(1, request_count + 1):
+            wc_api.get_marcxml_from_oclc(oclc_number)
+
+    new_session_time = time_it(use_new_sessions)
+    long_lived_session_time = time_it(use_long_lived_session)
+    wc_api.close_session()
+    server.shutdown()
+
+    print("{} requests to {}".format(request_count, server_url))
+    print("New session per request: {:.3f} ms/request".format(new_session_time / request_count * 1000))
+    print("Long-lived session:      {:.3f} ms/request".format(long_lived_session_time / request_count * 1000))
+
+
+def run_marc_db_benchmark(args: argparse.Namespace, lookup_count: int = 50000) -> None:
+    """
+    Build a throwaway MARC database of brief records, then time single and batched lookups against it, including
+    the date-function query LocalMarcDb used before updated_day was indexed.
+    """
+    record_count = args.records
+    temp_folder = tempfile.mkdtemp()
+    db = LocalMarcDb(temp_folder)
+    print("Building a database of {} records in {}".format(record_count, temp_folder))
+    today = datetime.date.today()
+    c = db.conn.cursor()
+
+    def build_database() -> None:
+        for first_oclc in range(1, record_count + 1, 100000):
+            oclc_range = range(first_oclc, min(first_oclc + 100000, record_count + 1))
+            marc_rows = []
+            for oclc in oclc_range:
+                updated_date = today - datetime.timedelta(days=oclc % 730)
+                marc_rows.append(
+                    (oclc, "", updated_date.strftime("%Y-%m-%d"), make_sample_worldcat_record(oclc, brief=True))
+                )
+            c.executemany(
+                "INSERT INTO marc_records (oclc_number, issn, updated_date, marc) VALUES (?, ?, ?, ?)", marc_rows
+            )
+            c.executemany("INSERT INTO oclcs_019 (oclc_019, oclc_number) VALUES (?, ?)", ((o, o) for o in oclc_range))
+            db.conn.commit()
+
+    print("Built in {:.1f} seconds".format(time_it(build_database)))
+
+    oclcs = [str(random.randint(1, record_count)) for _ in range(lookup_count)]
+    old_statement = (
+        "SELECT marc FROM marc_records JOIN oclcs_019 USING (oclc_number) WHERE oclc_019 = ? AND "
+        "DATE('now', '-1 year') < updated_date"
+    )
+
+    def report(label: str, seconds: float) -> None:
+        print("{:<32}{:>12,.0f} lookups/sec".format(label, lookup_count / seconds))
+
+    def use_old_query() -> None:
+        for oclc in oclcs:
+            c.execute(old_statement, (oclc,))
+            c.fetchone()
+
+    report("old recent_only query", time_it(use_old_query))
+    for recent_only in (True, False):
+        report(
+            "get_marc_from_db recent_only={}".format(recent_only),
+            time_it(lambda: [db.get_marc_from_db(oclc, recent_only=recent_only) for oclc in oclcs]),
+        )
+    report("get_marc_from_db_for_oclcs", time_it(lambda: db.get_marc_from_db_for_oclcs(oclcs, recent_only=True)))
+    db.close_marc_db()
+    shutil.rmtree(temp_folder)
+
+
+def run_marc_file_reader_benchmark(args: argparse.Namespace) -> None:
+    """
+    Time reading an MRK file line by line and memory-mapped, check that both give the same records, and time
+    building its offset index. Without a file, a sample file of made-up LHRs is used.
+    """
+    file_location = args.file
+    temp_folder = None
+    if file_location is None:
+        temp_folder = tempfile.TemporaryDirectory()
+        file_location = os.path.join(temp_folder.name, "benchmark.mrk")
+        make_sample_mrk_file(file_location, args.records)
+    try:
+        megabytes = os.path.getsize(file_location) / 1048576
+        timings = {}
+        record_hashes = {}
+        for label, use_mmap in (("readline", False), ("mmap", True)):
+            record_hash = 0
+            records_read = 0
+
+            def read_file() -> None:
+                nonlocal record_hash, records_read
+                for record in MarcFileReader(file_location, use_mmap=use_mmap):
+                    record_hash = hash((record_hash, record))
+                    records_read += 1
+
+            timings[label] = time_it(read_file)
+            record_hashes[label] = (records_read, record_hash)
+            print(
+                "{:<10}{:>10,} records in {:.2f} seconds ({:,.0f} records/sec, {:.1f} MB/sec)".format(
+                    label, records_read, timings[label], records_read / timings[label], megabytes / timings[label]
+                )
+            )
+        print("{:.1f}x faster".format(timings["readline"] / timings["mmap"]))
+        if record_hashes["readline"] != record_hashes["mmap"]:
+            print("Records differ between the readers!")
+            sys.exit(1)
+
+        mfr = MarcFileReader(file_location)
+        offset_index = []
+        index_time = time_it(lambda: offset_index.extend(mfr.get_offset_index()))
+        print("Offset index of {:,} records built in {:.2f} seconds".format(len(offset_index) // 2, index_time))
+        mfr.close()
+    finally:
+        if temp_folder is not None:
+            temp_folder.cleanup()
+
+
+def run_mrk_record_benchmark(args: argparse.Namespace) -> None:
+    """
+    Time the field lookups MrkProcessRunner makes on an LHR, with the marc_utilities regex functions and with an
+    MrkRecord (including the time to build it), after checking that both find the same things.
+    """
+    rounds = args.rounds
+    record = make_sample_lhr(1)
+    expected = [
+        get_fields_subfields(record, field, subfield) + [get_field_subfield(record, field, subfield)]
+        for field, subfield in MRK_RECORD_LOOKUPS
+    ]
+    mrk_record = MrkRecord(record)
+    found = [
+        mrk_record.get_fields_subfields(field, subfield) + [mrk_record.get_field_subfield(field, subfield)]
+        for field, subfield in MRK_RECORD_LOOKUPS
+    ]
+    if found != expected:
+        print("MrkRecord lookups differ from marc_utilities:\n{}\n{}".format(expected, found))
+        sys.exit(1)
+
+    def use_regexes() -> None:
+        for _ in range(rounds):
+            for field, subfield in MRK_RECORD_LOOKUPS:
+                get_fields_subfields(record, field, subfield)
+                get_field_subfield(record, field, subfield)
+
+    def use_mrk_records() -> None:
+        for _ in range(rounds):
+            mrk_record = MrkRecord(record)
+            for field, subfield in MRK_RECORD_LOOKUPS:
+                mrk_record.get_fields_subfields(field, subfield)
+                mrk_record.get_field_subfield(field, subfield)
+
+    regex_time = time_it(use_regexes)
+    mrk_record_time = time_it(use_mrk_records)
+    for label, timing in (("marc_utilities", regex_time), ("MrkRecord", mrk_record_time)):
+        print("{:<16}{:>8.1f} microseconds/record".format(label, timing / rounds * 1000000))
+    print("{:.1f}x faster".format(regex_time / mrk_record_time))
+
+
+def run_marc_fields_benchmark(args: argparse.Namespace) -> None:
+    """
+    Time building MarcFields objects for made-up WorldCat records, looking a few things up in them built eagerly
+    and lazily, and taking the validator's WorldCat data from them with get_data and with a MarcFieldsExtractor.
+    Measure the memory their field dicts hold, next to what the same fields take as a dict per field with a dict of
+    lists of subfields.
+    """
+    record_count = args.records
+    records = [make_sample_worldcat_record(number) for number in range(1000000, 1000000 + record_count)]
+
+    build_time = time_it(lambda: [MarcFields(record) for record in records])
+    print(
+        "Built {:,} records in {:.2f} seconds ({:.1f} microseconds/record)".format(
+            record_count, build_time, build_time / record_count * 1000000
+        )
+    )
+
+    # what the ISSN database lookups want from a record
+    for label, lazy in (("eager", False), ("lazy", True)):
+
+        def look_up_issn_db_data() -> None:
+            for record in records:
+                mf = MarcFields(record, lazy=lazy)
+                mf.get_data("year_1")
+                mf.get_data("form")
+                mf.get_data("imprint")
+
+        lookup_time = time_it(look_up_issn_db_data)
+        print(
+            "{:<6}year_1, form and imprint in {:.1f} microseconds/record".format(
+                label, lookup_time / record_count * 1000000
+            )
+        )
+
+    # the categories the validator takes from each WorldCat record
+    categories = [
+        "oclc", "oclcs_019", "issn_a", "issn_l", "title", "uniform_title", "title_h", "publisher", "record_type",
+        "form", "bib_lvl", "serial_type", "carrier_type", "media_type", "place", "lang", "govt_pub",
+        "authentication_code", "cat_agent", "cat_lang", "lc_class", "dewey", "year_1", "year_2", "combined_start_year",
+        "combined_end_year", "line_362", "current_freq", "former_freq", "preceding_oclcs", "succeeding_oclcs",
+        "other_oclcs", "numbering_peculiarities",
+    ]
+
+    def use_get_data() -> None:
+        for record in records:
+            mf = WorldCatMarcFields(record)
+            [stringify_marc_data(mf.get_data(category)) for category in categories]
+
+    extractor = MarcFieldsExtractor(categories, WorldCatMarcFields, stringify=True)
+    get_data_time = time_it(use_get_data)
+    extractor_time = time_it(lambda: [extractor.extract(WorldCatMarcFields(record)) for record in records])
+    print(
+        "{} categories in {:.1f} microseconds/record with get_data, {:.1f} with MarcFieldsExtractor".format(
+            len(categories), get_data_time / record_count * 1000000, extractor_time / record_count * 1000000
+        )
+    )
+
+    tracemalloc.start()
+    marc_dicts = [MarcFields(record).marc_dict for record in records]
+    field_memory = tracemalloc.get_traced_memory()[0]
+    dict_fields = [
+        [
+            {
+                "ind1": field.ind1,
+                "ind2": field.ind2,
+                "subfields": {code: field.get_subfields(code) for code in field.codes},
+            }
+            for fields in marc_dict.values()
+            for field in fields
+            if isinstance(field, MarcField)
+        ]
+        for marc_dict in marc_dicts
+    ]
+    dict_field_memory = tracemalloc.get_traced_memory()[0] - field_memory
+    tracemalloc.stop()
+    marc_field_memory = sum(
+        sys.getsizeof(field) + sys.getsizeof(field.codes) + sys.getsizeof(field.values)
+        for marc_dict in marc_dicts
+        for fields in marc_dict.values()
+        for field in fields
+        if isinstance(field, MarcField)
+    )
+    print("Field dicts hold {:.1f} KB/record, subfield data included".format(field_memory / record_count / 1024))
+    print(
+        "Without their subfield data, variable fields take {:.1f} KB/record as MarcField objects, "
+        "{:.1f} KB/record as dicts of lists".format(
+            marc_field_memory / record_count / 1024, dict_field_memory / record_count / 1024
+        )
+    )
+    del dict_fields
+
+
+def run_marcxml_to_mrk_benchmark(args: argparse.Namespace) -> None:
+    """Time converting the sample MARCXML documents, and any files given, with pymarc and with marcxml_to_mrk."""
+    marcxml_texts = list(SAMPLE_MARCXML)
+    for file_name in args.files:
+        with open(file_name, encoding="utf-8") as fin:
+            marcxml_texts.append(fin.read())
+
+    def convert_with_pymarc(marcxml: str) -> None:
+        [str(record) for record in pymarc.marcxml.parse_xml_to_array(io.StringIO(marcxml))]
+
+    timings = {}
+    for label, convert in (("pymarc", convert_with_pymarc), ("marcxml_to_mrk", marcxml_to_mrk_records)):
+        timings[label] = time_it(
+            lambda: [convert(marcxml) for _ in range(args.rounds) for marcxml in marcxml_texts]
+        )
+        print("{:<16}{:>10,.0f} documents/sec".format(label, args.rounds * len(marcxml_texts) / timings[label]))
+    print("{:.1f}x faster".format(timings["pymarc"] / timings["marcxml_to_mrk"]))
+
+
+def parse_command_line_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the validator's performance-sensitive code.")
+    benchmarks = parser.add_subparsers(dest="benchmark", required=True)
+
+    api_session = benchmarks.add_parser(
+        "api_session", help="Metadata API sessions, against a local stand-in server"
+    )
+    api_session.add_argument("-n", type=int, default=500, help="number of requests (default 500)")
+    api_session.set_defaults(run=run_api_session_benchmark)
+
+    marc_db = benchmarks.add_parser("marc_db", help="lookups in the local MARC database")
+    marc_db.add_argument("records", type=int, help="records in the throwaway database")
+    marc_db.set_defaults(run=run_marc_db_benchmark)
+
+    marc_file_reader = benchmarks.add_parser(
+        "marc_file_reader", help="reading an MRK file line by line and memory-mapped"
+    )
+    marc_file_reader.add_argument("file", nargs="?", help="MRK file; a sample file is made if not given")
+    marc_file_reader.add_argument(
+        "--records", "-r", type=int, default=200000, help="records in the sample file (default 200000)"
+    )
+    marc_file_reader.set_defaults(run=run_marc_file_reader_benchmark)
+
+    mrk_record = benchmarks.add_parser("mrk_record", help="MrkRecord lookups against the marc_utilities regexes")
+    mrk_record.add_argument("--rounds", "-r", type=int, default=20000, help="times to look up every field")
+    mrk_record.set_defaults(run=run_mrk_record_benchmark)
+
+    marc_fields = benchmarks.add_parser("marc_fields", help="building MarcFields objects, and what they take")
+    marc_fields.add_argument(
+        "--records", "-r", type=int, default=5000, help="made-up WorldCat records to build (default 5000)"
+    )
+    marc_fields.set_defaults(run=run_marc_fields_benchmark)
+
+    marcxml_to_mrk = benchmarks.add_parser("marcxml_to_mrk", help="converting MARCXML to MRK, against pymarc")
+    marcxml_to_mrk.add_argument("files", nargs="*", help="MARCXML files to use as well as the built-in samples")
+    marcxml_to_mrk.add_argument(
+        "--rounds", "-r", type=int, default=2000, help="times to convert each document (default 2000)"
+    )
+    marcxml_to_mrk.set_defaults(run=run_marcxml_to_mrk_benchmark)
+
+    return parser.parse_args()
+
+
+def app() -> None:
+    args = parse_command_line_arguments()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    app()
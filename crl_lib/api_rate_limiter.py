@@ -0,0 +1,230 @@
+"""
+Client-side rate limiting for the WorldCat Metadata API.
+
+RateLimiter is a token bucket that every thread making API requests draws from before each request. When the API
+answers 429 (Too Many Requests), the limiter halves its rate and holds all requests back for the Retry-After period,
+then creeps back up to the full rate as requests succeed. By default every WorldcatApiToken shares one limiter, so
+the budget covers all fetchers in the process.
+
+ProcessSharedRateLimiter keeps the same bucket in shared memory, so one budget can cover several processes. Create it
+in the parent and install it in each worker with use_shared_rate_limiters, for instance through a process pool's
+initializer.
+
+ApiRequestCounters keeps the request, retry and failure counts for the end-of-run log.
+"""
+
+import time
+import random
+import logging
+import datetime
+import threading
+import email.utils
+import multiprocessing
+from collections import Counter
+from typing import Dict, Optional
+
+import requests
+
+
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+# the rate never drops below this, however often the API throttles us
+MIN_REQUESTS_PER_SECOND = 0.5
+# each success raises a lowered rate by this fraction of the full rate
+RATE_RECOVERY_STEP = 0.02
+# requests that fail with a 429, a 5xx or a connection error are tried this many times in all
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+
+class TransientApiError(Exception):
+    """A request failed in a way that's worth retrying. retry_after is the server's Retry-After, in seconds, or 0."""
+
+    def __init__(self, message: str, retry_after: float = 0.0) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket, with a pause for the Retry-After period and a lowered rate after throttling.
+
+    Usage:
+
+        limiter = RateLimiter(requests_per_second=10)
+        limiter.acquire()  # blocks until a request may be sent
+        ...
+        limiter.succeeded()  # or limiter.throttled(retry_after) on a 429
+    """
+
+    def __init__(self, requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND, burst: int = 0) -> None:
+        self.max_rate = requests_per_second
+        self.rate = requests_per_second
+        self.capacity = burst or max(1, int(requests_per_second))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Wait until a request may be sent, and use up one token."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, retry_after: float = 0.0) -> None:
+        """The API answered 429: halve the rate, and send nothing more until retry_after seconds have passed."""
+        with self._lock:
+            self.rate = max(MIN_REQUESTS_PER_SECOND, self.rate / 2)
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.updated = max(self.updated, self.paused_until)
+        logging.debug("WorldCat API throttled; slowing to {:.1f} requests/sec".format(self.rate))
+
+    def succeeded(self) -> None:
+        """A request went through: step a lowered rate back up towards the full rate."""
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_RECOVERY_STEP)
+
+
+def _shared_value(index: int) -> property:
+    def get_value(self: "ProcessSharedRateLimiter") -> float:
+        return self._shared_state[index]
+
+    def set_value(self: "ProcessSharedRateLimiter", value: float) -> None:
+        self._shared_state[index] = value
+
+    return property(get_value, set_value)
+
+
+class ProcessSharedRateLimiter(RateLimiter):
+    """
+    A RateLimiter whose state lives in shared memory, guarded by a process lock, so that every process it's handed to
+    draws from the same budget. It can only be passed to other processes when they're started.
+    """
+
+    rate = _shared_value(0)
+    tokens = _shared_value(1)
+    updated = _shared_value(2)
+    paused_until = _shared_value(3)
+
+    def __init__(self, requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND, burst: int = 0) -> None:
+        self._shared_state = multiprocessing.RawArray("d", 4)
+        super().__init__(requests_per_second=requests_per_second, burst=burst)
+        self._lock = multiprocessing.Lock()
+
+
+class ApiRequestCounters:
+    """Thread-safe counts of API requests and how they turned out."""
+
+    def __init__(self) -> None:
+        self.counts: Counter = Counter()
+        self.first_request_time: Optional[float] = None
+        self.last_request_time: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, count: int = 1) -> None:
+        with self._lock:
+            self.counts[name] += count
+            if name == "requests":
+                now = time.monotonic()
+                if self.first_request_time is None:
+                    self.first_request_time = now
+                self.last_request_time = now
+
+    def summary(self) -> str:
+        """One line for the log, like 'WorldCat API: 120 requests in 14.2 seconds (8.5/sec); ...'."""
+        requests_made = self.counts["requests"]
+        seconds = 0.0
+        if self.first_request_time is not None and self.last_request_time is not None:
+            seconds = self.last_request_time - self.first_request_time
+        rate = requests_made / seconds if seconds > 0 else 0.0
+        return (
+            "WorldCat API: {} requests in {:.1f} seconds ({:.1f}/sec); {} records, {} not found, {} throttled, "
+            "{} server errors, {} connection errors, {} other errors, {} retried, {} failed".format(
+                requests_made,
+                seconds,
+                rate,
+                self.counts["records"],
+                self.counts["not_found"],
+                self.counts["throttled"],
+                self.counts["server_errors"],
+                self.counts["connection_errors"],
+                self.counts["other_errors"],
+                self.counts["retries"],
+                self.counts["failed"],
+            )
+        )
+
+
+def get_retry_after(response: Optional[requests.Response]) -> float:
+    """Get a response's Retry-After header in seconds, whether it's given as seconds or as an HTTP date."""
+    if response is None:
+        return 0.0
+    retry_after = response.headers.get("Retry-After", "").strip()
+    if not retry_after:
+        return 0.0
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return 0.0
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+def get_backoff_delay(attempt: int, retry_after: float = 0.0) -> float:
+    """
+    Seconds to wait before trying again after the given (zero-based) failed attempt: exponential backoff with full
+    jitter, but never less than the server's Retry-After.
+    """
+    backoff = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+    return max(retry_after, random.uniform(0, backoff))
+
+
+_shared_rate_limiter: RateLimiter = RateLimiter()
+_key_rate_limiters: Dict[str, RateLimiter] = {}
+_key_rate_limiters_lock = threading.Lock()
+
+
+def get_shared_rate_limiter() -> RateLimiter:
+    """The limiter used by every WorldcatApiToken that isn't given its own."""
+    return _shared_rate_limiter
+
+
+def get_key_rate_limiter(api_key: str) -> RateLimiter:
+    """The limiter for one API key when requests are spread over several keys, at the shared limiter's full rate."""
+    with _key_rate_limiters_lock:
+        if api_key not in _key_rate_limiters:
+            _key_rate_limiters[api_key] = RateLimiter(_shared_rate_limiter.max_rate)
+        return _key_rate_limiters[api_key]
+
+
+def use_shared_rate_limiters(
+    shared_rate_limiter: RateLimiter, key_rate_limiters: Optional[Dict[str, RateLimiter]] = None
+) -> None:
+    """
+    Replace this process's shared limiter, and any per-key limiters, for instance with ProcessSharedRateLimiters made
+    by a parent process. Call before any WorldcatApiToken is created.
+    """
+    global _shared_rate_limiter
+    _shared_rate_limiter = shared_rate_limiter
+    with _key_rate_limiters_lock:
+        _key_rate_limiters.clear()
+        _key_rate_limiters.update(key_rate_limiters or {})
@@ -0,0 +1,99 @@
+"""
+Read gzipped (.gz) and zipped (.zip) input files as streams, without extracting them to disk.
+
+A .gz file holds one file, named by dropping the .gz. A .zip file has to hold exactly one file (folders aside), and
+that file's own name is used, since the name of the .zip may not end in the inner file's ending
+("TESTINST1.2021.10.02.zip" holding "TESTINST1.2021.10.02.mrk").
+
+Usage:
+
+    from crl_lib.compressed_files import open_input_file
+
+    with open_input_file("/path/to/file.tsv.gz", "r", encoding="utf-8", newline="") as fin:
+        [...]
+"""
+
+import io
+import os
+import gzip
+import zipfile
+from typing import BinaryIO, IO, Optional, Union
+
+
+COMPRESSED_FILE_ENDINGS = (".gz", ".zip")
+
+
+def is_compressed_file(file_location: Union[str, os.PathLike]) -> bool:
+    return os.fspath(file_location).lower().endswith(COMPRESSED_FILE_ENDINGS)
+
+
+def _get_zip_member(zip_file: zipfile.ZipFile) -> zipfile.ZipInfo:
+    members = [member for member in zip_file.infolist() if not member.is_dir()]
+    if len(members) != 1:
+        raise ValueError("{} holds {} files; it should hold one".format(zip_file.filename, len(members)))
+    return members[0]
+
+
+def get_uncompressed_name(file_location: Union[str, os.PathLike]) -> str:
+    """
+    Get the name of the file inside a compressed file, or the file's own name if it isn't compressed.
+
+    Args:
+        file_location (Union[str, os.PathLike]): The file, or just its name if it's a .gz file.
+
+    Returns:
+        str: The file name, without any folder.
+    """
+    file_name = os.path.basename(os.fspath(file_location))
+    if not is_compressed_file(file_name):
+        return file_name
+    stripped_name = os.path.splitext(file_name)[0]
+    if file_name.lower().endswith(".gz"):
+        return stripped_name
+    try:
+        with zipfile.ZipFile(file_location) as zip_file:
+            return os.path.basename(_get_zip_member(zip_file).filename)
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return stripped_name
+
+
+def open_compressed_file(file_location: Union[str, os.PathLike]) -> BinaryIO:
+    """
+    Open the file inside a .gz or .zip file for reading, decompressing it as it's read.
+
+    Raises:
+        ValueError: A .zip file doesn't hold exactly one file.
+    """
+    if os.fspath(file_location).lower().endswith(".gz"):
+        return gzip.open(file_location, "rb")
+    with zipfile.ZipFile(file_location) as zip_file:
+        # the member keeps the archive open until it's closed itself
+        return zip_file.open(_get_zip_member(zip_file))
+
+
+def open_input_file(
+    file_location: Union[str, os.PathLike],
+    mode: str = "rb",
+    encoding: Optional[str] = None,
+    newline: Optional[str] = None,
+) -> IO:
+    """
+    Open an input file for reading, whether or not it's compressed.
+
+    Args:
+        file_location (Union[str, os.PathLike]): The file.
+        mode (str, optional): "rb" for bytes, or "r" for text. Defaults to "rb".
+        encoding (Optional[str], optional): The text encoding, in text mode. Defaults to None.
+        newline (Optional[str], optional): As for open(), in text mode. Defaults to None.
+
+    Returns:
+        IO: The open file.
+    """
+    if not is_compressed_file(file_location):
+        if mode == "rb":
+            return open(file_location, "rb")
+        return open(file_location, mode, encoding=encoding, newline=newline)
+    binary_file = open_compressed_file(file_location)
+    if mode == "rb":
+        return binary_file
+    return io.TextIOWrapper(binary_file, encoding=encoding, newline=newline)
@@ -0,0 +1,214 @@
+"""
+Pick the text encoding of an input file once, from a sample, instead of trying encodings line by line or re-reading
+the whole file for each encoding.
+
+A file is taken as UTF-8 unless the sample has bytes that aren't UTF-8 and nothing that is, in which case it gets the
+fallback encoding (Latin-1 for MARC files, Windows-1252 for spreadsheets). Checking a whole file decodes it in large
+blocks, and only looks at single lines in a block that fails; those lines are reported with their byte offsets.
+
+Usage:
+
+    from crl_lib.encoding_sniffer import check_file_encoding
+
+    file_encoding = check_file_encoding("/path/to/file.txt", fallback_codec="cp1252")
+    for offset in file_encoding.mixed_line_offsets:
+        [...]
+"""
+
+import os
+from typing import BinaryIO, Iterator, List, NamedTuple, Tuple, Union
+
+from crl_lib.compressed_files import is_compressed_file, open_input_file
+
+
+SAMPLE_BLOCK_SIZE = 64 * 1024
+SAMPLE_BLOCK_COUNT = 8
+DECODE_BLOCK_SIZE = 1024 * 1024
+UTF8 = "utf-8"
+
+
+class FileEncoding(NamedTuple):
+    """
+    The encoding found for a file.
+
+    codec is the encoding for the file as a whole. mixed_line_offsets are the byte offsets of lines that can't be
+    decoded with it but can with the fallback encoding, and undecodable_line_offsets of lines that can't be decoded
+    with either.
+    """
+
+    codec: str
+    mixed_line_offsets: List[int]
+    undecodable_line_offsets: List[int]
+
+
+def read_sample(file_handle: BinaryIO, file_size: int) -> List[bytes]:
+    """
+    Read blocks from the start of a file and spread through the rest of it, leaving the file position where it was.
+
+    Args:
+        file_handle (BinaryIO): A seekable binary file.
+        file_size (int): The length of the file.
+
+    Returns:
+        List[bytes]: The sample blocks, cut to whole lines where a block starts or ends mid-file.
+    """
+    position = file_handle.tell()
+    if file_size <= SAMPLE_BLOCK_SIZE * SAMPLE_BLOCK_COUNT:
+        block_starts = [0]
+        block_size = file_size
+    else:
+        step = file_size // SAMPLE_BLOCK_COUNT
+        block_starts = [step * i for i in range(SAMPLE_BLOCK_COUNT)]
+        block_size = SAMPLE_BLOCK_SIZE
+    sample = []
+    for block_start in block_starts:
+        file_handle.seek(block_start)
+        block = file_handle.read(block_size)
+        if block_start > 0:
+            block = block[block.find(b"\n") + 1 :]
+        if block_start + block_size < file_size:
+            block = block[: block.rfind(b"\n") + 1]
+        sample.append(block)
+    file_handle.seek(position)
+    return sample
+
+
+def read_stream_sample(stream: BinaryIO) -> Tuple[bytes, List[bytes]]:
+    """
+    Read a sample from the start of a file that can't be sought in cheaply, such as a compressed one.
+
+    Args:
+        stream (BinaryIO): A binary file, read from its current position.
+
+    Returns:
+        Tuple[bytes, List[bytes]]: The bytes read, which the caller still has to use, and the sample, cut to whole
+            lines unless it's the whole file.
+    """
+    head = stream.read(SAMPLE_BLOCK_SIZE * SAMPLE_BLOCK_COUNT)
+    if len(head) < SAMPLE_BLOCK_SIZE * SAMPLE_BLOCK_COUNT:
+        return head, [head]
+    return head, [head[: head.rfind(b"\n") + 1]]
+
+
+def sniff_encoding(sample: List[bytes], fallback_codec: str) -> str:
+    """
+    Pick the encoding for a file from a sample of it.
+
+    Args:
+        sample (List[bytes]): Blocks of whole lines from the file, as from read_sample.
+        fallback_codec (str): The encoding to use if the sample isn't UTF-8.
+
+    Returns:
+        str: UTF8, or fallback_codec if the sample has lines that aren't UTF-8 and no non-ASCII lines that are.
+    """
+    found_non_utf8 = False
+    for block in sample:
+        if block.isascii():
+            continue
+        try:
+            block.decode(UTF8)
+            # a UTF-8 block with something other than ASCII in it: mixed at worst
+            return UTF8
+        except UnicodeDecodeError:
+            pass
+        for line in block.split(b"\n"):
+            if line.isascii():
+                continue
+            try:
+                line.decode(UTF8)
+                return UTF8
+            except UnicodeDecodeError:
+                found_non_utf8 = True
+    if found_non_utf8:
+        return fallback_codec
+    return UTF8
+
+
+def sniff_file_encoding(file_handle: BinaryIO, file_size: int, fallback_codec: str) -> str:
+    """Pick the encoding for an open binary file from a sample of it. See sniff_encoding."""
+    return sniff_encoding(read_sample(file_handle, file_size), fallback_codec)
+
+
+def _iter_line_blocks(file_handle: BinaryIO, remainder: bytes = b"") -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield (byte offset, block) for large blocks of whole lines from a binary file, read from its current position.
+    remainder is anything already read from the file, which comes first.
+    """
+    block_start = 0
+    while True:
+        data = file_handle.read(DECODE_BLOCK_SIZE)
+        block = remainder + data
+        if data:
+            # keep whole lines together, so a failing block can be checked line by line
+            line_end = block.rfind(b"\n") + 1
+            block, remainder = block[:line_end], block[line_end:]
+        yield block_start, block
+        block_start += len(block)
+        if not data:
+            return
+
+
+def _is_decodable(data: bytes, codec: str) -> bool:
+    try:
+        data.decode(codec)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def check_file_encoding(file_location: Union[str, os.PathLike], fallback_codec: str) -> FileEncoding:
+    """
+    Pick the encoding for a file from a sample, then decode the whole file with it in large blocks to find any lines
+    it doesn't fit. The file is read once for the sample and once to check it; a compressed file is read just once,
+    with the sample taken from its start.
+
+    Args:
+        file_location (Union[str, os.PathLike]): The file to check.
+        fallback_codec (str): The encoding to use if the file isn't UTF-8.
+
+    Returns:
+        FileEncoding: The encoding picked, and the offsets of the lines that don't fit it.
+    """
+    mixed_line_offsets: List[int] = []
+    undecodable_line_offsets: List[int] = []
+    with open_input_file(file_location) as fin:
+        remainder = b""
+        if is_compressed_file(file_location):
+            remainder, sample = read_stream_sample(fin)
+            codec = sniff_encoding(sample, fallback_codec)
+        else:
+            codec = sniff_file_encoding(fin, os.path.getsize(file_location), fallback_codec)
+        for block_start, block in _iter_line_blocks(fin, remainder):
+            if not _is_decodable(block, codec):
+                line_start = block_start
+                for line in block.split(b"\n"):
+                    if not _is_decodable(line, codec):
+                        if _is_decodable(line, fallback_codec):
+                            mixed_line_offsets.append(line_start)
+                        else:
+                            undecodable_line_offsets.append(line_start)
+                    line_start += len(line) + 1
+    return FileEncoding(codec, mixed_line_offsets, undecodable_line_offsets)
+
+
+def find_undecodable_lines(file_location: Union[str, os.PathLike], codec: str) -> List[int]:
+    """
+    Decode a whole file with one encoding, in large blocks, to find the lines it doesn't fit.
+
+    Args:
+        file_location (Union[str, os.PathLike]): The file to check.
+        codec (str): The encoding to check the file against.
+
+    Returns:
+        List[int]: The byte offsets of the lines that can't be decoded with codec.
+    """
+    undecodable_line_offsets: List[int] = []
+    with open_input_file(file_location) as fin:
+        for block_start, block in _iter_line_blocks(fin):
+            if not _is_decodable(block, codec):
+                line_start = block_start
+                for line in block.split(b"\n"):
+                    if not _is_decodable(line, codec):
+                        undecodable_line_offsets.append(line_start)
+                    line_start += len(line) + 1
+    return undecodable_line_offsets
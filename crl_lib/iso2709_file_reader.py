@@ -0,0 +1,301 @@
+"""
+Read binary MARC (ISO 2709, .mrc) files as MRK text, one record at a time.
+
+The file is memory-mapped and cut into records at the record terminator, and each record's leader and directory are
+decoded straight into MRK lines, without building pymarc Record objects. Records come out the way MarcFileReader gives
+them for the same records converted to MRK (as pymarc's str(record) would write them): one line per field, trailing
+whitespace removed, no final newline. Run this module on a file to compare its output with pymarc's.
+
+Usage:
+
+    from crl_lib.iso2709_file_reader import Iso2709FileReader
+
+    for record in Iso2709FileReader("/path/to/file.mrc"):
+        [...]
+"""
+
+import os
+import sys
+import mmap
+import logging
+import argparse
+from typing import Iterator, List, Optional, Tuple, Union
+
+import pymarc
+
+from crl_lib.compressed_files import is_compressed_file, open_compressed_file
+
+
+LEADER_LENGTH = 24
+DIRECTORY_ENTRY_LENGTH = 12
+END_OF_RECORD = b"\x1d"
+SUBFIELD_DELIMITER = b"\x1f"
+# exported files sometimes put line breaks or padding between records
+BETWEEN_RECORDS = b"\r\n \x00"
+# compressed files are decompressed this much at a time
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+
+class Iso2709RecordError(ValueError):
+    """A record's leader or directory can't be decoded."""
+
+
+def join_mrk_lines(lines: List[str]) -> str:
+    """Make a record string from MRK lines as MarcFileReader would read them: trailing whitespace and blank lines go."""
+    return "\n".join(line for line in (line.rstrip() for line in lines) if line)
+
+
+def _decode_field_data(data: bytes, utf8: bool) -> str:
+    if utf8:
+        try:
+            return data.decode("utf-8")
+        except UnicodeDecodeError:
+            # as MarcFileReader does with lines that aren't UTF-8
+            return data.decode("latin-1")
+    return pymarc.marc8_to_unicode(data, hide_utf8_warnings=True)
+
+
+def iso2709_to_mrk_lines(marc: bytes) -> List[str]:
+    """
+    Decode one ISO 2709 record into MRK lines, following pymarc's Record.decode_marc and str(record).
+
+    Args:
+        marc (bytes): The record, from the leader up to and including the record terminator.
+
+    Returns:
+        List[str]: The =LDR line followed by a line per field.
+
+    Raises:
+        Iso2709RecordError: The leader or directory is unreadable.
+    """
+    if len(marc) < LEADER_LENGTH:
+        raise Iso2709RecordError("Record shorter than a leader")
+    leader = marc[:LEADER_LENGTH].decode("latin-1")
+    utf8 = leader[9] == "a"
+    try:
+        base_address = int(leader[12:17])
+    except ValueError:
+        raise Iso2709RecordError("Invalid base address {!r}".format(leader[12:17]))
+    if base_address <= LEADER_LENGTH or base_address >= len(marc):
+        raise Iso2709RecordError("Base address {} out of range".format(base_address))
+    directory = marc[LEADER_LENGTH : base_address - 1]
+    if len(directory) % DIRECTORY_ENTRY_LENGTH != 0:
+        raise Iso2709RecordError("Directory length isn't a multiple of {}".format(DIRECTORY_ENTRY_LENGTH))
+
+    lines = ["=LDR  {}".format(leader)]
+    for entry_start in range(0, len(directory), DIRECTORY_ENTRY_LENGTH):
+        entry = directory[entry_start : entry_start + DIRECTORY_ENTRY_LENGTH]
+        tag = entry[:3].decode("latin-1")
+        try:
+            field_length = int(entry[3:7])
+            field_offset = int(entry[7:12])
+        except ValueError:
+            raise Iso2709RecordError("Invalid directory entry {!r}".format(entry))
+        field_start = base_address + field_offset
+        field_data = marc[field_start : field_start + field_length - 1]
+        if tag < "010" and tag.isdigit():
+            lines.append("={}  {}".format(tag, _decode_field_data(field_data, utf8).replace(" ", "\\")))
+            continue
+        subfields = field_data.split(SUBFIELD_DELIMITER)
+        indicators = subfields[0].decode("latin-1")[:2].ljust(2)
+        line_parts = ["={}  ".format(tag)]
+        for indicator in indicators:
+            line_parts.append("\\" if indicator in (" ", "\\") else indicator)
+        for subfield in subfields[1:]:
+            if not subfield:
+                continue
+            line_parts.append("$")
+            line_parts.append(subfield[:1].decode("latin-1"))
+            line_parts.append(_decode_field_data(subfield[1:], utf8))
+        lines.append("".join(line_parts))
+    return lines
+
+
+class Iso2709FileReader:
+    """
+    Iterator over the records in a binary MARC file, giving MRK strings, with the same interface as MarcFileReader.
+    Records that can't be decoded are logged with their byte offset and skipped.
+
+    Gzipped and zipped files are decompressed a block at a time instead of being memory-mapped. They can only be read
+    from start to end, as a single chunk, and eof is the size of the compressed file.
+    """
+
+    def __init__(self, marc_target: Union[str, os.PathLike]) -> None:
+        self.compressed = is_compressed_file(marc_target)
+        self.mmap: Optional[mmap.mmap] = None
+        if self.compressed:
+            self.file_handle = open_compressed_file(marc_target)
+            self.eof = os.path.getsize(marc_target)
+        else:
+            self.file_handle = open(marc_target, "rb")
+            self.file_handle.seek(0, 2)
+            self.eof = self.file_handle.tell()
+            self.file_handle.seek(0)
+            if self.eof:
+                self.mmap = mmap.mmap(self.file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.record = ""
+        self.record_offsets = (0, 0)
+        self.records_skipped = 0
+        self._records: Optional[Iterator[Tuple[int, int, str]]] = None
+        # a record read ahead by get_record, for compressed files
+        self._upcoming: Optional[Tuple[int, int, str]] = None
+        self.more_records = True
+
+    def __iter__(self) -> "Iso2709FileReader":
+        return self
+
+    def __next__(self) -> str:
+        if self._upcoming is not None:
+            (start, end, self.record), self._upcoming = self._upcoming, None
+            self.record_offsets = (start, end)
+            return self.record
+        if self._records is None:
+            if self.compressed:
+                self._records = self._iter_streamed_records()
+            else:
+                self._records = self.iter_records_in_range(0, self.eof)
+        try:
+            start, end, self.record = next(self._records)
+        except StopIteration:
+            self.close()
+            raise
+        self.record_offsets = (start, end)
+        return self.record
+
+    def get_record(self) -> str:
+        record = self.__next__()
+        if self.compressed:
+            # the end of a compressed file only shows once it's been read, so read ahead
+            self._upcoming = next(self._records, None)
+            if self._upcoming is None:
+                self.close()
+        elif self.mmap is None or self._skip_between_records(self.record_offsets[1], self.eof) >= self.eof:
+            self.more_records = False
+        return record
+
+    def close(self) -> None:
+        self.more_records = False
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        self.file_handle.close()
+
+    def iter_records_with_offsets(self) -> Iterator[Tuple[int, int, str]]:
+        for record in self:
+            yield self.record_offsets[0], self.record_offsets[1], record
+
+    def _skip_between_records(self, position: int, end: int, buffer: Optional[bytes] = None) -> int:
+        if buffer is None:
+            buffer = self.mmap
+        while position < end and buffer[position : position + 1] in BETWEEN_RECORDS:
+            position += 1
+        return position
+
+    def _decode_record(self, marc: bytes, record_start: int) -> Optional[str]:
+        try:
+            return join_mrk_lines(iso2709_to_mrk_lines(marc))
+        except Iso2709RecordError as e:
+            self.records_skipped += 1
+            logging.warning("Skipping unreadable MARC record at byte {}: {}".format(record_start, e))
+            return None
+
+    def _iter_streamed_records(self) -> Iterator[Tuple[int, int, str]]:
+        """Yield (start, end, record) for each record in a compressed file, decompressing it a block at a time."""
+        buffer = b""
+        buffer_start = 0
+        while True:
+            data = self.file_handle.read(STREAM_BLOCK_SIZE)
+            buffer = buffer + data
+            position = 0
+            while True:
+                position = self._skip_between_records(position, len(buffer), buffer)
+                terminator = buffer.find(END_OF_RECORD, position)
+                if terminator == -1:
+                    if data or position >= len(buffer):
+                        break
+                    # an unterminated record at the end of the file
+                    terminator = len(buffer) - 1
+                record = self._decode_record(buffer[position : terminator + 1], buffer_start + position)
+                if record is not None:
+                    yield buffer_start + position, buffer_start + terminator + 1, record
+                position = terminator + 1
+            if not data:
+                return
+            buffer = buffer[position:]
+            buffer_start += position
+
+    def iter_records_in_range(self, start: int, end: int) -> Iterator[Tuple[int, int, str]]:
+        """Yield (start, end, record) for the records between two byte offsets from get_chunk_offsets."""
+        if start >= end:
+            return
+        if self.compressed:
+            if (start, end) != (0, self.eof):
+                raise ValueError("Compressed MARC files can only be read as a whole")
+            yield from self._iter_streamed_records()
+            return
+        if self.mmap is None:
+            return
+        position = start
+        while True:
+            position = self._skip_between_records(position, end)
+            if position >= end:
+                return
+            terminator = self.mmap.find(END_OF_RECORD, position, end)
+            record_end = end if terminator == -1 else terminator + 1
+            record = self._decode_record(self.mmap[position:record_end], position)
+            if record is not None:
+                yield position, record_end, record
+            position = record_end
+
+    def get_chunk_offsets(self, chunk_count: int) -> List[Tuple[int, int]]:
+        """Split the file into up to chunk_count byte ranges of roughly the same size, cut after record terminators."""
+        if self.mmap is None or chunk_count <= 1:
+            return [(0, self.eof)]
+        boundaries = [0]
+        for i in range(1, chunk_count):
+            target = max(self.eof * i // chunk_count, boundaries[-1])
+            terminator = self.mmap.find(END_OF_RECORD, target)
+            if terminator == -1:
+                break
+            if boundaries[-1] < terminator + 1 < self.eof:
+                boundaries.append(terminator + 1)
+        boundaries.append(self.eof)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def check_against_pymarc(file_location: str) -> int:
+    """
+    Compare this module's records with pymarc's for a binary MARC file, printing any differences.
+
+    Returns:
+        int: The number of records that differ.
+    """
+    differences = 0
+    with open(file_location, "rb") as fh:
+        pymarc_records = [
+            None if record is None else join_mrk_lines(str(record).split("\n"))
+            for record in pymarc.MARCReader(fh, to_unicode=True, hide_utf8_warnings=True)
+        ]
+    records = list(Iso2709FileReader(file_location))
+    pymarc_records = [record for record in pymarc_records if record is not None]
+    for i, (expected, converted) in enumerate(zip(pymarc_records, records)):
+        if expected != converted:
+            differences += 1
+            print("Record {} differs:\npymarc: {!r}\nreader: {!r}".format(i + 1, expected, converted))
+    if len(pymarc_records) != len(records):
+        differences += 1
+        print("pymarc read {} records, this reader {}".format(len(pymarc_records), len(records)))
+    print("{} records compared, {} differences.".format(len(records), differences))
+    return differences
+
+
+def app() -> None:
+    parser = argparse.ArgumentParser(description="Compare the binary MARC reader's output with pymarc's.")
+    parser.add_argument("file", help="binary MARC (.mrc) file")
+    args = parser.parse_args()
+    if check_against_pymarc(args.file):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    app()
@@ -1,13 +1,136 @@
 import sqlite3
 import datetime
+import argparse
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+import weakref
+import zlib
 from pathlib import Path
 import typing
 
 from crl_lib import CRL_FOLDER
-from crl_lib.marc_fields import WorldCatMarcFields
+from crl_lib.marc_fields import MarcFieldsExtractor, WorldCatMarcFields
 
 
 MARC_DB_LOCATION = Path.joinpath(CRL_FOLDER, "marc_collection.db")
+# Older SQLite builds allow at most 999 variables in a single statement
+MAX_OCLCS_PER_QUERY = 500
+# What collect_data_for_marc_db takes from each record
+MARC_DB_DATA_EXTRACTOR = MarcFieldsExtractor(["oclc", "oclcs_019", "issn_a"], WorldCatMarcFields)
+# How long an OCLC that WorldCat reported as not found is trusted to stay that way
+NOT_FOUND_TTL_DAYS = 90
+# The day max_age_days before today. checked_date is a local date, and SQLite's 'now' is UTC.
+NOT_FOUND_CUTOFF_DATE_SQL = "DATE('now', 'localtime', ?)"
+# Schema version, kept in the database's user_version. See _migrate_schema.
+SCHEMA_VERSION = 2
+# Values of marc_records.marc_format, for how the MARC is stored
+MARC_FORMAT_TEXT = 0
+MARC_FORMAT_ZLIB = 1
+# Plain text, which other programs reading the database expect, unless recompress_marc has set the database to zlib
+DEFAULT_MARC_FORMAT = MARC_FORMAT_TEXT
+ZLIB_LEVEL = 6
+# Rows rewritten per commit by recompress_marc
+RECOMPRESS_BATCH_SIZE = 10000
+# Collected records are handed to the writer thread in batches of this size, or
+# after WRITE_COMMIT_SECONDS, and it commits on the same thresholds
+WRITE_BATCH_SIZE = 1000
+WRITE_COMMIT_SECONDS = 5
+# Batches waiting for the writer thread before collecting more blocks
+WRITE_QUEUE_MAX_BATCHES = 20
+# Connection settings. A negative cache_size is in KiB.
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+]
+
+
+class _MarcDbWriter(threading.Thread):
+    """
+    Background thread with its own connection to the MARC database, which runs
+    the batches of inserts and deletes put on write_queue in order.
+
+    A batch is a list of (SQL statement, parameter tuples) pairs. Putting a
+    threading.Event on the queue commits everything before it and then sets
+    the event; putting None commits and stops the thread. Otherwise the thread
+    commits once WRITE_BATCH_SIZE rows or WRITE_COMMIT_SECONDS have built up.
+
+    A database error is logged and kept in error for LocalMarcDb to raise, and
+    batches are dropped until it has been raised. If the database can't be
+    opened at all, connection_failed is set and every batch is dropped.
+    """
+
+    def __init__(self, marc_db_file_location: Path) -> None:
+        super().__init__(name="LocalMarcDbWriter", daemon=True)
+        self.marc_db_file_location = marc_db_file_location
+        self.write_queue: queue.Queue = queue.Queue(maxsize=WRITE_QUEUE_MAX_BATCHES)
+        self.error: typing.Optional[sqlite3.Error] = None
+        self.connection_failed = False
+
+    def run(self) -> None:
+        try:
+            conn = sqlite3.connect(self.marc_db_file_location, timeout=60)
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+        except sqlite3.Error as e:
+            logging.exception("Could not open the local MARC database for writing")
+            self.error = e
+            self.connection_failed = True
+            conn = None
+        uncommitted_rows = 0
+        last_commit = time.monotonic()
+        while True:
+            timeout = None
+            if uncommitted_rows:
+                timeout = max(0.0, WRITE_COMMIT_SECONDS - (time.monotonic() - last_commit))
+            try:
+                item = self.write_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = []
+            try:
+                if isinstance(item, list) and item and self.error is None and conn is not None:
+                    for statement, rows in item:
+                        conn.executemany(statement, rows)
+                        uncommitted_rows += len(rows)
+                if uncommitted_rows and (
+                    not isinstance(item, list)
+                    or uncommitted_rows >= WRITE_BATCH_SIZE
+                    or time.monotonic() - last_commit >= WRITE_COMMIT_SECONDS
+                ):
+                    conn.commit()
+                    uncommitted_rows = 0
+                    last_commit = time.monotonic()
+            except sqlite3.Error as e:
+                logging.exception("Could not write to the local MARC database")
+                self.error = e
+                conn.rollback()
+                uncommitted_rows = 0
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                break
+        if conn is not None:
+            conn.close()
+
+
+# Databases with writer threads still running, closed when the program exits
+_open_marc_dbs: "weakref.WeakSet[LocalMarcDb]" = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_marc_dbs() -> None:
+    """
+    Flush and close any databases left open. This also runs when the program
+    is stopped with Ctrl-C, since SIGINT raises KeyboardInterrupt.
+    """
+    for marc_db in list(_open_marc_dbs):
+        marc_db.close_marc_db()
 
 
 class LocalMarcDb:
@@ -36,9 +159,54 @@ class LocalMarcDb:
 
         db = LocalMarcDb("/path/to/file")
 
+    OCLC numbers that WorldCat reports as not found are kept in the
+    oclcs_not_found table with the date they were checked, so that they aren't
+    requested again until the result is older than a given number of days:
+
+        db.collect_oclc_not_found(oclc)
+        db.check_oclc_not_found(oclc, max_age_days=90)
+
+    Data extracted from a record can be saved in the worldcat_extracts table,
+    marked with a version string for the extraction logic, so that later runs
+    can skip parsing the MARC. Extracts are dropped when their record is
+    replaced, and ignored if their version doesn't match:
+
+        db.collect_extract_for_marc_db(oclc, extract_version, data_dict)
+        extracts = db.get_extracts_from_db_for_oclcs(oclcs, extract_version)
+
+    The database is opened in WAL mode with a larger page cache and memory
+    mapping. Update dates are also kept as YYYYMMDD integers in the indexed
+    updated_day column, which is what the recent_only lookups compare
+    against. This class fills it in on insert; a trigger does it for other
+    programs that share the database.
+
+    Collected data is written by a background thread with its own connection,
+    so collecting never waits on the disk unless the writer falls
+    WRITE_QUEUE_MAX_BATCHES batches behind. write_collected_data_to_marc_db
+    waits until everything collected so far is committed. Databases still open
+    when the program exits, including on Ctrl-C, are flushed and closed then.
+    Pass write_behind=False to write on the calling thread instead.
+
+    MARC records are stored as plain text by default, which other programs
+    reading the database directly expect. zlib compression is opt-in: convert
+    the existing rows with recompress_marc, which also records the format in
+    the database so later LocalMarcDb objects keep using it:
+
+        db = LocalMarcDb(marc_format=MARC_FORMAT_ZLIB)
+        db.recompress_marc()
+
+    The marc_format column says how each row is stored, so rows in either
+    format read. Anything reading a compressed database's marc column itself
+    has to decompress the rows with marc_format 1 (MARC_FORMAT_ZLIB).
+
     """
 
-    def __init__(self, data_folder: typing.Union[Path, str] = "") -> None:
+    def __init__(
+        self,
+        data_folder: typing.Union[Path, str] = "",
+        marc_format: typing.Optional[int] = None,
+        write_behind: bool = True,
+    ) -> None:
 
         if data_folder:
             data_folder = Path(data_folder)
@@ -48,42 +216,77 @@ class LocalMarcDb:
                 and not data_folder.name.endswith(".sqlite3")
             ):
                 marc_db_file_location = data_folder.joinpath("marc_collection.db")
+            else:
+                marc_db_file_location = data_folder
         else:
             marc_db_file_location = MARC_DB_LOCATION
 
         self.timestamp = self.make_year_month_day_timestamp()
+        self.timestamp_day = int(self.timestamp.replace("-", ""))
+        # "recent" records were updated less than a year ago
+        recent_cutoff_date = datetime.date.today() - datetime.timedelta(days=365)
+        self.recent_cutoff_day = int(recent_cutoff_date.strftime("%Y%m%d"))
         # default SQL commands
         self.marc_record_insert = (
-            "INSERT OR REPLACE INTO marc_records (oclc_number, issn, updated_date, marc) "
-            "VALUES (?, ?, ?, ?)"
+            "INSERT OR REPLACE INTO marc_records (oclc_number, issn, updated_date, updated_day, marc, marc_format) "
+            "VALUES (?, ?, ?, ?, ?, ?)"
         )
         self.oclc_number_insert = (
             "INSERT OR REPLACE INTO oclcs_019 (oclc_019, oclc_number) VALUES (?, ?)"
         )
         self.old_oclc_delete = "DELETE FROM marc_records WHERE oclc_number == ?"
+        self.not_found_insert = (
+            "INSERT OR REPLACE INTO oclcs_not_found (oclc_number, checked_date) VALUES (?, ?)"
+        )
+        self.not_found_delete = "DELETE FROM oclcs_not_found WHERE oclc_number == ?"
+        self.extract_insert = (
+            "INSERT OR REPLACE INTO worldcat_extracts (oclc_number, extract_version, extract) "
+            "VALUES (?, ?, ?)"
+        )
+        self.extract_delete = "DELETE FROM worldcat_extracts WHERE oclc_number == ?"
 
         # Default save data lists
-        self.marc_insert_data: typing.List[typing.Tuple[str, ...]] = []
+        self.marc_insert_data: typing.List[tuple] = []
         self.oclc_insert_data: typing.List[tuple] = []
         self.oclc_delete_data: typing.List[tuple] = []
+        self.not_found_insert_data: typing.List[tuple] = []
+        self.not_found_delete_data: typing.List[tuple] = []
+        self.extract_insert_data: typing.List[tuple] = []
+        self.extract_delete_data: typing.List[tuple] = []
+        self._last_hand_off = time.monotonic()
+        self._writer: typing.Optional[_MarcDbWriter] = None
 
         # open database, and create it if it doesn't already exist
+        # other processes may be writing to it at the same time, so wait for them as the writer thread does
         if marc_db_file_location.exists():
-            self.conn = sqlite3.connect(marc_db_file_location)
+            self.conn = sqlite3.connect(marc_db_file_location, timeout=60)
         else:
-            self.conn = sqlite3.connect(marc_db_file_location)
+            self.conn = sqlite3.connect(marc_db_file_location, timeout=60)
             self.create_local_marc_db()
         self.marc_db_file_location = marc_db_file_location
+        for pragma in CONNECTION_PRAGMAS:
+            self.conn.execute(pragma)
 
         self.main_table_has_issn_column = self._check_for_issn_column()
+        self._create_not_found_table()
+        self._create_extracts_table()
+        self._create_settings_table()
+        self._migrate_schema()
+        # the format set for this database by recompress_marc, unless one is asked for
+        if marc_format is None:
+            marc_format = self._get_stored_marc_format()
+        self.marc_format = marc_format
+
+        if write_behind is True:
+            self._writer = _MarcDbWriter(marc_db_file_location)
+            self._writer.start()
+            _open_marc_dbs.add(self)
 
     def __del__(self) -> None:
         """
         Destructor, to commit any unsaved changes to the MARC database and to
         close it gracefully.
         """
-        if self.marc_insert_data:
-            self._write_collected_data_to_marc_db()
         self.close_marc_db()
 
     @staticmethod
@@ -94,23 +297,74 @@ class LocalMarcDb:
         return timestamp
 
     def write_collected_data_to_marc_db(self) -> None:
+        """Write everything collected so far, and wait until it's committed."""
         self._write_collected_data_to_marc_db()
+        if self._writer is not None and self._writer.is_alive():
+            committed = threading.Event()
+            self._writer.write_queue.put(committed)
+            while not committed.wait(1) and self._writer.is_alive():
+                pass
+            self._check_writer()
 
     def _write_collected_data_to_marc_db(self) -> None:
-        if len(self.marc_insert_data) == 0:
+        """Hand the collected data to the writer thread, or write it here if there isn't one."""
+        self._last_hand_off = time.monotonic()
+        if (
+            len(self.marc_insert_data) == 0
+            and len(self.not_found_insert_data) == 0
+            and len(self.extract_insert_data) == 0
+        ):
             return
+        batch = [
+            (self.marc_record_insert, self.marc_insert_data),
+            (self.oclc_number_insert, self.oclc_insert_data),
+            (self.old_oclc_delete, self.oclc_delete_data),
+            (self.not_found_insert, self.not_found_insert_data),
+            # records found now override any earlier "not found" results
+            (self.not_found_delete, self.not_found_delete_data),
+            # extracts of replaced records are stale
+            (self.extract_delete, self.extract_delete_data),
+            (self.extract_insert, self.extract_insert_data),
+        ]
+        self._reset_save_lists()
+        if self._writer is not None:
+            self._check_writer()
+            if self._writer.is_alive() and not self._writer.connection_failed:
+                self._writer.write_queue.put(batch)
+                return
+            logging.warning("The local MARC database writer thread isn't running; writing to the database directly")
+            self._stop_writer()
         c = self.conn.cursor()
-        c.executemany(self.marc_record_insert, self.marc_insert_data)
-        c.executemany(self.oclc_number_insert, self.oclc_insert_data)
-        c.executemany(self.old_oclc_delete, self.oclc_delete_data)
+        for statement, rows in batch:
+            c.executemany(statement, rows)
         self.conn.commit()
-        self._reset_save_lists()
+
+    def _write_collected_data_if_due(self) -> None:
+        """Hand off the collected data once there's a batch of it, or it's been waiting a while."""
+        if (
+            len(self.marc_insert_data) > WRITE_BATCH_SIZE
+            or len(self.not_found_insert_data) > WRITE_BATCH_SIZE
+            or len(self.extract_insert_data) > WRITE_BATCH_SIZE
+            or time.monotonic() - self._last_hand_off >= WRITE_COMMIT_SECONDS
+        ):
+            self._write_collected_data_to_marc_db()
+
+    def _check_writer(self) -> None:
+        """Raise any database error from the writer thread here, where it can be handled."""
+        if self._writer is not None and self._writer.error is not None:
+            error = self._writer.error
+            self._writer.error = None
+            raise error
 
     def _reset_save_lists(self) -> None:
         """Zero out the save lists."""
         self.marc_insert_data = []
         self.oclc_insert_data = []
         self.oclc_delete_data = []
+        self.not_found_insert_data = []
+        self.not_found_delete_data = []
+        self.extract_insert_data = []
+        self.extract_delete_data = []
 
     def _check_for_issn_column(self) -> bool:
         """Old version of the database might not have a column for issns"""
@@ -122,17 +376,137 @@ class LocalMarcDb:
                 return True
 
         self.marc_record_insert = (
-            "INSERT OR REPLACE INTO marc_records (oclc_number, updated_date, marc) "
-            "VALUES (?, ?, ?)"
+            "INSERT OR REPLACE INTO marc_records (oclc_number, updated_date, updated_day, marc, marc_format) "
+            "VALUES (?, ?, ?, ?, ?)"
         )
         return False
 
+    def _create_not_found_table(self) -> None:
+        """Add the table of OCLCs not found in WorldCat. Older databases won't have it."""
+        create_not_found_table_sql = (
+            "CREATE TABLE IF NOT EXISTS oclcs_not_found (oclc_number INTEGER NOT NULL UNIQUE, "
+            "checked_date DATE, PRIMARY KEY (oclc_number));"
+        )
+        c = self.conn.cursor()
+        c.execute(create_not_found_table_sql)
+        self.conn.commit()
+
+    def _create_extracts_table(self) -> None:
+        """Add the table of data extracted from records. Older databases won't have it."""
+        create_extracts_table_sql = (
+            "CREATE TABLE IF NOT EXISTS worldcat_extracts (oclc_number INTEGER NOT NULL UNIQUE, "
+            "extract_version TEXT NOT NULL, extract TEXT NOT NULL, PRIMARY KEY (oclc_number));"
+        )
+        c = self.conn.cursor()
+        c.execute(create_extracts_table_sql)
+        self.conn.commit()
+
+    def _create_settings_table(self) -> None:
+        """Add the table of database-wide settings. Older databases won't have it."""
+        create_settings_table_sql = (
+            "CREATE TABLE IF NOT EXISTS marc_db_settings (setting TEXT NOT NULL UNIQUE, value, "
+            "PRIMARY KEY (setting));"
+        )
+        c = self.conn.cursor()
+        c.execute(create_settings_table_sql)
+        self.conn.commit()
+
+    def _get_stored_marc_format(self) -> int:
+        """Get the marc_format recorded for this database, or DEFAULT_MARC_FORMAT if none is."""
+        c = self.conn.cursor()
+        c.execute("SELECT value FROM marc_db_settings WHERE setting = 'marc_format'")
+        row = c.fetchone()
+        if row is None:
+            return DEFAULT_MARC_FORMAT
+        return int(row[0])
+
+    def _migrate_schema(self) -> None:
+        """
+        Bring an older database up to SCHEMA_VERSION.
+
+        Version 1 adds the updated_day column (the update date as a YYYYMMDD
+        integer), fills it in for existing records, adds a trigger to fill it
+        in for new ones, and indexes it and the not-found check dates.
+
+        Version 2 adds the marc_format column. Existing rows are plain text.
+        """
+        c = self.conn.cursor()
+        c.execute("PRAGMA user_version")
+        if c.fetchone()[0] >= SCHEMA_VERSION:
+            return
+        # take the write lock before checking again, in case another process is migrating at the same time
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("PRAGMA user_version")
+        if c.fetchone()[0] >= SCHEMA_VERSION:
+            self.conn.rollback()
+            return
+        c.execute("PRAGMA table_info(marc_records)")
+        marc_records_columns = {pragma_tuple[1] for pragma_tuple in c.fetchall()}
+        if "updated_day" not in marc_records_columns:
+            logging.info("Updating the local MARC database. This can take a while for a large database.")
+            c.execute("ALTER TABLE marc_records ADD COLUMN updated_day INTEGER")
+            c.execute(
+                "UPDATE marc_records SET updated_day = CAST(REPLACE(updated_date, '-', '') AS INTEGER)"
+            )
+        # other programs share this database and don't know about updated_day, so fill it in for their inserts
+        c.execute(
+            "CREATE TRIGGER IF NOT EXISTS marc_records_updated_day AFTER INSERT ON marc_records "
+            "WHEN NEW.updated_day IS NULL BEGIN "
+            "UPDATE marc_records SET updated_day = CAST(REPLACE(NEW.updated_date, '-', '') AS INTEGER) "
+            "WHERE oclc_number = NEW.oclc_number; END"
+        )
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS marc_records_updated_day_index ON marc_records (updated_day)"
+        )
+        c.execute(
+            "CREATE INDEX IF NOT EXISTS oclcs_not_found_checked_date_index ON oclcs_not_found (checked_date)"
+        )
+        if "marc_format" not in marc_records_columns:
+            c.execute(
+                "ALTER TABLE marc_records ADD COLUMN marc_format INTEGER NOT NULL DEFAULT {}".format(
+                    MARC_FORMAT_TEXT
+                )
+            )
+        c.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+        self.conn.commit()
+
+    def _stop_writer(self) -> None:
+        """Commit what the writer thread has been handed, and stop it."""
+        writer = self._writer
+        self._writer = None
+        _open_marc_dbs.discard(self)
+        # a thread that has died would never take None off the queue
+        if writer is not None and writer.is_alive():
+            writer.write_queue.put(None)
+            writer.join()
+
     def close_marc_db(self) -> None:
+        if getattr(self, "_writer", None) is not None:
+            try:
+                self._write_collected_data_to_marc_db()
+            finally:
+                self._stop_writer()
         try:
+            # let SQLite refresh its query planner statistics if they need it
+            self.conn.execute("PRAGMA optimize")
             self.conn.close()
-        except AttributeError:
+        except (AttributeError, sqlite3.Error):
             pass
 
+    @staticmethod
+    def _encode_marc(marc: str, marc_format: int) -> typing.Union[str, bytes]:
+        """Get a MARC record in the form it's stored in for the given marc_format."""
+        if marc_format == MARC_FORMAT_ZLIB:
+            return zlib.compress(marc.encode("utf-8"), ZLIB_LEVEL)
+        return marc
+
+    @staticmethod
+    def _decode_marc(stored_marc: typing.Union[str, bytes], marc_format: int) -> str:
+        """Get a MARC record back out of the form it was stored in."""
+        if marc_format == MARC_FORMAT_ZLIB:
+            return zlib.decompress(stored_marc).decode("utf-8")
+        return stored_marc
+
     @staticmethod
     def _check_oclc(oclc: typing.Union[int, str]) -> str:
         if not oclc:
@@ -148,11 +522,12 @@ class LocalMarcDb:
         one for data storage.
         """
         create_marc_records_table_sql = (
-            'CREATE TABLE "marc_records" (oclc_number INTEGER UNIQUE, issn TEXT, '
-            "updated_date DATE, marc TEXT NOT NULL, PRIMARY KEY (oclc_number));"
+            'CREATE TABLE IF NOT EXISTS "marc_records" (oclc_number INTEGER UNIQUE, issn TEXT, '
+            "updated_date DATE, marc TEXT NOT NULL, updated_day INTEGER, marc_format INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (oclc_number));"
         )
         create_oclcs_019_table_sql = (
-            "CREATE TABLE oclcs_019 (oclc_019 INTEGER NOT NULL UNIQUE, oclc_number INTEGER "
+            "CREATE TABLE IF NOT EXISTS oclcs_019 (oclc_019 INTEGER NOT NULL UNIQUE, oclc_number INTEGER "
             "NOT NULL, PRIMARY KEY (oclc_019));"
         )
         c = self.conn.cursor()
@@ -178,20 +553,62 @@ class LocalMarcDb:
             return ""
         if recent_only is True:
             statement = (
-                "SELECT marc FROM marc_records JOIN oclcs_019 USING (oclc_number) WHERE oclc_019 = ? AND "
-                "DATE('now', '-1 year') < updated_date"
+                "SELECT marc, marc_format FROM marc_records JOIN oclcs_019 USING (oclc_number) "
+                "WHERE oclc_019 = ? AND updated_day > ?"
             )
+            t: tuple = (oclc_str, self.recent_cutoff_day)
         else:
-            statement = "SELECT marc FROM marc_records JOIN oclcs_019 USING (oclc_number) WHERE oclc_019 = ?"
-        t = (oclc_str,)
+            statement = (
+                "SELECT marc, marc_format FROM marc_records JOIN oclcs_019 USING (oclc_number) WHERE oclc_019 = ?"
+            )
+            t = (oclc_str,)
         c = self.conn.cursor()
         c.execute(statement, t)
         try:
             c_tuple = c.fetchone()
-            return c_tuple[0]
+            return self._decode_marc(c_tuple[0], c_tuple[1])
         except TypeError:
             return ""
 
+    def get_marc_from_db_for_oclcs(
+        self, oclcs: typing.Iterable[typing.Union[str, int]], recent_only: bool = False
+    ) -> typing.Dict[str, str]:
+        """
+        Look up many OCLC numbers at once, a few hundred per query, rather than
+        calling get_marc_from_db for each one.
+
+        Returns a dict of MARC records keyed by the OCLC numbers as given (as
+        strings). OCLCs not in the database are left out of the dict.
+        """
+        # the database stores integers, so "00123" comes back as 123
+        wanted_oclcs: typing.Dict[int, typing.List[str]] = {}
+        for oclc in oclcs:
+            oclc_str = self._check_oclc(oclc)
+            if oclc_str:
+                wanted_oclcs.setdefault(int(oclc_str), []).append(oclc_str)
+
+        statement = (
+            "SELECT oclc_019, marc, marc_format FROM marc_records JOIN oclcs_019 USING (oclc_number) "
+            "WHERE oclc_019 IN ({})"
+        )
+        extra_parameters: typing.List[int] = []
+        if recent_only is True:
+            statement += " AND updated_day > ?"
+            extra_parameters.append(self.recent_cutoff_day)
+
+        marc_records: typing.Dict[str, str] = {}
+        oclc_ints = list(wanted_oclcs)
+        c = self.conn.cursor()
+        for i in range(0, len(oclc_ints), MAX_OCLCS_PER_QUERY):
+            oclc_chunk = oclc_ints[i : i + MAX_OCLCS_PER_QUERY]
+            placeholders = ", ".join("?" for _ in oclc_chunk)
+            c.execute(statement.format(placeholders), oclc_chunk + extra_parameters)
+            for oclc_019, stored_marc, marc_format in c.fetchall():
+                marc = self._decode_marc(stored_marc, marc_format)
+                for oclc_str in wanted_oclcs[oclc_019]:
+                    marc_records[oclc_str] = marc
+        return marc_records
+
     def collect_data_for_marc_db(self, marc: typing.Union[str, list]) -> None:
         """
         Data collector, generally to be invoked via a fetcher like that in the
@@ -213,31 +630,221 @@ class LocalMarcDb:
             marc_list = [marc]
         for marc_record in marc_list:
             assert isinstance(marc_record, str)
-            mf = WorldCatMarcFields(marc_record)
-            oclc = mf.oclc
-            old_oclcs = mf.oclcs_019
-            issn = mf.issn_a
+            mf = WorldCatMarcFields(marc_record, lazy=True)
+            marc_db_data = MARC_DB_DATA_EXTRACTOR.extract(mf)
+            oclc = marc_db_data["oclc"]
+            old_oclcs = marc_db_data["oclcs_019"]
+            issn = marc_db_data["issn_a"]
+            stored_marc = self._encode_marc(marc_record, self.marc_format)
 
             if self.main_table_has_issn_column is True:
                 marc_insert_data_tuple_with_issn = (
                     oclc,
                     issn,
                     self.timestamp,
-                    marc_record,
+                    self.timestamp_day,
+                    stored_marc,
+                    self.marc_format,
                 )
                 self.marc_insert_data.append(marc_insert_data_tuple_with_issn)
             else:
-                marc_insert_data_tuple = (oclc, self.timestamp, marc_record)
+                marc_insert_data_tuple = (oclc, self.timestamp, self.timestamp_day, stored_marc, self.marc_format)
                 self.marc_insert_data.append(marc_insert_data_tuple)
 
             self.oclc_insert_data.append((oclc, oclc))
+            self.not_found_delete_data.append((oclc,))
+            self.extract_delete_data.append((oclc,))
             for old_oclc in old_oclcs:
                 self.oclc_insert_data.append((old_oclc, oclc))
                 self.oclc_delete_data.append((old_oclc,))
+                self.not_found_delete_data.append((old_oclc,))
 
-        if len(self.marc_insert_data) > 1000:
-            self._write_collected_data_to_marc_db()
-            self._reset_save_lists()
+        self._write_collected_data_if_due()
+
+    def get_extracts_from_db_for_oclcs(
+        self,
+        oclcs: typing.Iterable[typing.Union[str, int]],
+        extract_version: str,
+        recent_only: bool = False,
+    ) -> typing.Dict[str, dict]:
+        """
+        Get saved extracts for many OCLC numbers at once. Only extracts made by
+        extract_version are returned, and with recent_only only those of
+        records less than a year old.
+
+        Returns a dict of extract dicts keyed by the OCLC numbers as given (as
+        strings). OCLCs without a current extract are left out of the dict.
+        """
+        wanted_oclcs: typing.Dict[int, typing.List[str]] = {}
+        for oclc in oclcs:
+            oclc_str = self._check_oclc(oclc)
+            if oclc_str:
+                wanted_oclcs.setdefault(int(oclc_str), []).append(oclc_str)
+
+        statement = (
+            "SELECT oclc_019, extract FROM worldcat_extracts JOIN oclcs_019 USING (oclc_number) "
+            "JOIN marc_records USING (oclc_number) WHERE oclc_019 IN ({}) AND extract_version = ?"
+        )
+        extra_parameters: typing.List[typing.Union[str, int]] = [extract_version]
+        if recent_only is True:
+            statement += " AND updated_day > ?"
+            extra_parameters.append(self.recent_cutoff_day)
+
+        extracts: typing.Dict[str, dict] = {}
+        oclc_ints = list(wanted_oclcs)
+        c = self.conn.cursor()
+        for i in range(0, len(oclc_ints), MAX_OCLCS_PER_QUERY):
+            oclc_chunk = oclc_ints[i : i + MAX_OCLCS_PER_QUERY]
+            placeholders = ", ".join("?" for _ in oclc_chunk)
+            c.execute(statement.format(placeholders), oclc_chunk + extra_parameters)
+            for oclc_019, extract_json in c.fetchall():
+                extract = json.loads(extract_json)
+                for oclc_str in wanted_oclcs[oclc_019]:
+                    extracts[oclc_str] = extract
+        return extracts
+
+    def collect_extract_for_marc_db(
+        self, oclc: typing.Union[str, int], extract_version: str, extract: dict
+    ) -> None:
+        """
+        Save data extracted from the record for an OCLC number (the record's own
+        OCLC, not a 019). Saved along with the collected MARC records.
+        """
+        oclc_str = self._check_oclc(oclc)
+        if not oclc_str:
+            return
+        self.extract_insert_data.append((oclc_str, extract_version, json.dumps(extract)))
+        self._write_collected_data_if_due()
+
+    def collect_oclc_not_found(self, oclc: typing.Union[str, int]) -> None:
+        """
+        Record that WorldCat has no record for an OCLC number. Saved along with
+        the collected MARC records.
+        """
+        oclc_str = self._check_oclc(oclc)
+        if not oclc_str:
+            return
+        self.not_found_insert_data.append((oclc_str, self.timestamp))
+        self._write_collected_data_if_due()
+
+    def get_oclcs_not_found(
+        self,
+        oclcs: typing.Iterable[typing.Union[str, int]],
+        max_age_days: int = NOT_FOUND_TTL_DAYS,
+    ) -> typing.Set[str]:
+        """
+        Find which of a group of OCLC numbers were reported as not found in
+        WorldCat within the last max_age_days days. Returns the OCLCs as given,
+        as strings. A max_age_days of 0 turns the check off.
+        """
+        if max_age_days <= 0:
+            return set()
+        wanted_oclcs: typing.Dict[int, typing.List[str]] = {}
+        for oclc in oclcs:
+            oclc_str = self._check_oclc(oclc)
+            if oclc_str:
+                wanted_oclcs.setdefault(int(oclc_str), []).append(oclc_str)
+
+        statement = (
+            "SELECT oclc_number FROM oclcs_not_found WHERE oclc_number IN ({}) "
+            "AND checked_date > " + NOT_FOUND_CUTOFF_DATE_SQL
+        )
+        age_modifier = "-{} days".format(int(max_age_days))
+        oclcs_not_found: typing.Set[str] = set()
+        oclc_ints = list(wanted_oclcs)
+        c = self.conn.cursor()
+        for i in range(0, len(oclc_ints), MAX_OCLCS_PER_QUERY):
+            oclc_chunk = oclc_ints[i : i + MAX_OCLCS_PER_QUERY]
+            placeholders = ", ".join("?" for _ in oclc_chunk)
+            c.execute(statement.format(placeholders), oclc_chunk + [age_modifier])
+            for (oclc_number,) in c.fetchall():
+                oclcs_not_found.update(wanted_oclcs[oclc_number])
+        return oclcs_not_found
+
+    def check_oclc_not_found(
+        self, oclc: typing.Union[str, int], max_age_days: int = NOT_FOUND_TTL_DAYS
+    ) -> bool:
+        """Check a single OCLC against the not-found results."""
+        return bool(self.get_oclcs_not_found([oclc], max_age_days))
+
+    def get_not_found_summary(self) -> typing.List[typing.Tuple[str, int]]:
+        """Count of not-found OCLCs for each date they were checked, oldest first."""
+        c = self.conn.cursor()
+        c.execute(
+            "SELECT checked_date, COUNT(*) FROM oclcs_not_found GROUP BY checked_date "
+            "ORDER BY checked_date"
+        )
+        return c.fetchall()
+
+    def get_all_oclcs_not_found(self) -> typing.List[typing.Tuple[int, str]]:
+        """Every not-found OCLC with the date it was checked."""
+        c = self.conn.cursor()
+        c.execute(
+            "SELECT oclc_number, checked_date FROM oclcs_not_found ORDER BY oclc_number"
+        )
+        return c.fetchall()
+
+    def purge_oclcs_not_found(self, older_than_days: int = 0) -> int:
+        """
+        Delete not-found results, so the OCLCs will be requested from WorldCat
+        again. With older_than_days set, only older results are deleted.
+        Returns the number of OCLCs removed.
+        """
+        # results still with the writer thread would come back after the purge
+        self.write_collected_data_to_marc_db()
+        c = self.conn.cursor()
+        if older_than_days > 0:
+            age_modifier = "-{} days".format(int(older_than_days))
+            c.execute(
+                "DELETE FROM oclcs_not_found WHERE checked_date <= " + NOT_FOUND_CUTOFF_DATE_SQL,
+                (age_modifier,),
+            )
+        else:
+            c.execute("DELETE FROM oclcs_not_found")
+        self.conn.commit()
+        return c.rowcount
+
+    def recompress_marc(self, vacuum: bool = True) -> int:
+        """
+        Rewrite every MARC record not already stored in this database's
+        marc_format, a batch at a time, then VACUUM the file to give the freed
+        space back to the filesystem. The format is recorded in the database
+        first, so records saved from then on are stored the same way.
+
+        Returns the number of records rewritten.
+        """
+        self.write_collected_data_to_marc_db()
+        c = self.conn.cursor()
+        c.execute(
+            "INSERT OR REPLACE INTO marc_db_settings (setting, value) VALUES ('marc_format', ?)",
+            (self.marc_format,),
+        )
+        self.conn.commit()
+        rewritten = 0
+        last_oclc = -1
+        while True:
+            c.execute(
+                "SELECT oclc_number, marc, marc_format FROM marc_records WHERE oclc_number > ? "
+                "ORDER BY oclc_number LIMIT ?",
+                (last_oclc, RECOMPRESS_BATCH_SIZE),
+            )
+            rows = c.fetchall()
+            if not rows:
+                break
+            last_oclc = rows[-1][0]
+            update_data = [
+                (self._encode_marc(self._decode_marc(stored_marc, marc_format), self.marc_format), self.marc_format, oclc)
+                for oclc, stored_marc, marc_format in rows
+                if marc_format != self.marc_format
+            ]
+            c.executemany("UPDATE marc_records SET marc = ?, marc_format = ? WHERE oclc_number = ?", update_data)
+            self.conn.commit()
+            rewritten += len(update_data)
+        if vacuum:
+            self.conn.execute("VACUUM")
+            # in WAL mode the file only shrinks once the log is checkpointed
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return rewritten
 
 
 def marc_from_db_full(oclc: str, recent_only: bool = False) -> str:
@@ -245,3 +852,58 @@ def marc_from_db_full(oclc: str, recent_only: bool = False) -> str:
     db = LocalMarcDb()
     marc = db.get_marc_from_db(oclc, recent_only)
     return marc
+
+
+def parse_command_line_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Inspect or purge the OCLCs the local MARC database has recorded as not found in WorldCat, "
+            "or recompress the stored MARC."
+        )
+    )
+    parser.add_argument("--db", type=str, default="", help="location of the MARC database or its folder")
+    parser.add_argument("--list", "-l", action="store_true", help="list every not-found OCLC")
+    parser.add_argument("--purge", "-p", action="store_true", help="delete not-found results")
+    parser.add_argument(
+        "--older_than", type=int, default=0, help="with --purge, only delete results older than this many days"
+    )
+    parser.add_argument(
+        "--recompress", action="store_true", help="compress all stored MARC records, and those saved later, then vacuum the database"
+    )
+    parser.add_argument(
+        "--decompress", action="store_true", help="store all MARC records as plain text again, then vacuum the database"
+    )
+    return parser.parse_args()
+
+
+def app() -> None:
+    """
+    Print a summary of the not-found OCLCs, list them, purge them, or
+    recompress the stored MARC.
+    """
+    args = parse_command_line_arguments()
+    if args.recompress or args.decompress:
+        marc_format = MARC_FORMAT_TEXT if args.decompress else MARC_FORMAT_ZLIB
+        db = LocalMarcDb(args.db, marc_format=marc_format)
+        size_before = db.marc_db_file_location.stat().st_size
+        rewritten = db.recompress_marc()
+        size_after = db.marc_db_file_location.stat().st_size
+        print("Rewrote {} MARC records. Database size {:,} -> {:,} bytes.".format(rewritten, size_before, size_after))
+        return
+    db = LocalMarcDb(args.db)
+    if args.purge:
+        removed = db.purge_oclcs_not_found(args.older_than)
+        print("Removed {} OCLCs from the not-found list.".format(removed))
+    elif args.list:
+        for oclc_number, checked_date in db.get_all_oclcs_not_found():
+            print("{}\t{}".format(oclc_number, checked_date))
+    else:
+        total = 0
+        for checked_date, count in db.get_not_found_summary():
+            print("{}\t{}".format(checked_date, count))
+            total += count
+        print("{} OCLCs recorded as not found in WorldCat.".format(total))
+
+
+if __name__ == "__main__":
+    app()
@@ -21,10 +21,26 @@ Basic usage:
     bib_no = crl_mf.bib_no
     update_date = crl_mf.bib_no
 
-The module works by first converting the MARC record to a dict, then querying the dict. To show the entire dict:
+The module works by first converting the MARC record to a dict of its fields, then querying the dict. To show the
+entire dict:
 
     print(mf.marc_dict)
 
+Control fields (LDR and 001 to 009) are kept as strings, other fields as MarcField objects.
+
+Code that only wants a few fields from each record can skip decoding the rest:
+
+    mf = MarcFields(marc_record_as_text_string, lazy=True)
+
+A lazy object only sorts the record's lines by tag up front, and decodes the lines of a tag the first time anything
+looks that tag up.
+
+To take the same categories of data from many records, look the getters up once with a MarcFieldsExtractor:
+
+    extractor = MarcFieldsExtractor(['issn', 'title', 'bib_lvl'], stringify=True)
+    for marc_record in marc_records:
+        data = extractor.extract(MarcFields(marc_record))
+
 """
 
 
@@ -40,6 +56,17 @@ from crl_lib.year_utilities import find_years_first_last
 from crl_lib.marc_codes import language_codes, country_codes, check_for_valid_lc_class
 from crl_lib.marc_utilities import get_field_subfield, get_fields_subfields
 
+# Version of the data extraction logic. Bump this whenever a change to the getters alters what they return, so that
+# data extracted by an earlier version and saved elsewhere (like the local MARC database) is recognized as stale.
+MARC_FIELDS_VERSION = 1
+
+# What check_and_clean_record repairs. Each repair is only made if the record needs it, so a clean record is only
+# scanned, not rebuilt.
+BLANK_LINES_REGEX = re.compile(r"\n\n+")
+SUBFIELD_SPACES_REGEX = re.compile(r"(\$.) +")
+# common errors that can cause issues with OCLC numbers, fixed in this order
+OCLC_PREFIX_ERRORS = ["a (OCoLC)", "(OCoLC)(OCoLC)", "(OCoCLC)", "(OCoCL)", "(OCoLCO"]
+
 # TODO:
 #   ADD COVERAGE OF 006?
 #   ADD COVERAGE OF 007?
@@ -50,6 +77,65 @@ from crl_lib.marc_utilities import get_field_subfield, get_fields_subfields
 #     examples of multiple 050 lines.
 
 
+class MarcField:
+    """
+    A variable (010 and up) field of a MARC record: its indicators, and its subfields as a string of their codes with
+    a tuple of their data, both in record order. Much smaller, and quicker to build, than a dict per field holding a
+    dict of lists of subfields.
+    """
+
+    __slots__ = ('ind1', 'ind2', 'codes', 'values')
+
+    def __init__(self, ind1, ind2, codes, values):
+        self.ind1 = ind1
+        self.ind2 = ind2
+        self.codes = codes
+        self.values = values
+
+    def __iter__(self):
+        """(subfield code, subfield data) for each subfield in the field."""
+        return zip(self.codes, self.values)
+
+    def __repr__(self):
+        return 'MarcField({!r}, {!r}, {!r}, {!r})'.format(self.ind1, self.ind2, self.codes, self.values)
+
+    def get_subfields(self, subfield):
+        """The data of every occurrence of a subfield in the field, in record order."""
+        if subfield not in self.codes:
+            return []
+        return [value for code, value in zip(self.codes, self.values) if code == subfield]
+
+
+class LazyMarcDict(dict):
+    """
+    The marc_dict of a lazy MarcFields object: a dict of tag to fields, as for an eager one, that holds each tag's
+    lines undecoded until the tag is first looked up. Like the defaultdict it stands in for, looking up a tag the
+    record doesn't have adds it with an empty list.
+    """
+
+    def __init__(self, field_lines, decode_field):
+        super().__init__()
+        self._field_lines = field_lines
+        self._decode_field = decode_field
+
+    def __missing__(self, field):
+        self[field] = [self._decode_field(field, line) for line in self._field_lines.pop(field, [])]
+        return self[field]
+
+    def __contains__(self, field):
+        return dict.__contains__(self, field) or field in self._field_lines
+
+    def get(self, field, default=None):
+        if field in self:
+            return self[field]
+        return default
+
+    def __repr__(self):
+        for field in list(self._field_lines):
+            self[field]
+        return dict.__repr__(self)
+
+
 class MarcFields:
     """"
     Class for extracting data from MARC records.
@@ -102,7 +188,7 @@ class MarcFields:
     non_repeatable_fields = {'LDR', '001'}
     main_entry_fields = ["100", "110", "111", "130"]
 
-    def __init__(self, record, record_origin=None, log_warnings=False, debug_info=''):
+    def __init__(self, record, record_origin=None, log_warnings=False, debug_info='', lazy=False):
         """
         rather than set all vars at start, we dynamically search them when called for;
         i.e., calling for 'form' causes library to process everything in the 008 line
@@ -110,7 +196,11 @@ class MarcFields:
         debug_info is a string that will be added to any logging outputs, that might be useful for identifying the 
         source of the MARC record in question, or some other piece of useful information. Something like "from local
         catalog" might be an appropriate string.
+
+        lazy leaves each field undecoded until something looks it up. Warnings about a field's subfields are then only
+        added to warnings_list as the field is decoded, after the object has logged any others.
         """
+        self.lazy = lazy
         self.log_warnings = log_warnings
         if debug_info:
             debug_info = ' {}'.format(debug_info)
@@ -160,16 +250,18 @@ class MarcFields:
             Exception("Record without LDR sent to MarcFields object.")
         if "\n" not in record:
             return
-        # regexes require "\n"
-        record = re.sub(r"\r\n*", "\n", record)
-        record = re.sub(r"\r", "\n", record)
-        record = re.sub(r"\n\n+", "\n", record)
+        # regexes require "\n"; any run of line endings and blank lines becomes one
+        if "\r" in record:
+            record = record.replace("\r", "\n")
+        if "\n\n" in record:
+            record = BLANK_LINES_REGEX.sub("\n", record)
         # remove empty spaces after subfields
-        record = re.sub(r"(\$.) +", r"\1", record)
-        # common errors that can cause issues with OCLC numbers
-        oclc_errors = ["a (OCoLC)", "(OCoLC)(OCoLC)", "(OCoCLC)", "(OCoCL)", "(OCoLCO"]
-        for oclc_error in oclc_errors:
-            record = record.replace(oclc_error, "(OCoLC)")
+        if SUBFIELD_SPACES_REGEX.search(record):
+            record = SUBFIELD_SPACES_REGEX.sub(r"\1", record)
+        if "(OCo" in record:
+            for oclc_error in OCLC_PREFIX_ERRORS:
+                if oclc_error in record:
+                    record = record.replace(oclc_error, "(OCoLC)")
         return record
 
     def convert_mrk_to_dicts(self):
@@ -177,6 +269,8 @@ class MarcFields:
         Convert the record to a dict, to extract data from. 
         """
         pymarc_dict = {'leader': '', 'fields': []}
+        # for a lazy object, the lines of each tag, to decode when wanted
+        field_lines = defaultdict(list)
         marc_list = self.marc.split('\n')
         for line in marc_list:
             line = line.rstrip()
@@ -188,58 +282,70 @@ class MarcFields:
                 continue
 
             try:
-                if field == 'LDR' or int(field) < 10:
-                    field_data = line[6:]
-                    self.marc_dict[field].append(field_data)                  
-                    continue
+                if field != 'LDR':
+                    int(field)
             except (TypeError, ValueError):
                 self.warnings_list.append('Invalid field {} in MARC passed to MarcFields object.'.format(field))
                 continue
+            if self.lazy:
+                field_lines[field].append(line)
+            else:
+                self.marc_dict[field].append(self.decode_field(field, line))
 
-            ind1 = line[6]
-            ind2 = line[7]
-            self.marc_dict[field].append({'ind1': ind1, 'ind2': ind2, 'subfields': {}})
-            if field == '040':
-                # 040 (cataloging source) line may have double dollar signs due to OCLC codes like "CQ$."
-                line = line.replace('$$', r'{dollar}$')
-                # Similar issue if last OCLC code ends with a dollar sign.
-                if line.endswith('$'):
-                    line = line[:-1] + r'{dollar}'
-            try:
-                if line[8] == '$':
-                    field_list = line[9:].split('$')
-                else:
-                    field_list = line[8:].split('$')
-                    self.warnings_list.append('No subfield indicator at start of MARC line {}'.format(line))
-            except IndexError:
-                print(f'ERROR FIELD {field}')
-                print(self.marc)
-            for subfield_data in field_list:
-                try:
-                    subfield = subfield_data[0]
-                except IndexError:
-                    self.warnings_list.append(
-                        'Subfield with no data in line {}, probably an extra $ or $ at end of line'.format(field))
-                    continue
-                subfield_content = subfield_data[1:]
-                self.marc_dict[field][-1]['subfields'].setdefault(subfield, [])
-                self.marc_dict[field][-1]['subfields'][subfield].append(subfield_content)
-                if field == '245':
-                    self.marc_dict['title_line'].append((subfield, subfield_content))                   
-
+        if self.lazy:
+            self.marc_dict = LazyMarcDict(field_lines, self.decode_field)
+            fields_by_tag = field_lines
+        else:
+            fields_by_tag = self.marc_dict
         # Check for illegally duplicated subfields. Right now only looking at a few minimal fields.
         for field in self.non_repeatable_fields:
-            if len(self.marc_dict[field]) > 1:
+            if len(fields_by_tag.get(field, [])) > 1:
                 self.warnings_list.append('Illegally repeated field {} in MARC record'.format(field))
 
+    def decode_field(self, field, line):
+        """
+        Decode one line of the record: the data of a control field as a string, or a MarcField for any other field.
+        """
+        if field == 'LDR' or int(field) < 10:
+            return line[6:]
+
+        ind1 = line[6]
+        ind2 = line[7]
+        if field == '040':
+            # 040 (cataloging source) line may have double dollar signs due to OCLC codes like "CQ$."
+            line = line.replace('$$', r'{dollar}$')
+            # Similar issue if last OCLC code ends with a dollar sign.
+            if line.endswith('$'):
+                line = line[:-1] + r'{dollar}'
+        try:
+            if line[8] == '$':
+                field_list = line[9:].split('$')
+            else:
+                field_list = line[8:].split('$')
+                self.warnings_list.append('No subfield indicator at start of MARC line {}'.format(line))
+        except IndexError:
+            print(f'ERROR FIELD {field}')
+            print(self.marc)
+            field_list = []
+        codes = []
+        values = []
+        for subfield_data in field_list:
+            try:
+                codes.append(subfield_data[0])
+            except IndexError:
+                self.warnings_list.append(
+                    'Subfield with no data in line {}, probably an extra $ or $ at end of line'.format(field))
+                continue
+            values.append(subfield_data[1:])
+        return MarcField(ind1, ind2, ''.join(codes), tuple(values))
+
     def _get_list_from_marc_dict(self, field, subfield=None, position=None, end_position=None):
         if field not in self.marc_dict:
             return []
         data_list = []
         for field_data in self.marc_dict[field]:
             if subfield:
-                if subfield in field_data['subfields']:
-                    data_list.extend(field_data['subfields'][subfield])
+                data_list.extend(field_data.get_subfields(subfield))
             else:
                 data_list.append(field_data)
         if position:
@@ -741,8 +847,8 @@ class MarcFields:
     def get_title(self):
         self.title = ''
 
-        for title_tuple in self.marc_dict['title_line']:
-            title_subfield, subfield_data = title_tuple
+        title_subfields = [title_tuple for title_field in self.marc_dict.get('245', []) for title_tuple in title_field]
+        for title_subfield, subfield_data in title_subfields:
             if title_subfield == 'h':
                 continue
             # preserve ellipsis, with space if it exists
@@ -785,18 +891,14 @@ class MarcFields:
 
         for publisher_field in publisher_fields:
             if publisher_field in self.marc_dict and not publisher:
-                for line_dict in self.marc_dict[publisher_field]:
-                    if line_dict['ind1'] == '3' and not publisher:
-                        try:
-                            publisher =  line_dict['subfields']['b']
-                        except KeyError:
+                for publisher_line in self.marc_dict[publisher_field]:
+                    if publisher_line.ind1 == '3' and not publisher:
+                        publisher = publisher_line.get_subfields('b')
+                        if not publisher:
                             publisher = ''
                             blank_publisher = True
                     elif not first_seen_publisher:
-                        try:
-                            first_seen_publisher =  line_dict['subfields']['b']
-                        except KeyError:
-                            pass
+                        first_seen_publisher = publisher_line.get_subfields('b')
         
         if not publisher and not blank_publisher:
             publisher = first_seen_publisher
@@ -1004,8 +1106,9 @@ class WorldCatMarcFields(MarcFields):
     forces the process to take whatever is in the 001 field as the OCLC number.
 
     """
-    def __init__(self, record, record_origin='worldcat', log_warnings=False, debug_info=''):
-        super().__init__(record, record_origin=record_origin, log_warnings=log_warnings, debug_info=debug_info)
+    def __init__(self, record, record_origin='worldcat', log_warnings=False, debug_info='', lazy=False):
+        super().__init__(
+            record, record_origin=record_origin, log_warnings=log_warnings, debug_info=debug_info, lazy=lazy)
         """marc as None means record failed checks in parent class"""
         if self.marc is None:
             return
@@ -1015,9 +1118,10 @@ class CRLMarcFields(MarcFields):
     """
     Handle a Center for Research Libraries record, with its specific fields and data.
     """
-    def __init__(self, record, record_origin="crl", log_warnings=False, debug_info=''):
+    def __init__(self, record, record_origin="crl", log_warnings=False, debug_info='', lazy=False):
         self.marc = None
-        super().__init__(record, record_origin=record_origin, log_warnings=log_warnings, debug_info=debug_info)
+        super().__init__(
+            record, record_origin=record_origin, log_warnings=log_warnings, debug_info=debug_info, lazy=lazy)
         """marc as None means record failed checks in parent class"""
         if self.marc is None:
             return
@@ -1058,3 +1162,56 @@ class CRLMarcFields(MarcFields):
 
     def get_locations(self):
         self.locations = self._get_list_from_marc_dict(field='998', subfield='a')
+
+
+def stringify_marc_data(data):
+    """Turn a MarcFields value into a string: lists and tuples joined with "; ", and empty values (but 0) as ''."""
+    if not data and str(data) != '0':
+        return ''
+    if isinstance(data, (list, tuple)):
+        return '; '.join(data)
+    return str(data)
+
+
+class MarcFieldsExtractor:
+    """
+    A plan for taking the same categories of data from many MarcFields objects. The getter for each category is
+    looked up once, when the plan is made, instead of through __getattr__ for every category of every record.
+
+    Usage:
+
+        extractor = MarcFieldsExtractor({'wc_oclc': 'oclc', 'wc_title': 'title'}, WorldCatMarcFields, stringify=True)
+        data = extractor.extract(wc_mf)  # {'wc_oclc': '12345', 'wc_title': 'Journal of studies'}
+
+    categories is either a list of MarcFields data categories, or a dict of the names to return the data under to
+    the categories. Getters are looked up on marc_fields_class, so pass the subclass for getters only it has or
+    overrides. With stringify, values are returned as by stringify_marc_data.
+    """
+
+    def __init__(self, categories, marc_fields_class=MarcFields, stringify=False):
+        if not isinstance(categories, dict):
+            categories = {category: category for category in categories}
+        self.names = list(categories)
+        self.stringify = stringify
+        self.plan = []
+        for name, category in categories.items():
+            getter = getattr(marc_fields_class, 'get_{}'.format(category), None)
+            if not callable(getter):
+                raise ValueError('No {} getter for data category {}'.format(marc_fields_class.__name__, category))
+            self.plan.append((name, category, getter))
+
+    def extract(self, mf):
+        """Get every category from a MarcFields object, as a dict keyed by the names the plan was made with."""
+        extracted_data = {}
+        # data already found is kept on the object by its getter
+        found_data = mf.__dict__
+        for name, category, getter in self.plan:
+            if category in found_data:
+                data = found_data[category]
+            else:
+                getter(mf)
+                data = getattr(mf, category)
+            if self.stringify:
+                data = stringify_marc_data(data)
+            extracted_data[name] = data
+        return extracted_data
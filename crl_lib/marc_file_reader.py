@@ -1,3 +1,38 @@
+import os
+import re
+import sys
+import mmap
+import array
+import logging
+import argparse
+
+from crl_lib.compressed_files import get_uncompressed_name, is_compressed_file, open_compressed_file
+from crl_lib.encoding_sniffer import UTF8, read_stream_sample, sniff_encoding, sniff_file_encoding
+from crl_lib.iso2709_file_reader import Iso2709FileReader
+from crl_lib.marcxml_file_reader import MarcXmlFileReader
+
+
+# A line that's blank apart from spaces, tabs and carriage returns ends a record. Lines blank in some other way (say
+# a lone form feed) are found when the record is decoded.
+BLANK_LINE_REGEX = re.compile(rb"\n[ \t\r]*\n")
+
+OFFSET_INDEX_SUFFIX = ".offsets"
+OFFSET_INDEX_MAGIC = b"MRKOFFSETS1"
+
+# Files whose sample isn't UTF-8 are read as Latin-1, as are lines in UTF-8 files that aren't UTF-8. Lines in Latin-1
+# files that are UTF-8 are still read as UTF-8, since Latin-1 decodes anything.
+FALLBACK_ENCODING = "latin-1"
+# Lines that aren't in the file's encoding logged per file; the rest are only kept in mixed_encoding_line_offsets
+MAX_LOGGED_MIXED_ENCODING_LINES = 20
+
+# Compressed files are decompressed and split into records this much at a time
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+# File endings read by open_marc_file with something other than MarcFileReader
+BINARY_MARC_FILE_ENDINGS = (".mrc", ".marc")
+MARCXML_FILE_ENDINGS = (".xml",)
+
+
 class MarcFileReader():
     """
     Simple iterator for text-based MARC files (mrk files).
@@ -20,16 +55,53 @@ class MarcFileReader():
         while mfr.more_records is True:
             record = mfr.get_record()
 
+    Files on disk are memory-mapped and split into records at the byte level; other file handles (and use_mmap=False)
+    are read line by line. Gzipped (.gz) and zipped (.zip) files are decompressed as they're read, a block at a time,
+    and split the same way as memory-mapped files. Either way the records are the same. The byte offsets of each record are available too:
+
+        for start, end, record in mfr.iter_records_with_offsets():
+            [...]
+
+    Records can also be read by sequence number, using an offset index that's kept in a sidecar file next to the
+    MARC file (see get_offset_index):
+
+        mfr = MarcFileReader("/path/to/file")
+        mfr.get_offset_index(write_sidecar=True)
+        record = mfr.get_record_by_seqnum(1000)
     """
 
-    def __init__(self, marc_target, allow_unicode_failure=False):
+    def __init__(self, marc_target, allow_unicode_failure=False, use_mmap=True):
         """
         if allow_unicode_failure is set to True, process will fail with a line cannot be decoded via utf8 or latin-1
         """
         self.allow_unicode_failure = allow_unicode_failure
         self.record = ''
+        # byte offsets of the record last read: where its first line starts, and where its last line ends
+        self.record_offsets = (0, 0)
+        self.compressed = False
         self._establish_file_handle(marc_target)
-        self._find_eof()
+        # picked once, from a sample of the file
+        self.encoding = UTF8
+        self.mmap = None
+        if self.compressed is True:
+            # the size of the compressed file: the uncompressed size isn't known until it's all been read
+            self.eof = os.path.getsize(marc_target)
+            self._stream_head, sample = read_stream_sample(self.file_handle)
+            self.encoding = sniff_encoding(sample, FALLBACK_ENCODING)
+        else:
+            self._find_eof()
+            if self.eof > 0:
+                self.encoding = sniff_file_encoding(self.file_handle, self.eof, FALLBACK_ENCODING)
+            if use_mmap is True:
+                self._map_file()
+        # byte offsets of lines not in the file's encoding: Latin-1 lines in a UTF-8 file, or UTF-8 lines in a
+        # Latin-1 one
+        self.mixed_encoding_line_offsets = []
+        self._records = None
+        # a record read ahead by get_record, for compressed files
+        self._upcoming = None
+        self._position = 0
+        self.offset_index = None
         # The below is for the get_record method
         self.more_records = True
 
@@ -38,15 +110,40 @@ class MarcFileReader():
         return self
 
     def __next__(self):
-        self._get_next_record()
+        if self.mmap is None and self.compressed is False:
+            self._get_next_record()
+            return self.record
+        if self._upcoming is not None:
+            (start, end, self._position, self.record), self._upcoming = self._upcoming, None
+            self.record_offsets = (start, end)
+            return self.record
+        if self._records is None:
+            if self.compressed is True:
+                self._records = self._iter_streamed_records()
+            else:
+                self._records = self._iter_mapped_records()
+        try:
+            start, end, self._position, self.record = next(self._records)
+        except StopIteration:
+            self.close()
+            raise
+        self.record_offsets = (start, end)
         return self.record
 
     def _establish_file_handle(self, marc_target):
         """Set file handle. Create it if input is a file location."""
         if hasattr(marc_target, "read") and callable(marc_target.read):
             self.file_handle = marc_target
+            self.file_location = getattr(marc_target, "name", None)
+            if not isinstance(self.file_location, (str, bytes, os.PathLike)):
+                self.file_location = None
+        elif is_compressed_file(marc_target):
+            self.file_handle = open_compressed_file(marc_target)
+            self.file_location = marc_target
+            self.compressed = True
         else:
             self.file_handle = open(marc_target, "rb")
+            self.file_location = marc_target
 
     def _find_eof(self):
         """Find the file length before iteration starts, so we know when we reach the end."""
@@ -54,23 +151,74 @@ class MarcFileReader():
         self.eof = self.file_handle.tell()
         self.file_handle.seek(0)
 
+    def _map_file(self):
+        """Memory-map the file, if it's a non-empty file on disk."""
+        if self.eof == 0:
+            return
+        try:
+            self.mmap = mmap.mmap(self.file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            # io.UnsupportedOperation, for in-memory files, is both an OSError and a ValueError
+            self.mmap = None
+
+    def close(self):
+        self.more_records = False
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        self.file_handle.close()
+
+    def _decode_line(self, binary_line, line_start):
+        """
+        Decode a line in the file's encoding. In a UTF-8 file, a line that isn't UTF-8 is read as Latin-1, and in a
+        Latin-1 file a line that is UTF-8 is read as UTF-8; either way its offset is reported. Returns None for a line
+        to skip.
+        """
+        if self.encoding != UTF8 and not binary_line.isascii():
+            try:
+                line_str = binary_line.decode(UTF8).rstrip()
+            except UnicodeDecodeError:
+                pass
+            else:
+                self._report_mixed_encoding_line(line_start, UTF8)
+                return line_str
+        try:
+            return binary_line.decode(self.encoding).rstrip()
+        except UnicodeDecodeError:
+            pass
+        self._report_mixed_encoding_line(line_start, FALLBACK_ENCODING)
+        try:
+            return binary_line.decode(FALLBACK_ENCODING).rstrip()
+        except UnicodeDecodeError:
+            if self.allow_unicode_failure is True:
+                raise Exception("Unable to process line as UTF-8 or Latin-1")
+            return None
+
+    def _report_mixed_encoding_line(self, line_start, line_encoding):
+        if self.mixed_encoding_line_offsets and line_start <= self.mixed_encoding_line_offsets[-1]:
+            # a block being decoded again, or a record read again by offset
+            return
+        self.mixed_encoding_line_offsets.append(line_start)
+        if len(self.mixed_encoding_line_offsets) <= MAX_LOGGED_MIXED_ENCODING_LINES:
+            logging.warning("Line at byte {} of {} is read as {}, not {}".format(
+                line_start, self.file_location, line_encoding, self.encoding))
+        elif len(self.mixed_encoding_line_offsets) == MAX_LOGGED_MIXED_ENCODING_LINES + 1:
+            logging.warning("More lines in {} are not read as {}; not logging them".format(
+                self.file_location, self.encoding))
+
     def _get_next_record(self):
         """Glue all lines together until we reach a blank line."""
         self.record_list = []
+        record_start = 0
         while True:
+            line_start = self.file_handle.tell()
             try:
                 binary_line = self.file_handle.readline()
             except ValueError:
                 raise StopIteration
-            try:
-                line_str = binary_line.decode("utf8").rstrip()
-            except UnicodeDecodeError:
-                try:
-                    line_str = binary_line.decode("latin-1").rstrip()
-                except UnicodeDecodeError:
-                    if self.allow_unicode_failure is True:
-                        raise Exception("Unable to process line as UTF-8 or Latin-1")
-                    continue
+            line_str = self._decode_line(binary_line, line_start)
+            if line_str is None:
+                continue
             if not line_str:
                 if not self.record_list:
                     if self.file_handle.tell() >= self.eof:
@@ -79,14 +227,287 @@ class MarcFileReader():
                         raise StopIteration
                     continue
                 self.record = "\n".join(self.record_list)
+                self.record_offsets = (record_start, line_start)
                 return
+            if not self.record_list:
+                record_start = line_start
             self.record_list.append(line_str)
 
+    def _iter_mapped_records(self, position=0, end=None):
+        """
+        Yield (start, end, resume position, record) for each record in the memory-mapped file, or in the part of it
+        from position to end. The resume position is where the line-by-line reader would be after reading the record,
+        past the blank line that ended it.
+
+        The file is cut into blocks at blank lines with a regex, and each block decoded in one go. A block that isn't
+        a single record (it has some other kind of blank line in it, or nothing but blank lines) is split line by line.
+        """
+        mapped_file = self.mmap
+        file_size = len(mapped_file)
+        if end is not None:
+            file_size = min(end, file_size)
+        yield from self._iter_buffer_records(mapped_file, position, file_size)
+
+    def _iter_streamed_records(self):
+        """
+        Yield (start, end, resume position, record) for each record in a compressed file, as _iter_mapped_records
+        does, decompressing it a block at a time. Offsets are in the decompressed file.
+        """
+        buffer = self._stream_head
+        self._stream_head = b""
+        buffer_start = 0
+        while True:
+            data = self.file_handle.read(STREAM_BLOCK_SIZE)
+            buffer = buffer + data
+            final = not data
+            # the records that end in this buffer; the rest of it is kept for the next block
+            buffer_used = yield from self._iter_buffer_records(buffer, 0, len(buffer), buffer_start, final)
+            if final:
+                return
+            buffer = buffer[buffer_used:]
+            buffer_start += buffer_used
+
+    def _iter_buffer_records(self, buffer, position, buffer_end, buffer_start=0, final=True):
+        """
+        Yield (start, end, resume position, record) for each record in a buffer holding the file from buffer_start,
+        from position to buffer_end. Unless final is True, whatever follows the last blank line in the buffer is
+        left, as the record it starts may go on past buffer_end. Returns the position in the buffer reached.
+        """
+        while position < buffer_end:
+            match = BLANK_LINE_REGEX.search(buffer, position, buffer_end)
+            if match:
+                block_end = match.start() + 1
+                next_position = match.end()
+            elif not final:
+                break
+            else:
+                block_end = buffer_end
+                next_position = buffer_end
+            block = buffer[position:block_end]
+            block_start = buffer_start + position
+            lines = self._decode_block(block, block_start)
+            if lines and all(lines):
+                yield block_start, buffer_start + block_end, buffer_start + next_position, "\n".join(lines)
+            else:
+                for start, end, resume_position, record in self._split_block(block, block_start):
+                    yield start, end, resume_position or buffer_start + next_position, record
+            position = next_position
+        return position
+
+    def _decode_block(self, block, block_start):
+        """Decode a block of lines, as _decode_line would, returning the lines. Skipped lines are left out."""
+        lines = None
+        if self.encoding == UTF8 or block.isascii():
+            try:
+                lines = block.decode(self.encoding).split("\n")
+            except UnicodeDecodeError:
+                pass
+        if lines is None:
+            binary_lines = block.split(b"\n")
+            if block.endswith(b"\n"):
+                binary_lines.pop()
+            lines = []
+            line_start = block_start
+            for binary_line in binary_lines:
+                line_str = self._decode_line(binary_line, line_start)
+                if line_str is not None:
+                    lines.append(line_str)
+                line_start += len(binary_line) + 1
+            return lines
+        if block.endswith(b"\n"):
+            lines.pop()
+        return [line.rstrip() for line in lines]
+
+    def _split_block(self, block, block_start):
+        """Split a block into records line by line, keeping track of each line's offset."""
+        binary_lines = block.split(b"\n")
+        if block.endswith(b"\n"):
+            binary_lines.pop()
+        record_list = []
+        record_start = block_start
+        offset = block_start
+        for binary_line in binary_lines:
+            line_start = offset
+            offset += len(binary_line) + 1
+            line_str = self._decode_line(binary_line, line_start)
+            if line_str is None:
+                continue
+            if not line_str:
+                if record_list:
+                    yield record_start, line_start, offset, "\n".join(record_list)
+                    record_list = []
+                continue
+            if not record_list:
+                record_start = line_start
+            record_list.append(line_str)
+        if record_list:
+            yield record_start, min(offset, block_start + len(block)), None, "\n".join(record_list)
+
+    def iter_records_with_offsets(self):
+        """
+        Iterate over the remaining records, yielding (start, end, record), where start and end are the byte offsets
+        of the record in the file.
+        """
+        for record in self:
+            yield self.record_offsets[0], self.record_offsets[1], record
+
+    def get_chunk_offsets(self, chunk_count):
+        """
+        Split the file into up to chunk_count byte ranges of roughly the same size, returned as (start, end) tuples.
+        Ranges are cut just after blank lines, so reading each range with iter_records_in_range gives the same
+        records, in the same order, as reading the whole file.
+        """
+        if self.mmap is None or chunk_count <= 1:
+            return [(0, self.eof)]
+        boundaries = [0]
+        for i in range(1, chunk_count):
+            target = max(self.eof * i // chunk_count, boundaries[-1])
+            match = BLANK_LINE_REGEX.search(self.mmap, target)
+            if not match:
+                break
+            if boundaries[-1] < match.end() < self.eof:
+                boundaries.append(match.end())
+        boundaries.append(self.eof)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def iter_records_in_range(self, start, end):
+        """
+        Iterate over the records between two byte offsets from get_chunk_offsets, yielding (start, end, record).
+        Needs a file that can be memory-mapped.
+        """
+        if start >= end:
+            return
+        if self.mmap is None:
+            raise ValueError("Reading records by offset needs a MARC file that can be memory-mapped")
+        for record_start, record_end, _, record in self._iter_mapped_records(start, end):
+            yield record_start, record_end, record
+
     def get_record(self):
         """
         Get the next record, if you don't want to use the class as an iterator.
         """
         record = self.__next__()
-        if self.file_handle.tell() >= self.eof:
+        if self.compressed is True:
+            # the end of a compressed file only shows once it's been read, so read ahead
+            self._upcoming = next(self._records, None)
+            if self._upcoming is None:
+                self.close()
+        elif self.mmap is None:
+            if self.file_handle.closed or self.file_handle.tell() >= self.eof:
+                self.more_records = False
+        elif self._position >= self.eof:
             self.more_records = False
         return record
+
+    def get_offset_index_location(self):
+        if self.file_location is None:
+            return None
+        return os.fsdecode(self.file_location) + OFFSET_INDEX_SUFFIX
+
+    def get_offset_index(self, write_sidecar=False):
+        """
+        Get an array of record offsets: the start and end of the first record, then of the second, and so on. It's
+        read from the sidecar file if there's a current one, otherwise worked out by scanning the file, and saved to
+        the sidecar if write_sidecar is True.
+
+        Needs a file that can be memory-mapped.
+        """
+        if self.offset_index is not None:
+            return self.offset_index
+        if self.eof == 0:
+            self.offset_index = array.array("Q")
+            return self.offset_index
+        if self.mmap is None:
+            raise ValueError("The offset index needs a MARC file that can be memory-mapped")
+        self.offset_index = self._read_offset_index()
+        if self.offset_index is None:
+            self.offset_index = array.array("Q")
+            for start, end, _, _ in self._iter_mapped_records():
+                self.offset_index.append(start)
+                self.offset_index.append(end)
+            if write_sidecar is True:
+                self._write_offset_index(self.offset_index)
+        return self.offset_index
+
+    def get_record_by_seqnum(self, seqnum):
+        """Get a record by its sequence number, counting from 1, without reading the records before it."""
+        offset_index = self.get_offset_index()
+        if seqnum < 1 or seqnum * 2 > len(offset_index):
+            raise IndexError("No record {} in the file".format(seqnum))
+        return self.read_record_at(offset_index[seqnum * 2 - 2], offset_index[seqnum * 2 - 1])
+
+    def read_record_at(self, start, end):
+        """Get the record that lies between two byte offsets in the file."""
+        if self.mmap is None:
+            raise ValueError("Reading records by offset needs a MARC file that can be memory-mapped")
+        return "\n".join(self._decode_block(self.mmap[start:end], start))
+
+    def _get_offset_index_header(self):
+        file_stat = os.fstat(self.file_handle.fileno())
+        return b"%s %d %d\n" % (OFFSET_INDEX_MAGIC, file_stat.st_size, file_stat.st_mtime_ns)
+
+    def _read_offset_index(self):
+        """Read the sidecar offset index, if there is one and it was made from the file as it is now."""
+        index_location = self.get_offset_index_location()
+        if index_location is None:
+            return None
+        try:
+            with open(index_location, "rb") as fin:
+                if fin.readline() != self._get_offset_index_header():
+                    return None
+                offset_index = array.array("Q")
+                offset_index.frombytes(fin.read())
+        except (OSError, ValueError):
+            return None
+        if sys.byteorder == "big":
+            offset_index.byteswap()
+        return offset_index
+
+    def _write_offset_index(self, offset_index):
+        """Save the offset index next to the MARC file, as little-endian 64-bit integers after a header line."""
+        index_location = self.get_offset_index_location()
+        if index_location is None:
+            return
+        offset_bytes = array.array("Q", offset_index)
+        if sys.byteorder == "big":
+            offset_bytes.byteswap()
+        temp_location = "{}.{}.tmp".format(index_location, os.getpid())
+        try:
+            with open(temp_location, "wb") as fout:
+                fout.write(self._get_offset_index_header())
+                fout.write(offset_bytes.tobytes())
+            os.replace(temp_location, index_location)
+        except OSError as e:
+            logging.debug("Could not write the MARC offset index {} ({})".format(index_location, e))
+
+
+def open_marc_file(file_location):
+    """
+    Get a reader for a MARC file based on its ending: Iso2709FileReader for binary MARC (.mrc), MarcXmlFileReader for
+    MARCXML (.xml), otherwise MarcFileReader. All of them give records as MRK strings and share MarcFileReader's
+    interface for iterating, get_record, get_chunk_offsets and iter_records_in_range. A gzipped or zipped file goes by
+    the ending of the file inside it.
+    """
+    file_ending = os.path.splitext(get_uncompressed_name(file_location))[1].lower()
+    if file_ending in BINARY_MARC_FILE_ENDINGS:
+        return Iso2709FileReader(file_location)
+    if file_ending in MARCXML_FILE_ENDINGS:
+        return MarcXmlFileReader(file_location)
+    return MarcFileReader(file_location)
+
+
+def app():
+    parser = argparse.ArgumentParser(description="Index MARC (mrk) files.")
+    parser.add_argument("file", help="MARC file")
+    parser.add_argument("--index", "-i", action="store_true", help="write the offset index sidecar for the file")
+    args = parser.parse_args()
+    if not args.index:
+        parser.error("nothing to do; use --index to index the file")
+    mfr = MarcFileReader(args.file)
+    offset_index = mfr.get_offset_index(write_sidecar=True)
+    print("Indexed {:,} records in {}".format(len(offset_index) // 2, mfr.get_offset_index_location()))
+    mfr.close()
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,118 @@
+"""
+Read MARCXML files as MRK text, one record at a time.
+
+The file is read and parsed a block at a time with MarcXmlToMrkConverter, so a large collection is never held in
+memory as a whole. Records come out the way Iso2709FileReader and MarcFileReader give them: one line per field,
+trailing whitespace removed, no final newline.
+
+Usage:
+
+    from crl_lib.marcxml_file_reader import MarcXmlFileReader
+
+    for record in MarcXmlFileReader("/path/to/file.xml"):
+        [...]
+"""
+
+import os
+import logging
+from collections import deque
+from typing import Deque, Iterator, List, Optional, Tuple, Union
+from xml.etree.ElementTree import ParseError
+
+from pymarc.exceptions import RecordLeaderInvalid
+
+from crl_lib.compressed_files import open_input_file
+from crl_lib.iso2709_file_reader import join_mrk_lines
+from crl_lib.marcxml_to_mrk import MarcXmlToMrkConverter
+
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class MarcXmlFileReader:
+    """
+    Iterator over the records in a MARCXML file, giving MRK strings, with the same interface as MarcFileReader.
+
+    Record offsets are the byte range of the block a record was completed in, rather than of the record itself, and
+    the file is only ever read as one chunk: XML can't be split at arbitrary byte offsets. Gzipped and zipped files
+    are decompressed as they're read.
+    """
+
+    def __init__(self, marc_target: Union[str, os.PathLike]) -> None:
+        self.file_location = marc_target
+        self.file_handle = open_input_file(marc_target)
+        # for a compressed file, the size of the compressed file
+        self.eof = os.path.getsize(marc_target)
+        self.record = ""
+        self.record_offsets = (0, 0)
+        self._records = self._iter_records()
+        self._upcoming: Optional[Tuple[int, int, str]] = None
+        self.more_records = True
+
+    def __iter__(self) -> "MarcXmlFileReader":
+        return self
+
+    def __next__(self) -> str:
+        if self._upcoming is not None:
+            (start, end, self.record), self._upcoming = self._upcoming, None
+        else:
+            try:
+                start, end, self.record = next(self._records)
+            except StopIteration:
+                self.close()
+                raise
+        self.record_offsets = (start, end)
+        return self.record
+
+    def get_record(self) -> str:
+        record = self.__next__()
+        # the parser can't tell whether another record is coming until it has read one, so look ahead
+        self._upcoming = next(self._records, None)
+        if self._upcoming is None:
+            self.close()
+        return record
+
+    def close(self) -> None:
+        self.more_records = False
+        self.file_handle.close()
+
+    def iter_records_with_offsets(self) -> Iterator[Tuple[int, int, str]]:
+        for record in self:
+            yield self.record_offsets[0], self.record_offsets[1], record
+
+    def _iter_records(self) -> Iterator[Tuple[int, int, str]]:
+        if self.eof == 0:
+            return
+        converter = MarcXmlToMrkConverter()
+        pending: Deque[str] = deque()
+        block_start = 0
+        while True:
+            block = self.file_handle.read(READ_BLOCK_SIZE)
+            block_end = block_start + len(block)
+            try:
+                if block:
+                    pending.extend(converter.feed(block))
+                else:
+                    pending.extend(converter.close())
+            except (ParseError, RecordLeaderInvalid, KeyError) as e:
+                # there's no resynchronizing after bad XML, so keep the records read so far and stop
+                logging.error(
+                    "Stopped reading MARCXML file {} at byte {}: {!r}".format(self.file_location, block_start, e)
+                )
+                block = b""
+            while pending:
+                yield block_start, block_end, join_mrk_lines(pending.popleft().split("\n"))
+            if not block:
+                return
+            block_start = block_end
+
+    def iter_records_in_range(self, start: int, end: int) -> Iterator[Tuple[int, int, str]]:
+        """Yield (start, end, record) for every record; only the single range from get_chunk_offsets is supported."""
+        if start >= end:
+            return
+        if (start, end) != (0, self.eof):
+            raise ValueError("MARCXML files can only be read as a whole")
+        yield from self.iter_records_with_offsets()
+
+    def get_chunk_offsets(self, chunk_count: int) -> List[Tuple[int, int]]:
+        return [(0, self.eof)]
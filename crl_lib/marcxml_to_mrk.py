@@ -0,0 +1,268 @@
+"""
+Convert MARCXML straight to MRK (MARCMaker) text, without building pymarc Record objects.
+
+The output is the same, byte for byte, as running the MARCXML through pymarc.marcxml.parse_xml_to_array and calling
+str() on each record, including pymarc's handling of odd input: missing leaders, indicators other than blank, control
+fields with non-numeric tags, and so on. Run this module to compare the two on sample records (and any MARCXML files
+given).
+
+Usage:
+
+    from crl_lib.marcxml_to_mrk import marcxml_to_mrk
+
+    mrk = marcxml_to_mrk(api_response_text)
+"""
+
+import io
+import sys
+import argparse
+from pathlib import Path
+from typing import List, Optional, Union
+from xml.etree.ElementTree import Element, XMLPullParser
+
+import pymarc
+from pymarc.exceptions import RecordLeaderInvalid
+
+
+LEADER_LENGTH = 24
+# pymarc's Record() fills in a blank leader like this
+DEFAULT_LEADER = " " * 10 + "22" + " " * 8 + "4500"
+
+
+class _FieldInProgress:
+    """The parts of a MARCXML field collected so far, shaped like the pymarc Field it stands in for."""
+
+    __slots__ = ("tag", "control_field", "data", "indicators", "subfields")
+
+    def __init__(self, tag: str, ind1: str = " ", ind2: str = " ") -> None:
+        if tag.isdigit() and len(tag) != 3:
+            tag = "{:03}".format(int(tag))
+        self.tag = tag
+        self.control_field = tag < "010" and tag.isdigit()
+        self.data = ""
+        self.indicators = (ind1, ind2)
+        self.subfields: List[str] = []
+
+    def to_mrk(self) -> str:
+        if self.control_field:
+            return "={}  {}".format(self.tag, self.data.replace(" ", "\\"))
+        indicators = "".join("\\" if indicator in (" ", "\\") else indicator for indicator in self.indicators)
+        return "={}  {}{}".format(self.tag, indicators, "".join(self.subfields))
+
+
+def _get_element_text(element: Element) -> str:
+    """
+    Get the text pymarc's SAX handler would see for an element: the text after the last child, if there are any
+    children, otherwise all of the element's text.
+    """
+    if len(element):
+        return element[-1].tail or ""
+    return element.text or ""
+
+
+class MarcXmlToMrkConverter:
+    """
+    Incremental MARCXML to MRK converter, for MARCXML that comes in pieces (a large file read a block at a time).
+    Each record's elements are dropped as soon as the record is converted, so memory use doesn't grow with the size
+    of the document.
+
+    Usage:
+
+        converter = MarcXmlToMrkConverter()
+        for block in blocks:
+            for mrk in converter.feed(block):
+                [...]
+        for mrk in converter.close():
+            [...]
+    """
+
+    def __init__(self) -> None:
+        self.parser = XMLPullParser(events=("start", "end"))
+        self.root: Optional[Element] = None
+        self.leader: Optional[str] = None
+        self.lines: Optional[List[str]] = None
+        self.field: Optional[_FieldInProgress] = None
+
+    def feed(self, marcxml: Union[str, bytes]) -> List[str]:
+        """
+        Parse the next piece of the document.
+
+        Args:
+            marcxml (Union[str, bytes]): The next piece of MARCXML text.
+
+        Returns:
+            List[str]: MRK for the records completed in this piece, each ending in a newline.
+
+        Raises:
+            RecordLeaderInvalid: A leader isn't 24 characters long, as with pymarc.
+        """
+        self.parser.feed(marcxml)
+        return self._read_events()
+
+    def close(self) -> List[str]:
+        """Finish the document, returning MRK for any records left."""
+        self.parser.close()
+        return self._read_events()
+
+    def _read_events(self) -> List[str]:
+        mrk_records: List[str] = []
+        for event, element in self.parser.read_events():
+            local_name = element.tag.rpartition("}")[2]
+            if event == "start":
+                if self.root is None:
+                    self.root = element
+                if local_name == "record":
+                    self.leader = DEFAULT_LEADER
+                    self.lines = []
+                elif local_name == "controlfield":
+                    self.field = _FieldInProgress(element.attrib["tag"])
+                elif local_name == "datafield":
+                    self.field = _FieldInProgress(
+                        element.attrib["tag"], element.get("ind1", " "), element.get("ind2", " ")
+                    )
+                elif local_name == "subfield":
+                    # raises KeyError for a subfield without a code, as pymarc does
+                    element.attrib["code"]
+                continue
+
+            lines = self.lines
+            if lines is None:
+                continue
+            field = self.field
+            if local_name == "record":
+                mrk_records.append("\n".join(["=LDR  {}".format(self.leader)] + lines) + "\n")
+                self.lines = None
+                element.clear()
+                if self.root is not None and self.root is not element:
+                    # drop finished records from the collection; records still being built are held by the parser
+                    self.root.clear()
+            elif local_name == "leader":
+                self.leader = _get_element_text(element)
+                if len(self.leader) != LEADER_LENGTH:
+                    raise RecordLeaderInvalid
+            elif local_name == "controlfield" and field is not None:
+                field.data = _get_element_text(element)
+                lines.append(field.to_mrk())
+                self.field = None
+            elif local_name == "datafield" and field is not None:
+                lines.append(field.to_mrk())
+                self.field = None
+            elif local_name == "subfield" and field is not None and element.attrib["code"]:
+                if not field.control_field:
+                    field.subfields.append("${}{}".format(element.attrib["code"], _get_element_text(element)))
+        return mrk_records
+
+
+def marcxml_to_mrk_records(marcxml: Union[str, bytes]) -> List[str]:
+    """
+    Convert MARCXML (a single record or a collection) to MRK.
+
+    Args:
+        marcxml (Union[str, bytes]): MARCXML text, for instance a Metadata API response.
+
+    Returns:
+        List[str]: One MRK string per record, each ending in a newline.
+
+    Raises:
+        RecordLeaderInvalid: A leader isn't 24 characters long, as with pymarc.
+    """
+    converter = MarcXmlToMrkConverter()
+    return converter.feed(marcxml) + converter.close()
+
+
+def marcxml_to_mrk(marcxml: Union[str, bytes]) -> str:
+    """
+    Convert MARCXML to MRK, for responses that hold one record.
+
+    Args:
+        marcxml (Union[str, bytes]): MARCXML text.
+
+    Returns:
+        str: MRK for the first record, or a blank string if there isn't one.
+    """
+    mrk_records = marcxml_to_mrk_records(marcxml)
+    if mrk_records:
+        return mrk_records[0]
+    return ""
+
+
+def _marcxml_to_mrk_with_pymarc(marcxml: str) -> List[str]:
+    return [str(record) for record in pymarc.marcxml.parse_xml_to_array(io.StringIO(marcxml))]
+
+
+SAMPLE_MARCXML = [
+    # a typical Metadata API response
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<record xmlns="http://www.loc.gov/MARC21/slim">'
+    "<leader>00000cas a2200000 i 4500</leader>"
+    '<controlfield tag="001">1234567</controlfield>'
+    '<controlfield tag="003">OCoLC</controlfield>'
+    '<controlfield tag="005">20240115093012.0</controlfield>'
+    '<controlfield tag="008">750101c19449999nyuqr p       0   a0eng  </controlfield>'
+    '<datafield tag="019" ind1=" " ind2=" "><subfield code="a">1111</subfield><subfield code="a">2222</subfield>'
+    "</datafield>"
+    '<datafield tag="022" ind1="0" ind2=" "><subfield code="a">0000-0019</subfield>'
+    '<subfield code="l">0000-0019</subfield></datafield>'
+    '<datafield tag="040" ind1=" " ind2=" "><subfield code="a">DLC</subfield><subfield code="b">eng</subfield>'
+    '<subfield code="d">CQ$</subfield></datafield>'
+    '<datafield tag="245" ind1="0" ind2="4"><subfield code="a">The journal of &amp; "quotes" &lt;tags&gt; :</subfield>'
+    '<subfield code="b">café 日本  double  spaces </subfield></datafield>'
+    '<datafield tag="362" ind1="0" ind2="\\"><subfield code="a">Vol. 1 (1944)-</subfield></datafield>'
+    "</record>",
+    # a collection, with whitespace between elements and a prefixed namespace
+    '<marc:collection xmlns:marc="http://www.loc.gov/MARC21/slim">\n'
+    "  <marc:record>\n    <marc:leader>00000nas a2200000 a 4500</marc:leader>\n"
+    '    <marc:controlfield tag="001"> 12 34 </marc:controlfield>\n'
+    '    <marc:datafield tag="650" ind1="" ind2="0">\n'
+    '      <marc:subfield code="a">Periodicals.</marc:subfield>\n'
+    '      <marc:subfield code="">no code</marc:subfield>\n'
+    "    </marc:datafield>\n  </marc:record>\n"
+    '  <marc:record><marc:controlfield tag="1">short tag</marc:controlfield>'
+    '<marc:controlfield tag="FMT">SE</marc:controlfield>'
+    '<marc:datafield tag="005" ind1="1" ind2="2"><marc:subfield code="a">data in a control field</marc:subfield>'
+    "</marc:datafield>"
+    '<marc:datafield tag="500"><marc:subfield code="a">line\r\nbreak<b>bold</b> after</marc:subfield>'
+    "</marc:datafield></marc:record>\n"
+    "</marc:collection>",
+    # no namespace at all, and an empty record
+    '<collection><record><leader>01234cas  2200289   4500</leader>'
+    '<datafield tag="830" ind1=" " ind2="0"/></record><record/></collection>',
+]
+
+
+def check_equivalence(marcxml_texts: List[str]) -> int:
+    """
+    Compare this module's output with pymarc's for each MARCXML text, printing any differences.
+
+    Args:
+        marcxml_texts (List[str]): MARCXML documents to convert.
+
+    Returns:
+        int: The number of documents whose output differed.
+    """
+    differences = 0
+    for i, marcxml in enumerate(marcxml_texts):
+        expected = _marcxml_to_mrk_with_pymarc(marcxml)
+        converted = marcxml_to_mrk_records(marcxml)
+        if converted != expected:
+            differences += 1
+            print("Document {} differs:\npymarc:    {!r}\nconverter: {!r}".format(i, expected, converted))
+    print("{} of {} documents converted identically.".format(len(marcxml_texts) - differences, len(marcxml_texts)))
+    return differences
+
+
+def app() -> None:
+    parser = argparse.ArgumentParser(description="Check the MARCXML to MRK converter against pymarc.")
+    parser.add_argument("files", nargs="*", help="MARCXML files to use as well as the built-in samples")
+    # checking is all the module does when run now; --check is kept so older command lines still work
+    parser.add_argument("--check", "-c", action="store_true", help="compare output with pymarc's")
+    args = parser.parse_args()
+    marcxml_texts = list(SAMPLE_MARCXML)
+    for file_name in args.files:
+        marcxml_texts.append(Path(file_name).read_text(encoding="utf-8"))
+    if check_equivalence(marcxml_texts):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    app()
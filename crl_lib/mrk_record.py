@@ -0,0 +1,130 @@
+"""
+A MARC text (MRK) record split into its lines once, and indexed by tag, for code that looks up many fields in the same
+record.
+
+The lookups give the same results as the functions in crl_lib.marc_utilities, which search the whole record text with
+a regex on every call, for records with one field per line (as from MarcFileReader and the other readers).
+
+Usage:
+
+    from crl_lib.mrk_record import MrkRecord
+
+    mrk_record = MrkRecord(record)
+    title = mrk_record.get_field_subfield("245", "a")
+    holdings = mrk_record.get_fields_subfields("866", "a")
+    converter = mrk_record.holdings_converter
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from crl_lib.line_85x86x import Convert85x86x
+from crl_lib.marc_utilities import get_field_subfield_from_joined_string
+
+
+# "=245  " comes before the field data on each line
+FIELD_DATA_START = 6
+
+
+def get_line_subfields(line: str) -> List[str]:
+    """
+    Split a MARC line into its subfields, each starting with its code.
+
+    Args:
+        line (str): A whole line, like "=245  00$aTitle$bsubtitle".
+
+    Returns:
+        List[str]: The parts of the line after each "$", like ["aTitle", "bsubtitle"]. Parts left empty by a "$$" or a
+            "$" at the end of the line are kept.
+    """
+    return line[FIELD_DATA_START:].split("$")[1:]
+
+
+def get_last_subfield(subfields: List[str], subfield: str) -> str:
+    """
+    Get a subfield's data from a line split with get_line_subfields, as marc_utilities.get_field_subfield would find
+    it in the line: the last non-empty occurrence of the subfield.
+    """
+    for subfield_data in reversed(subfields):
+        if len(subfield_data) > 1 and subfield_data[0] == subfield:
+            return subfield_data[1:]
+    return ""
+
+
+def get_all_subfields(subfields: List[str], subfield: str) -> List[str]:
+    """
+    Get every non-empty occurrence of a subfield from a line split with get_line_subfields, as
+    marc_utilities.get_fields_subfields would find them in the line.
+    """
+    return [
+        subfield_data[1:] for subfield_data in subfields if len(subfield_data) > 1 and subfield_data[0] == subfield
+    ]
+
+
+class MrkRecord:
+    """
+    An MRK record's lines, indexed by tag in a single pass over the record.
+
+    Lines that don't look like fields ("=" then a tag then two spaces) are kept in lines but not indexed. Lines with
+    a carriage return in them are left out of the index too, as the marc_utilities regexes treat those differently.
+    Unlike the regexes, which would find "=245  " anywhere in the record, fields are only looked for at line starts.
+    """
+
+    __slots__ = ("record", "lines", "field_lines", "_holdings_converter")
+
+    def __init__(self, record: str) -> None:
+        self.record = record
+        self.lines = record.split("\n")
+        self.field_lines: Dict[str, List[str]] = defaultdict(list)
+        for line in self.lines:
+            if line[:1] == "=" and line[4:FIELD_DATA_START].isspace() and "\r" not in line:
+                self.field_lines[line[1:4]].append(line)
+        self._holdings_converter: Optional[Convert85x86x] = None
+
+    def get_lines(self, field: str) -> List[str]:
+        """Get the whole lines of a field that have data, in record order."""
+        return [line for line in self.field_lines.get(field, []) if len(line) > FIELD_DATA_START]
+
+    def get_field_subfield(self, field: str, subfield: Optional[str] = None) -> str:
+        """
+        Get the data of the first line of a field, or of a subfield in the first line that has it. Same arguments and
+        results as marc_utilities.get_field_subfield.
+        """
+        if not field:
+            return ""
+        if len(field) == 4:
+            field, subfield = get_field_subfield_from_joined_string(field)
+        for line in self.field_lines.get(field, []):
+            if not subfield:
+                if len(line) > FIELD_DATA_START:
+                    return line[FIELD_DATA_START:]
+                continue
+            subfield_data = get_last_subfield(get_line_subfields(line), subfield)
+            if subfield_data:
+                return subfield_data
+        return ""
+
+    def get_fields_subfields(self, field: str, subfield: Optional[str] = None) -> List[str]:
+        """
+        Get the data of every line of a field, or of every occurrence of a subfield in them. Same arguments and
+        results as marc_utilities.get_fields_subfields.
+        """
+        if not field:
+            return []
+        if len(field) == 4:
+            field, subfield = get_field_subfield_from_joined_string(field)
+        lines = self.get_lines(field)
+        if not subfield:
+            return [line[FIELD_DATA_START:] for line in lines]
+        data_list = []
+        for line in lines:
+            data_list.extend(get_all_subfields(get_line_subfields(line), subfield))
+        return data_list
+
+    @property
+    def holdings_converter(self) -> Convert85x86x:
+        """The record's 85x/86x holdings, converted the first time they're wanted."""
+        if self._holdings_converter is None:
+            self._holdings_converter = Convert85x86x(self.record)
+        return self._holdings_converter
+
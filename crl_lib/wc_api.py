@@ -1,12 +1,24 @@
 from typing import Union, List
 import io
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import bookops_worldcat
+import bookops_worldcat.errors
 import pymarc
 from typing import Dict, Union, List
 
 import crl_lib.api_keys
 import crl_lib.worldcat_api_token
 import crl_lib.local_marc_db
+import crl_lib.marcxml_to_mrk
+from crl_lib.api_rate_limiter import (
+    MAX_ATTEMPTS,
+    RateLimiter,
+    TransientApiError,
+    get_backoff_delay,
+    get_key_rate_limiter,
+)
 
 
 JSON_HEADER = {"Accept": "application/atom+json"}
@@ -15,11 +27,45 @@ JSON_HEADER = {"Accept": "application/atom+json"}
 class WcApi(crl_lib.worldcat_api_token.WorldcatApiToken):
     """
     Convenience class to work with old code. Works with the WorldCat Metadata API.
+
+    With use_all_keys, and more than one key enabled for the Metadata API in api_keys.yaml, requests are spread
+    round-robin over all of them. Each key gets its own token, session and rate limit, and a key that keeps failing
+    is rested for a while (see WorldcatApiToken.is_healthy) while the others carry on.
     """
 
-    def __init__(self, api_key: str = "", api_secret: str = "") -> None:
-        super().__init__(api_key=api_key, api_secret=api_secret)
+    def __init__(
+        self,
+        api_key: str = "",
+        api_secret: str = "",
+        not_found_ttl_days: int = crl_lib.local_marc_db.NOT_FOUND_TTL_DAYS,
+        rate_limiter: Union[None, RateLimiter] = None,
+        use_all_keys: bool = False,
+    ) -> None:
+        super().__init__(api_key=api_key, api_secret=api_secret, rate_limiter=rate_limiter)
         self.local_marc_db = crl_lib.local_marc_db.LocalMarcDb()
+        # OCLCs WorldCat didn't have are not requested again for this many days. 0 always requests them.
+        self.not_found_ttl_days = not_found_ttl_days
+
+        # one WorldcatApiToken per key when using several; empty means requests use this object's own key
+        self.api_key_tokens: List[crl_lib.worldcat_api_token.WorldcatApiToken] = []
+        self._next_api_key = 0
+        self._api_key_lock = threading.Lock()
+        if use_all_keys and not api_key:
+            api_key_tuples = crl_lib.worldcat_api_token.get_metadata_api_keys()
+            if len(api_key_tuples) > 1:
+                for key, secret in api_key_tuples:
+                    if rate_limiter is None:
+                        key_rate_limiter = get_key_rate_limiter(key)
+                    else:
+                        key_rate_limiter = RateLimiter(self.rate_limiter.max_rate)
+                    key_token = crl_lib.worldcat_api_token.WorldcatApiToken(
+                        api_key=key, api_secret=secret, rate_limiter=key_rate_limiter
+                    )
+                    # results and counts are gathered here, whichever key made the request
+                    key_token.counters = self.counters
+                    key_token.oclcs_not_found = self.oclcs_not_found
+                    key_token.oclcs_failed = self.oclcs_failed
+                    self.api_key_tokens.append(key_token)
 
     def fetch_marc_from_api(
         self,
@@ -33,14 +79,55 @@ class WcApi(crl_lib.worldcat_api_token.WorldcatApiToken):
         )
         return marc_record
 
-    def get_marcxml_from_oclc(self, oclc_number: Union[int, str]) -> str:
-        self.check_token()
-        with bookops_worldcat.MetadataSession(authorization=self.token) as session:
-            result = session.bib_get(oclc_number)
-            if result.status_code == 200:
-                marcxml = result.text
-                return marcxml
-        return ""
+    def close(self) -> None:
+        """
+        Close the API session and write any collected records to the local MARC database. Call at the end of a run.
+        """
+        self.close_session()
+        self.local_marc_db.write_collected_data_to_marc_db()
+
+    def set_pool_size(self, pool_size: int) -> None:
+        super().set_pool_size(pool_size)
+        for key_token in self.api_key_tokens:
+            key_token.set_pool_size(pool_size)
+
+    def close_session(self) -> None:
+        super().close_session()
+        for key_token in self.api_key_tokens:
+            key_token.close_session()
+
+    def check_tokens(self) -> None:
+        """Make sure every key in use has a current token. A key that can't get one is rested."""
+        if not self.api_key_tokens:
+            self.check_token()
+            return
+        for key_token in self.api_key_tokens:
+            try:
+                key_token.check_token()
+            except bookops_worldcat.errors.WorldcatAuthorizationError:
+                key_token.rest(crl_lib.worldcat_api_token.KEY_REST_SECONDS * 10)
+
+    def _choose_api_key_token(self) -> crl_lib.worldcat_api_token.WorldcatApiToken:
+        """Take the next healthy key in turn, or the one back soonest if they're all resting."""
+        with self._api_key_lock:
+            for _ in range(len(self.api_key_tokens)):
+                key_token = self.api_key_tokens[self._next_api_key]
+                self._next_api_key = (self._next_api_key + 1) % len(self.api_key_tokens)
+                if key_token.is_healthy():
+                    return key_token
+            return min(self.api_key_tokens, key=lambda key_token: key_token.resting_until)
+
+    def _request_marcxml(self, oclc_number: Union[int, str]) -> str:
+        """Make one request, with the next key in turn when using several."""
+        if not self.api_key_tokens:
+            return super()._request_marcxml(oclc_number)
+        key_token = self._choose_api_key_token()
+        try:
+            return key_token._request_marcxml(oclc_number)
+        except bookops_worldcat.errors.WorldcatAuthorizationError as err:
+            # the request can be retried with another key
+            key_token.rest(crl_lib.worldcat_api_token.KEY_REST_SECONDS * 10)
+            raise TransientApiError(str(err))
 
     def get_marc_from_oclc(
         self,
@@ -65,12 +152,115 @@ class WcApi(crl_lib.worldcat_api_token.WorldcatApiToken):
             marc_record = self.local_marc_db.get_marc_from_db(oclc_number, recent_only)
             if marc_record:
                 return marc_record
+            if self.local_marc_db.check_oclc_not_found(oclc_number, self.not_found_ttl_days):
+                return ""
         marcxml = self.get_marcxml_from_oclc(oclc_number)
+        self._collect_oclcs_not_found()
+        return self._get_marc_from_marcxml(marcxml, return_pymarc=return_pymarc)
+
+    def get_marc_from_oclcs(
+        self,
+        oclc_numbers: List[Union[int, str]],
+        recent_only: bool = False,
+        skip_db: bool = False,
+        workers: int = 1,
+    ) -> Dict[str, str]:
+        """
+        Get MARC records for a batch of OCLC numbers. Records not found in the local MARC database are requested from
+        the WorldCat Metadata API by a pool of worker threads, unless WorldCat recently reported them as not found.
+
+        Only the API requests are made from the worker threads. Database lookups, MARCXML conversion and database
+        writes all happen on the calling thread, so the local MARC database keeps a single writer. The workers share
+        this object's access token and rate limiter.
+
+        Requests that are throttled or fail with a server or connection error go on a retry queue, which is sent again
+        once the rest of the batch is done, after a backoff delay. OCLCs still failing after MAX_ATTEMPTS tries get a
+        blank string and are added to oclcs_failed.
+
+        Args:
+            oclc_numbers (List[Union[int, str]]): OCLC numbers as ints or strs. Duplicates are fetched once.
+            recent_only (bool, optional): Only return records from local database that are less than one year old. Defaults to False.
+            skip_db (bool, optional): Skip local MARC database. Defaults to False.
+            workers (int, optional): Maximum number of simultaneous API requests. Defaults to 1.
+
+        Returns:
+            Dict[str, str]: MARC records keyed by OCLC number as a string. Blank string for OCLCs with no record.
+        """
+        oclc_strs = list(dict.fromkeys(str(oclc_number) for oclc_number in oclc_numbers))
+        if skip_db:
+            marc_records: Dict[str, str] = {}
+        else:
+            marc_records = self.local_marc_db.get_marc_from_db_for_oclcs(oclc_strs, recent_only)
+            oclcs_not_found = self.local_marc_db.get_oclcs_not_found(
+                [oclc_str for oclc_str in oclc_strs if oclc_str not in marc_records], self.not_found_ttl_days
+            )
+            for oclc_str in oclcs_not_found:
+                marc_records[oclc_str] = ""
+        oclcs_to_fetch = [oclc_str for oclc_str in oclc_strs if oclc_str not in marc_records]
+
+        if not oclcs_to_fetch:
+            return marc_records
+
+        # get fresh tokens before the workers start, so they don't all try to refresh them at once
+        self.set_pool_size(workers)
+        self.check_tokens()
+        retry_queue = oclcs_to_fetch
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            for attempt in range(MAX_ATTEMPTS):
+                oclcs_to_request = retry_queue
+                retry_queue = []
+                retry_delay = 0.0
+                # map returns results in submission order
+                request_results = executor.map(self._try_request_marcxml, oclcs_to_request)
+                for oclc_str, (marcxml, retry_after) in zip(oclcs_to_request, request_results):
+                    if retry_after is None:
+                        marc_records[oclc_str] = self._get_marc_from_marcxml(marcxml)
+                    else:
+                        retry_queue.append(oclc_str)
+                        retry_delay = max(retry_delay, get_backoff_delay(attempt, retry_after))
+                if not retry_queue or attempt + 1 == MAX_ATTEMPTS:
+                    break
+                self.counters.add("retries", len(retry_queue))
+                time.sleep(retry_delay)
+        for oclc_str in retry_queue:
+            self.counters.add("failed")
+            self.oclcs_failed.add(oclc_str)
+            marc_records[oclc_str] = ""
+        self._collect_oclcs_not_found()
+        return marc_records
+
+    def _try_request_marcxml(self, oclc_str: str) -> tuple:
+        """
+        Make one request, for the worker threads. Returns the MARCXML and None, or a blank string and the server's
+        Retry-After (0 if it gave none) for a failure worth retrying.
+        """
+        try:
+            return self._request_marcxml(oclc_str), None
+        except TransientApiError as err:
+            return "", err.retry_after
+
+    def _collect_oclcs_not_found(self) -> None:
+        """Pass OCLCs the API reported as not found on to the local MARC database, from the calling thread."""
+        while self.oclcs_not_found:
+            self.local_marc_db.collect_oclc_not_found(self.oclcs_not_found.pop())
+
+    def _get_marc_from_marcxml(
+        self, marcxml: str, return_pymarc: bool = False
+    ) -> Union[str, pymarc.record.Record]:
+        """
+        Convert a MARCXML API response to MARC, and collect it for the local MARC database. pymarc is only used when a
+        pymarc Record is wanted; otherwise the MARCXML goes straight to MRK.
+        """
+        if not marcxml:
+            return ""
+        if return_pymarc is not True:
+            marc = crl_lib.marcxml_to_mrk.marcxml_to_mrk(marcxml)
+            if marc:
+                self.local_marc_db.collect_data_for_marc_db(marc)
+            return marc
         records = pymarc.marcxml.parse_xml_to_array(io.StringIO(marcxml))
         for record in records:
             if record:
                 self.local_marc_db.collect_data_for_marc_db(str(record))
-            if return_pymarc is True:
-                return record
-            return str(record)
+            return record
         return ""
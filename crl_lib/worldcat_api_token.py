@@ -1,19 +1,41 @@
+import time
 import datetime
+import threading
+import requests
 import bookops_worldcat
 import bookops_worldcat.errors
 import pymarc
 from bookops_worldcat import WorldcatAccessToken, MetadataSession
-from typing import Dict, Tuple, Union, List
+from typing import Dict, Tuple, Union, List, Set, Optional
 import crl_lib.api_keys
+from crl_lib.worldcat_token_cache import CachedWorldcatAccessToken
+from crl_lib.api_rate_limiter import (
+    MAX_ATTEMPTS,
+    ApiRequestCounters,
+    RateLimiter,
+    TransientApiError,
+    get_backoff_delay,
+    get_retry_after,
+    get_shared_rate_limiter,
+)
 
 JSON_HEADER = {"Accept": "application/atom+json"}
 SCOPES = {"metadata": "WorldCatMetadataAPI", "search": "wcapi"}
+# requests keeps up to this many connections open per host by default
+DEFAULT_POOL_SIZE = 10
+# a key that fails this many requests in a row is rested for KEY_REST_SECONDS
+KEY_FAILURE_THRESHOLD = 3
+KEY_REST_SECONDS = 60
 
 
 class WorldcatApiToken:
 
     def __init__(
-        self, api: str = "metadata", api_key: str = "", api_secret: str = ""
+        self,
+        api: str = "metadata",
+        api_key: str = "",
+        api_secret: str = "",
+        rate_limiter: Optional[RateLimiter] = None,
     ) -> None:
         if not api_key:
             api_key, api_secret = get_metadata_api_key()
@@ -21,21 +43,107 @@ class WorldcatApiToken:
         self.api_key = api_key
         self.api_secret = api_secret
         self.token: Union[None, bookops_worldcat.authorize.WorldcatAccessToken] = None
+        # worker threads share one token, so only one of them should refresh it
+        self._token_lock = threading.Lock()
+        # one long-lived session, so connections are kept alive between requests
+        self.session: Union[None, MetadataSession] = None
+        self.pool_size = DEFAULT_POOL_SIZE
+        self._session_lock = threading.Lock()
+        # OCLCs the API has answered with "not found"; added to from worker threads
+        self.oclcs_not_found: Set[str] = set()
+        # OCLCs still failing after MAX_ATTEMPTS tries, which say nothing about WorldCat having a record
+        self.oclcs_failed: Set[str] = set()
+        # all fetchers share one request budget unless given their own
+        if rate_limiter is None:
+            rate_limiter = get_shared_rate_limiter()
+        self.rate_limiter = rate_limiter
+        self.counters = ApiRequestCounters()
+        # the last response each thread got, since bookops errors don't carry it
+        self._responses = threading.local()
+        # health of this key, for spreading requests over several keys
+        self.consecutive_failures = 0
+        self.resting_until = 0.0
+
+    def is_healthy(self) -> bool:
+        """False while the key is resting after repeated failures."""
+        return time.monotonic() >= self.resting_until
+
+    def rest(self, seconds: float = KEY_REST_SECONDS) -> None:
+        """Take the key out of use for a while."""
+        self.resting_until = max(self.resting_until, time.monotonic() + seconds)
+
+    def _record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= KEY_FAILURE_THRESHOLD:
+            self.consecutive_failures = 0
+            self.rest()
 
     def get_token(self) -> None:
-        self.token = WorldcatAccessToken(
+        # other runs may already have a token for this key, in the cache in the CRL folder
+        self.token = CachedWorldcatAccessToken(
             key=self.api_key, secret=self.api_secret, scopes=SCOPES[self.api]
         )
 
     def check_token(self) -> None:
-        if not self.token:
-            self.get_token()
-        else:
-            check_time = datetime.datetime.now(
-                datetime.timezone.utc
-            ) + datetime.timedelta(minutes=2)
-            if check_time > self.token.token_expires_at:
+        with self._token_lock:
+            if not self.token:
                 self.get_token()
+            else:
+                check_time = datetime.datetime.now(
+                    datetime.timezone.utc
+                ) + datetime.timedelta(minutes=2)
+                if check_time > self.token.token_expires_at:
+                    self.get_token()
+
+    def get_session(self) -> MetadataSession:
+        """
+        Get the Metadata API session, creating it on first use.
+
+        The session is reused for every request, so its connections stay open
+        between calls. If check_token has replaced the access token since the
+        last call, the session is switched over to the new one.
+        """
+        self.check_token()
+        with self._session_lock:
+            if self.session is None:
+                self.session = self._create_session()
+            elif self.session.authorization is not self.token:
+                self.session.authorization = self.token
+                self.session.headers.update(
+                    {"Authorization": f"Bearer {self.token.token_str}"}
+                )
+            return self.session
+
+    def _create_session(self) -> MetadataSession:
+        session = MetadataSession(authorization=self.token)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.hooks["response"].append(self._remember_response)
+        return session
+
+    def _remember_response(self, response: requests.Response, *args, **kwargs) -> None:
+        self._responses.last = response
+
+    def set_pool_size(self, pool_size: int) -> None:
+        """
+        Make sure the session can keep at least pool_size connections open, for
+        use from that many threads at once. The session is rebuilt on its next
+        use if the pool has to grow.
+        """
+        if pool_size <= self.pool_size:
+            return
+        self.pool_size = pool_size
+        self.close_session()
+
+    def close_session(self) -> None:
+        """Close the session and any connections it holds open."""
+        with self._session_lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
 
     def fetch_marc_from_api(
         self, oclc_number: Union[int, str]
@@ -47,12 +155,66 @@ class WorldcatApiToken:
         return marc_record
 
     def get_marcxml_from_oclc(self, oclc_number: Union[int, str]) -> str:
-        self.check_token()
-        with bookops_worldcat.MetadataSession(authorization=self.token) as session:
+        """
+        Get the MARCXML for an OCLC number, or a blank string if there's no
+        record. Throttled requests, server errors and connection errors are
+        retried with backoff, up to MAX_ATTEMPTS tries in all; an OCLC that
+        still fails goes in oclcs_failed.
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return self._request_marcxml(oclc_number)
+            except TransientApiError as err:
+                if attempt + 1 < MAX_ATTEMPTS:
+                    self.counters.add("retries")
+                    time.sleep(get_backoff_delay(attempt, err.retry_after))
+        self.counters.add("failed")
+        self.oclcs_failed.add(str(oclc_number))
+        return ""
+
+    def _request_marcxml(self, oclc_number: Union[int, str]) -> str:
+        """
+        Make one rate-limited request for an OCLC's MARCXML. Raises
+        TransientApiError for failures worth retrying; other failures give a
+        blank string, as does "not found", which also goes in oclcs_not_found.
+        """
+        session = self.get_session()
+        self.rate_limiter.acquire()
+        self._responses.last = None
+        self.counters.add("requests")
+        try:
             result = session.bib_get(oclc_number)
-            if result.status_code == 200:
-                marcxml = result.text
-                return marcxml
+        except bookops_worldcat.errors.WorldcatRequestError as err:
+            # bookops raises on any error status, including "not found"
+            response = self._responses.last
+            if response is None:
+                self.counters.add("connection_errors")
+                self._record_failure()
+                raise TransientApiError(str(err))
+            if response.status_code == 404:
+                self.counters.add("not_found")
+                self.oclcs_not_found.add(str(oclc_number))
+                self.oclcs_failed.discard(str(oclc_number))
+                return ""
+            if response.status_code == 429:
+                self.counters.add("throttled")
+                retry_after = get_retry_after(response)
+                self.rate_limiter.throttled(retry_after)
+                self._record_failure()
+                raise TransientApiError(str(err), retry_after)
+            if response.status_code >= 500:
+                self.counters.add("server_errors")
+                self._record_failure()
+                raise TransientApiError(str(err), get_retry_after(response))
+            self.counters.add("other_errors")
+            return ""
+        self.rate_limiter.succeeded()
+        self.consecutive_failures = 0
+        self.oclcs_failed.discard(str(oclc_number))
+        if result.status_code == 200:
+            self.counters.add("records")
+            marcxml = result.text
+            return marcxml
         return ""
 
     def get_marc_from_oclc(
@@ -98,6 +260,23 @@ def get_metadata_api_key() -> Tuple[str, str]:
     raise Exception("No API key for the Metadata API defined.")
 
 
+def get_metadata_api_keys() -> List[Tuple[str, str]]:
+    """Get every distinct key and secret enabled for the Metadata API, in the order they're configured."""
+    api_keys = crl_lib.api_keys.OclcApiKeys()
+    api_key_tuples: List[Tuple[str, str]] = []
+    for name in api_keys.api_keys:
+        if api_keys.api_keys[name]["METADATA"]:
+            api_key_tuple = (
+                api_keys.api_keys[name]["KEY"],
+                api_keys.api_keys[name]["SECRET"],
+            )
+            if api_key_tuple not in api_key_tuples:
+                api_key_tuples.append(api_key_tuple)
+    if not api_key_tuples:
+        raise Exception("No API key for the Metadata API defined.")
+    return api_key_tuples
+
+
 def test_metadata_api_key(api_key: str, api_secret: str) -> bool:
     try:
         token = WorldcatAccessToken(api_key, api_secret, scopes=SCOPES["metadata"])
@@ -0,0 +1,154 @@
+"""
+Keep WorldCat access tokens in the CRL folder, so runs started close together share one token instead of each
+authenticating again.
+
+CachedWorldcatAccessToken works like bookops_worldcat's WorldcatAccessToken, but looks in the cache file before
+asking the OAuth server for a token, and saves the tokens it gets. bookops asks the token for a new one when it
+expires, which goes through the cache as well.
+
+The cache file is only readable by the user. Reading and refreshing happen under a lock file, so when several
+processes start at once only one of them requests a token and the rest pick it up from the cache.
+
+Usage:
+
+    from crl_lib.worldcat_token_cache import CachedWorldcatAccessToken
+
+    token = CachedWorldcatAccessToken(key=api_key, secret=api_secret, scopes="WorldCatMetadataAPI")
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import datetime
+import contextlib
+from pathlib import Path
+from typing import Dict, Iterator
+
+from bookops_worldcat import WorldcatAccessToken
+
+from crl_lib import CRL_FOLDER
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+
+TOKEN_CACHE_LOCATION = Path.joinpath(CRL_FOLDER, "worldcat_tokens.json")
+TOKEN_CACHE_LOCK_LOCATION = Path.joinpath(CRL_FOLDER, "worldcat_tokens.lock")
+# cached tokens this close to expiring are replaced; more than the two minutes WorldcatApiToken.check_token allows
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+TOKEN_EXPIRY_FORMAT = "%Y-%m-%d %H:%M:%S%z"
+
+
+@contextlib.contextmanager
+def _locked(lock_location: Path) -> Iterator[None]:
+    """Hold an exclusive lock on a lock file, waiting for other processes to let go of it."""
+    with open(lock_location, "a+b") as lock_file:
+        if sys.platform == "win32":
+            while True:
+                try:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after about ten seconds
+                    time.sleep(0.1)
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _read_token_cache(cache_location: Path) -> Dict[str, dict]:
+    try:
+        with open(cache_location, "r", encoding="utf-8") as fin:
+            token_cache = json.load(fin)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(token_cache, dict):
+        return {}
+    return token_cache
+
+
+def _write_token_cache(cache_location: Path, token_cache: Dict[str, dict]) -> None:
+    """Replace the cache file in one step, creating it readable only by the user."""
+    temp_location = cache_location.with_name("{}.{}.tmp".format(cache_location.name, os.getpid()))
+    file_descriptor = os.open(temp_location, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(file_descriptor, "w", encoding="utf-8") as fout:
+        json.dump(token_cache, fout)
+    os.replace(temp_location, cache_location)
+
+
+class CachedWorldcatAccessToken(WorldcatAccessToken):
+    """
+    A WorldcatAccessToken that's shared through a cache file in the CRL folder. Tokens are cached per key and
+    scope, under a hash of the two.
+    """
+
+    cache_location = TOKEN_CACHE_LOCATION
+    lock_location = TOKEN_CACHE_LOCK_LOCATION
+
+    def _cache_key(self) -> str:
+        return hashlib.sha256("{}\n{}".format(self.key, self.scopes).encode("utf-8")).hexdigest()
+
+    def _request_token(self) -> None:
+        """Take the token from the cache if it has a fresh one, otherwise request one and cache it."""
+        try:
+            self.cache_location.parent.mkdir(parents=True, exist_ok=True)
+            with _locked(self.lock_location):
+                token_cache = _read_token_cache(self.cache_location)
+                if self._load_cached_token(token_cache.get(self._cache_key(), {})):
+                    return
+                super()._request_token()
+                self._save_token(token_cache)
+        except OSError as e:
+            logging.debug("WorldCat token cache unavailable ({}); requesting a token directly".format(e))
+            super()._request_token()
+
+    def _save_token(self, token_cache: Dict[str, dict]) -> None:
+        token_cache[self._cache_key()] = {
+            "token_str": self.token_str,
+            "token_type": self.token_type,
+            "expires_at": self.token_expires_at.strftime(TOKEN_EXPIRY_FORMAT),
+        }
+        self._drop_expired_tokens(token_cache)
+        try:
+            _write_token_cache(self.cache_location, token_cache)
+        except OSError as e:
+            logging.debug("Could not save the WorldCat token cache ({})".format(e))
+
+    def _load_cached_token(self, cached_token: dict) -> bool:
+        """Use a cached token if it won't expire within TOKEN_REFRESH_MARGIN. Returns True if it was used."""
+        try:
+            expires_at = datetime.datetime.strptime(cached_token["expires_at"], TOKEN_EXPIRY_FORMAT)
+            token_str = cached_token["token_str"]
+        except (KeyError, TypeError, ValueError):
+            return False
+        if expires_at - TOKEN_REFRESH_MARGIN < datetime.datetime.now(datetime.timezone.utc):
+            return False
+        self.token_str = token_str
+        self.token_type = cached_token.get("token_type", "bearer")
+        self.token_expires_at = expires_at
+        return True
+
+    @staticmethod
+    def _drop_expired_tokens(token_cache: Dict[str, dict]) -> None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for cache_key in list(token_cache):
+            try:
+                expires_at = datetime.datetime.strptime(token_cache[cache_key]["expires_at"], TOKEN_EXPIRY_FORMAT)
+            except (KeyError, TypeError, ValueError):
+                expires_at = now
+            if expires_at <= now:
+                del token_cache[cache_key]
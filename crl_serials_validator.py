@@ -6,6 +6,10 @@ Usage:
     python crl_serials_validator.py  # run the Validator with a command-line interface
     python crl_serials_validator.py -a  # run the Validator in automated (headless) mode
     python crl_serials_validator.py --headless  # run the Validator in automated (headless) mode
+    python crl_serials_validator.py -a --workers 4  # headless mode, with 4 simultaneous WorldCat requests
+    python crl_serials_validator.py -a -w 8 --all_keys  # as above, spread over every Metadata API key
+    python crl_serials_validator.py -a --processes 4  # headless mode, checking 4 input files at once
+    python crl_serials_validator.py -a --marc_processes 4  # headless mode, reading large MARC files with 4 processes
     python crl_serials_validator.py -b  # set bulk/automated/headless mode preferences
     python crl_serials_validator.py --bulk_prefs  # set bulk/automated/headless mode preferences
     python crl_serials_validator.py -s  # set WorldCat Search API keys on the command line
@@ -21,6 +25,7 @@ from validator_lib.validator_controller import ValidatorController
 from validator_lib.command_line_interface import SimpleValidatorInterface
 from validator_lib.bulk_validator_preferences import run_bulk_config
 import validator_lib.validator_file_locations
+from crl_lib.local_marc_db import NOT_FOUND_TTL_DAYS
 
 
 __version__ = '2025.6'
@@ -41,18 +46,41 @@ def parse_command_line_args():
     parser.add_argument(
         "--file_locations", "-f", action="store_true", 
         help="Show the location of the application's data files.")
+    parser.add_argument(
+        "--workers", "-w", type=int, default=1, 
+        help="Number of simultaneous WorldCat API requests. Defaults to 1.")
+    parser.add_argument(
+        "--not_found_ttl", type=int, default=NOT_FOUND_TTL_DAYS, 
+        help="Days before OCLCs not found in WorldCat are requested again. "
+        "0 always requests them. Defaults to {}.".format(NOT_FOUND_TTL_DAYS))
+    parser.add_argument(
+        "--all_keys", action="store_true", 
+        help="Spread WorldCat requests over every Metadata API key.")
+    parser.add_argument(
+        "--processes", "-j", type=int, default=1, 
+        help="Number of input files checked at once in headless mode. "
+        "Defaults to 1.")
+    parser.add_argument(
+        "--marc_processes", "-m", type=int, default=1, 
+        help="Number of processes checking the records of a large MARC "
+        "input file. Defaults to 1.")
     args = parser.parse_args()
     return args
 
 
-def headless_app():
+def headless_app(
+        workers=1, not_found_ttl_days=NOT_FOUND_TTL_DAYS, use_all_keys=False, 
+        processes=1, marc_processes=1):
     """
     Headless/bulk mode automatically starts processing input files, without 
     providing the opportunity to enter API keys, select issues, etc. Those 
     should be done either with the normal process or by setting them in bulk 
     using the bulk_prefs (b) option and the set_keys (s) option.
     """
-    vc = ValidatorController(headless_mode=True)
+    vc = ValidatorController(
+        headless_mode=True, workers=workers, 
+        not_found_ttl_days=not_found_ttl_days, use_all_keys=use_all_keys, 
+        processes=processes, marc_processes=marc_processes)
     vc.run_checks_process()
 
 
@@ -72,6 +100,9 @@ if __name__ == "__main__":
     if args.bulk_prefs is True:
         bulk_preferences()
     elif args.headless is True:
-        headless_app()
+        headless_app(
+            workers=args.workers, not_found_ttl_days=args.not_found_ttl, 
+            use_all_keys=args.all_keys, processes=args.processes, 
+            marc_processes=args.marc_processes)
     else:
         SimpleValidatorInterface(args)
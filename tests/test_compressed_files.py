@@ -0,0 +1,49 @@
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from crl_lib.compressed_files import get_uncompressed_name, open_input_file
+from validator_lib.utilities import get_input_file_format
+
+
+TEST_INPUTS_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_inputs")
+TEST_MRK_NAME = "TESTINST1.2021.10.02.mrk"
+
+
+class CompressedFileNameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        with open(os.path.join(TEST_INPUTS_FOLDER, TEST_MRK_NAME), "rb") as fin:
+            self.mrk_data = fin.read()
+
+    def test_dotted_date_zip_named_by_member(self):
+        zip_location = os.path.join(self.folder, "TESTINST1.2021.10.02.zip")
+        with zipfile.ZipFile(zip_location, "w") as zip_file:
+            zip_file.writestr(TEST_MRK_NAME, self.mrk_data)
+        self.assertEqual(get_uncompressed_name(zip_location), TEST_MRK_NAME)
+        self.assertEqual(get_input_file_format(zip_location), "mrk")
+        with open_input_file(zip_location) as fin:
+            self.assertEqual(fin.read(), self.mrk_data)
+
+    def test_zip_member_in_folder(self):
+        zip_location = os.path.join(self.folder, "holdings.zip")
+        with zipfile.ZipFile(zip_location, "w") as zip_file:
+            zip_file.writestr("holdings/", b"")
+            zip_file.writestr("holdings/" + TEST_MRK_NAME, self.mrk_data)
+        self.assertEqual(get_uncompressed_name(zip_location), TEST_MRK_NAME)
+
+    def test_gz_named_by_dropping_ending(self):
+        gz_location = os.path.join(self.folder, TEST_MRK_NAME + ".gz")
+        with gzip.open(gz_location, "wb") as fout:
+            fout.write(self.mrk_data)
+        self.assertEqual(get_uncompressed_name(gz_location), TEST_MRK_NAME)
+        self.assertEqual(get_input_file_format(gz_location), "mrk")
+
+
+if __name__ == "__main__":
+    unittest.main()
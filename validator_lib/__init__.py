@@ -19,6 +19,8 @@ VALIDATOR_OUTPUT_FOLDER = os.path.join(os.getcwd(), "output")
 
 VALIDATOR_LOGS_FOLDER = os.path.join(os.getcwd(), "logs")
 LOG_FILE_LOCATION = os.path.join(VALIDATOR_LOGS_FOLDER, LOG_FILE_NAME)
+LOG_FORMAT = "%(asctime)s\t%(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 
 def instantiate_folders() -> None:
@@ -51,8 +53,8 @@ def set_logging() -> None:
         filename=LOG_FILE_LOCATION,
         level=log_level,
         filemode="a",
-        format="%(asctime)s\t%(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
+        format=LOG_FORMAT,
+        datefmt=LOG_DATE_FORMAT,
     )
 
 
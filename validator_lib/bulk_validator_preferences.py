@@ -6,6 +6,7 @@ from collections import OrderedDict
 
 from validator_lib.validator_config import ValidatorConfig
 from validator_lib.choose_input_file_fields import InputFields
+from validator_lib.utilities import MARC_INPUT_FORMATS
 
 
 def get_yes_no_response(question):
@@ -53,7 +54,7 @@ def pretty_print_disqualifying_issues(disqualifying_issues):
 class BulkConfig(ValidatorConfig):
 
     file_endings = InputFields.spreadsheet_file_endings.copy()
-    marc_file_endings = {'mrk'}
+    marc_file_endings = MARC_INPUT_FORMATS.copy()
 
     def __init__(self):
         super().__init__()
@@ -13,6 +13,7 @@ import sys
 
 from validator_lib.validator_config import ValidatorConfig
 from validator_lib.terminal_gui_utilities import print_terminal_page_header
+from validator_lib.utilities import is_marc_input_file
 
 
 class InputFields:
@@ -124,9 +125,7 @@ class InputFieldsChooser:
             elif user_choice.isdigit():
                 try:
                     wanted_file = self.all_input_files[int(user_choice) - 1]
-                    if wanted_file.lower().endswith(
-                        "mrk"
-                    ) or wanted_file.lower().endswith("mrc"):
+                    if is_marc_input_file(wanted_file):
                         self.get_file_fields(wanted_file, self.marc_cats)
                     else:
                         self.get_file_fields(wanted_file, self.spreadsheet_cats)
@@ -232,7 +231,7 @@ class InputFieldsChooser:
         )
         user_choice = input(colored("Your choice: ", "cyan"))
         if user_choice.lower().startswith("n"):
-            if input_file.lower().endswith("mrk") or input_file.lower().endswith("mrc"):
+            if is_marc_input_file(input_file):
                 print(self.marc_instructions)
             else:
                 print(self.spreadsheet_instructions)
@@ -277,9 +276,7 @@ class InputFieldsChooser:
         field_validation_warning = ""
         if not field_data:
             field_validation_warning = "Nothing entered."
-        elif not input_file.lower().endswith("mrk") and not input_file.lower().endswith(
-            "mrc"
-        ):
+        elif not is_marc_input_file(input_file):
             # Spreadsheets
             if not field_data.isdigit():
                 field_validation_warning = (
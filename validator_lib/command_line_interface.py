@@ -17,7 +17,11 @@ class SimpleValidatorInterface:
 
         self.args = args
         self.controller = ValidatorController(
-            headless_mode=False, papr_output=self.args.papr)
+            headless_mode=False, papr_output=self.args.papr, 
+            workers=self.args.workers, 
+            not_found_ttl_days=self.args.not_found_ttl, 
+            use_all_keys=self.args.all_keys, 
+            marc_processes=self.args.marc_processes)
 
         question_map = self.get_question_map()
         
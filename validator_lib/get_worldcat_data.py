@@ -1,7 +1,11 @@
 import logging
+import zlib
 
 from crl_lib.wc_api import WcApi
-from crl_lib.marc_fields import MarcFields, WorldCatMarcFields
+from crl_lib.local_marc_db import NOT_FOUND_TTL_DAYS
+from crl_lib.marc_fields import (
+    MarcFields, WorldCatMarcFields, MarcFieldsExtractor, stringify_marc_data, 
+    MARC_FIELDS_VERSION)
 
 from validator_lib import CRL_FOLDER
 
@@ -16,6 +20,83 @@ WANTED_WORLDCAT_DATA_CATEGORIES = [
     'succeeding_oclcs', 'other_oclcs', 'numbering_peculiarities'
 ]
 
+# Bump this when get_worldcat_data_category changes how it formats data. 
+# Extracts saved in the local MARC database are only used if they match the 
+# MarcFields version, this number and the category list.
+WORLDCAT_EXTRACT_FORMAT = 1
+WORLDCAT_EXTRACT_VERSION = '{}.{}.{}'.format(
+    MARC_FIELDS_VERSION, WORLDCAT_EXTRACT_FORMAT, 
+    zlib.crc32(','.join(WANTED_WORLDCAT_DATA_CATEGORIES).encode('utf8')))
+
+
+def get_marc_fields_category(cat):
+    """The MarcFields data category behind a WorldCat data category."""
+    if cat.startswith('wc_'):
+        cat = cat.replace('wc_', '')
+    elif cat.startswith('008_year'):
+        cat = cat.replace('008_', '')
+    elif 'including_362' in cat:
+        if cat == 'start_including_362':
+            cat = 'combined_start_year'
+        elif cat == 'end_including_362':
+            cat = 'combined_end_year'
+    return cat
+
+
+def clean_worldcat_data_category(cat, cat_data):
+    """Take the fill characters out of the 008 place and language codes."""
+    if cat == 'place' or cat == 'lang':
+        cat_data = cat_data.replace('\\', '')
+    return cat_data
+
+
+# the getters for every category, looked up once
+WORLDCAT_DATA_EXTRACTOR = MarcFieldsExtractor(
+    {cat: get_marc_fields_category(cat) 
+     for cat in WANTED_WORLDCAT_DATA_CATEGORIES}, 
+    WorldCatMarcFields, stringify=True)
+
+
+class WorldCatDataCache:
+    """
+    Extracted WorldCat data for every OCLC seen during a run, so that an OCLC
+    repeated across holdings, locations or input files is only fetched and 
+    parsed once.
+
+    Data is stored under the OCLC it was requested with, and also under the 
+    WorldCat OCLC and 019 OCLCs of the record found, since those all resolve to 
+    the same record.
+    """
+    def __init__(self):
+        self.worldcat_data = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, oclc):
+        return str(oclc) in self.worldcat_data
+
+    def get(self, oclc):
+        """Get the stored data dict for an OCLC, or None if it hasn't been seen."""
+        worldcat_data = self.worldcat_data.get(str(oclc))
+        if worldcat_data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return worldcat_data
+
+    def add(self, oclc, worldcat_data):
+        self.worldcat_data[str(oclc)] = worldcat_data
+        if not worldcat_data['wc_oclc']:
+            return
+        self.worldcat_data.setdefault(worldcat_data['wc_oclc'], worldcat_data)
+        for oclc_019 in worldcat_data['oclcs_019'].split('; '):
+            if oclc_019:
+                self.worldcat_data.setdefault(oclc_019, worldcat_data)
+
+    def log_cache_counts(self):
+        logging.info('WorldCat data cache: {} hits, {} misses'.format(
+            self.hits, self.misses))
+
 
 class WorldCatMarcDataExtractor:
     """
@@ -26,16 +107,48 @@ class WorldCatMarcDataExtractor:
     database, processes them, and exports the results to the local database.
 
     Note that there's no analysis in this object, just pure data gathering.
+
+    MARC for a batch of OCLCs can be gathered ahead of time with 
+    prefetch_marc_for_oclcs. That looks the whole batch up in the local MARC 
+    database in a few queries and, with workers set above 1, requests the 
+    rest from WorldCat concurrently.
     """
-    def __init__(self):
+    def __init__(
+        self, workers=1, worldcat_data_cache=None, 
+        not_found_ttl_days=NOT_FOUND_TTL_DAYS, use_all_keys=False):
         logging.info('Getting WorldCat data.')
-        self.wc_api = WcApi()
+        self.wc_api = WcApi(
+            not_found_ttl_days=not_found_ttl_days, use_all_keys=use_all_keys)
+        if self.wc_api.api_key_tokens:
+            logging.info('Using {} Metadata API keys.'.format(
+                len(self.wc_api.api_key_tokens)))
+        self.workers = workers
+        if worldcat_data_cache is None:
+            worldcat_data_cache = WorldCatDataCache()
+        self.worldcat_data_cache = worldcat_data_cache
+        self.prefetched_marc = {}
+        self.prefetched_extracts = {}
+        self.prefetched_oclcs = set()
         self.no_worldcat_data_found = []
+        self.worldcat_requests_failed = []
         self.no_oclc_in_input = 0
 
+    def close(self):
+        """
+        Close the WorldCat API session at the end of a run, and log the API 
+        request counts.
+        """
+        if self.wc_api.counters.counts['requests']:
+            logging.info(self.wc_api.counters.summary())
+        self.wc_api.close()
+
     def log_worldcat_data_not_found(self):
         for oclc in self.no_worldcat_data_found:
             logging.info('No WorldCat data found for OCLC {}'.format(oclc))
+        for oclc in self.worldcat_requests_failed:
+            logging.warning(
+                'WorldCat API request failed for OCLC {}; '
+                'it will be requested again next time'.format(oclc))
         if self.no_oclc_in_input > 0:
             if self.no_oclc_in_input == 1:
                 title_word = 'title'
@@ -44,21 +157,79 @@ class WorldCatMarcDataExtractor:
             logging.info('{} {} without an OCLC number'.format(
                 self.no_oclc_in_input, title_word))
         self.no_worldcat_data_found = []
+        self.worldcat_requests_failed = []
         self.no_oclc_in_input = 0
 
+    def check_request_failed(self, oclc):
+        """
+        True if the API couldn't be reached for an OCLC, as opposed to having 
+        no record for it.
+        """
+        return str(oclc) in self.wc_api.oclcs_failed
+
+    @staticmethod
+    def check_for_oclc(oclc):
+        if not oclc or str(oclc) == 'None' or str(oclc).lower() == 'null':
+            return False
+        return True
+
+    def prefetch_marc_for_oclcs(self, oclcs):
+        """
+        Get MARC for a batch of OCLCs. Data already extracted from cached 
+        records comes from the local MARC database in bulk, followed by cached 
+        records without a current extract and OCLCs recently found not to be 
+        in WorldCat, which are given blank MARC. With more than one worker, the 
+        misses are then requested from WorldCat with up to self.workers 
+        simultaneous requests; otherwise they are left to be fetched one at a 
+        time as they come up.
+
+        The results replace any earlier prefetched batch.
+        """
+        oclcs = [
+            str(oclc) for oclc in oclcs 
+            if self.check_for_oclc(oclc) and oclc not in self.worldcat_data_cache]
+        self.prefetched_oclcs = set(oclcs)
+        local_marc_db = self.wc_api.local_marc_db
+        self.prefetched_extracts = local_marc_db.get_extracts_from_db_for_oclcs(
+            oclcs, WORLDCAT_EXTRACT_VERSION, recent_only=True)
+        oclcs = [oclc for oclc in oclcs if oclc not in self.prefetched_extracts]
+        self.prefetched_marc = local_marc_db.get_marc_from_db_for_oclcs(
+            oclcs, recent_only=True)
+        oclcs_not_found = local_marc_db.get_oclcs_not_found(
+            [oclc for oclc in oclcs if oclc not in self.prefetched_marc], 
+            self.wc_api.not_found_ttl_days)
+        for oclc in oclcs_not_found:
+            self.prefetched_marc[oclc] = ''
+        if self.workers > 1:
+            oclcs_to_fetch = [
+                oclc for oclc in oclcs if oclc not in self.prefetched_marc]
+            self.prefetched_marc.update(self.wc_api.get_marc_from_oclcs(
+                oclcs_to_fetch, recent_only=True, skip_db=True, 
+                workers=self.workers))
+
     def get_marc_fields_object_from_oclc(self, oclc):
         """
         Get a WorldCatMarcFields object from an OCLC number. Returns None if no
         MARC is found.
         """
-        if not oclc or str(oclc) == 'None' or str(oclc).lower() == 'null':
+        if not self.check_for_oclc(oclc):
             self.no_oclc_in_input += 1
             return None
 
-        marc = self.wc_api.fetch_marc_from_api(oclc, recent_only=True)
+        oclc_str = str(oclc)
+        if oclc_str in self.prefetched_marc:
+            marc = self.prefetched_marc[oclc_str]
+        else:
+            # no need to check the local database again after a prefetch
+            marc = self.wc_api.fetch_marc_from_api(
+                oclc, recent_only=True, 
+                skip_db=oclc_str in self.prefetched_oclcs)
 
         if not marc:
-            self.no_worldcat_data_found.append(oclc)
+            if self.check_request_failed(oclc):
+                self.worldcat_requests_failed.append(oclc)
+            else:
+                self.no_worldcat_data_found.append(oclc)
             return None
 
         mf = WorldCatMarcFields(
@@ -74,26 +245,10 @@ class WorldCatMarcDataExtractor:
         no data object included (which should mean that the title wasn't found in
         WorldCat for one reason or another.)
         """
-        if cat.startswith('wc_'):
-            cat = cat.replace('wc_', '')
-        elif cat.startswith('008_year'):
-            cat = cat.replace('008_', '')
-        elif 'including_362' in cat:
-            if cat == 'start_including_362':
-                cat = 'combined_start_year'
-            elif cat == 'end_including_362':
-                cat = 'combined_end_year'
-
+        cat = get_marc_fields_category(cat)
         if mf:
-            cat_data = mf.get_data(cat)
-            if not cat_data and str(cat_data) != '0':
-                cat_data = ''
-            elif isinstance(cat_data, (list, tuple)):
-                cat_data = '; '.join(cat_data)
-            else:
-                cat_data = str(cat_data)
-            if cat == 'place' or cat == 'lang':
-                cat_data = cat_data.replace('\\', '')
+            cat_data = stringify_marc_data(mf.get_data(cat))
+            cat_data = clean_worldcat_data_category(cat, cat_data)
         else:
             cat_data = ''
         return cat_data
@@ -102,10 +257,35 @@ class WorldCatMarcDataExtractor:
         """
         Get a dict of WorldCat MARC data related to a title, from an OCLC 
         number. 
+
+        Data for OCLCs seen before in the run comes from the cache, and data 
+        extracted in earlier runs from the local MARC database, without 
+        parsing the MARC again. The dict returned may be shared, so it 
+        shouldn't be changed.
         """
+        if self.check_for_oclc(oclc):
+            worldcat_data = self.worldcat_data_cache.get(oclc)
+            if worldcat_data is not None:
+                if not worldcat_data['wc_oclc']:
+                    self.no_worldcat_data_found.append(oclc)
+                return worldcat_data
+            if str(oclc) in self.prefetched_extracts:
+                worldcat_data = self.prefetched_extracts[str(oclc)]
+                self.worldcat_data_cache.add(oclc, worldcat_data)
+                return worldcat_data
+
         mf = self.get_marc_fields_object_from_oclc(oclc)
-        worldcat_data = {}
-        for cat in WANTED_WORLDCAT_DATA_CATEGORIES:
-            cat_data = self.get_worldcat_data_category(mf, cat)
-            worldcat_data[cat] = cat_data
+        if mf:
+            worldcat_data = WORLDCAT_DATA_EXTRACTOR.extract(mf)
+            for cat in ('place', 'lang'):
+                worldcat_data[cat] = clean_worldcat_data_category(
+                    cat, worldcat_data[cat])
+        else:
+            worldcat_data = {cat: '' for cat in WANTED_WORLDCAT_DATA_CATEGORIES}
+        # a failed request may work later in the run
+        if self.check_for_oclc(oclc) and not self.check_request_failed(oclc):
+            self.worldcat_data_cache.add(oclc, worldcat_data)
+        if worldcat_data['wc_oclc']:
+            self.wc_api.local_marc_db.collect_extract_for_marc_db(
+                worldcat_data['wc_oclc'], WORLDCAT_EXTRACT_VERSION, worldcat_data)
         return worldcat_data
@@ -360,23 +360,23 @@ class ReviewWorkbookPrinter:
             output_filename = '{} {} records.mrk'.format(inst, good_or_bad)
             output_file_location = os.path.join(
                 self.output_folder, output_filename)
-            output_file_location = validator_lib.utilities.get_unused_filename(
+            output_file_location = validator_lib.utilities.reserve_unused_filename(
                 output_file_location)
 
-            with open(output_file_location, 'w', encoding='utf8') as fout:
-                if good_or_bad == 'good':
-                    for marc in self.good_marc[inst]:
-                        fout.write(marc + '\n\n')
-                elif good_or_bad == 'bad':
-                    for marc in self.bad_marc[inst]:
-                        fout.write(marc + '\n\n')
+            with validator_lib.utilities.atomic_output_file(
+                    output_file_location, reserved=True) as temp_location:
+                with open(temp_location, 'w', encoding='utf8') as fout:
+                    if good_or_bad == 'good':
+                        for marc in self.good_marc[inst]:
+                            fout.write(marc + '\n\n')
+                    elif good_or_bad == 'bad':
+                        for marc in self.bad_marc[inst]:
+                            fout.write(marc + '\n\n')
 
     def make_workbooks(self):
         for inst in self.outputs:
             output_filename = '{} for review.xlsx'.format(inst)
             output_file_location = os.path.join(self.output_folder, output_filename)
-            output_file_location = validator_lib.utilities.get_unused_filename(
-                output_file_location)
 
             for_review_list, for_review_special_rows = self.make_error_worksheet(self.outputs[inst]['for_review'])
             error_count_output = self.make_error_counts_output(inst)
@@ -432,7 +432,6 @@ class ReviewWorkbookPrinter:
                 error_filename = '{} errors.xlsx'.format(inst)
                 error_file_location = os.path.join(
                     self.output_folder, error_filename)
-                error_file_location = validator_lib.utilities.get_unused_filename(error_file_location)
                 error_pages['Checklist'] = {
                     'data': self.error_outputs[inst], 
                     'number_columns': checklist_number_columns
@@ -454,7 +453,10 @@ class ReviewWorkbookPrinter:
                     'special_formats': for_review_special_formats
                     }
 
-                CRLXlsxWriter(error_file_location, error_pages)
+                error_file_location = validator_lib.utilities.reserve_unused_filename(error_file_location)
+                with validator_lib.utilities.atomic_output_file(
+                        error_file_location, reserved=True) as temp_location:
+                    CRLXlsxWriter(temp_location, error_pages)
 
             if self.print_for_review is True:
                 output_pages['For review'] = {
@@ -468,12 +470,16 @@ class ReviewWorkbookPrinter:
                         'data': self.line_583_validation_output
                         }
 
-            if self.running_headless is True:
-                self.print_headless_checklist(
-                    output_pages['Checklist'], 
-                    output_file_location.replace('.xlsx', '.txt'))
-
-            CRLXlsxWriter(output_file_location, output_pages)
+            # reserved only now, so a failure before this leaves no empty placeholder behind
+            output_file_location = validator_lib.utilities.reserve_unused_filename(
+                output_file_location)
+            with validator_lib.utilities.atomic_output_file(
+                    output_file_location, reserved=True) as temp_location:
+                if self.running_headless is True:
+                    self.print_headless_checklist(
+                        output_pages['Checklist'], 
+                        output_file_location.replace('.xlsx', '.txt'))
+                CRLXlsxWriter(temp_location, output_pages)
                 
 
 
@@ -541,12 +547,14 @@ class ReviewWorkbookPrinter:
         for inst in output:
             output_filename = '{} for LHRs.txt'.format(inst)
             output_file_location = os.path.join(self.output_folder, output_filename)
-            output_file_location = validator_lib.utilities.get_unused_filename(output_file_location)
-            with open(output_file_location, 'w', encoding='utf8', newline='') as fout:
-                cout = csv.writer(fout, delimiter='\t', lineterminator=os.linesep)
-                cout.writerow(header)
-                for output_row in output[inst]:
-                    cout.writerow(output_row)
+            output_file_location = validator_lib.utilities.reserve_unused_filename(output_file_location)
+            with validator_lib.utilities.atomic_output_file(
+                    output_file_location, reserved=True) as temp_location:
+                with open(temp_location, 'w', encoding='utf8', newline='') as fout:
+                    cout = csv.writer(fout, delimiter='\t', lineterminator=os.linesep)
+                    cout.writerow(header)
+                    for output_row in output[inst]:
+                        cout.writerow(output_row)
 
     def print_headless_checklist(self, checklist_data, headless_output_filename):
         """
@@ -563,15 +571,18 @@ class ReviewWorkbookPrinter:
         
         if good_output:
             good_headless_output_filename = headless_output_filename.replace('review', 'loading')
-            fout_good = open(good_headless_output_filename, 'w', encoding='utf8', newline='')
-            cout_good = csv.writer(fout_good, delimiter='\t', lineterminator=os.linesep)
-            cout_good.writerow(header_row)
-            for row in good_output:
-                cout_good.writerow(row)
+            self.write_headless_output(
+                good_headless_output_filename, header_row, good_output)
         if bad_output:
             bad_headless_output_filename = headless_output_filename.replace('for review', 'failed')
-            fout_bad = open(bad_headless_output_filename, 'w', encoding='utf8', newline='')
-            cout_bad = csv.writer(fout_bad, delimiter='\t', lineterminator=os.linesep)
-            cout_bad.writerow(header_row)
-            for row in bad_output:
-                cout_bad.writerow(row)
+            self.write_headless_output(
+                bad_headless_output_filename, header_row, bad_output)
+
+    @staticmethod
+    def write_headless_output(output_filename, header_row, rows):
+        with validator_lib.utilities.atomic_output_file(output_filename) as temp_location:
+            with open(temp_location, 'w', encoding='utf8', newline='') as fout:
+                cout = csv.writer(fout, delimiter='\t', lineterminator=os.linesep)
+                cout.writerow(header_row)
+                for row in rows:
+                    cout.writerow(row)
@@ -1,45 +1,74 @@
 import os
 from pprint import pprint
 import sys
+import time
 import logging
+import datetime
+import contextlib
 from termcolor import colored, cprint
 
-from validator_lib.utilities import get_jstor_issns
+from crl_lib.local_marc_db import NOT_FOUND_TTL_DAYS
+from crl_lib.api_rate_limiter import use_shared_rate_limiters
+
+from validator_lib import VALIDATOR_LOGS_FOLDER, LOG_FORMAT, LOG_DATE_FORMAT
+from validator_lib.run_context import RunContext
 from validator_lib.print_review_workbook import ReviewWorkbookPrinter
 from validator_lib.run_mrk_process import MrkProcessRunner
-from validator_lib.run_spreadsheet_tsv_csv_process import SpreadsheetTsvCsvRunner
-from validator_lib.get_worldcat_data import WorldCatMarcDataExtractor
-from validator_lib.validator_issn_db import ValidatorIssnDb
 from validator_lib.process_input_data import InputDataProcessor
 from validator_lib.terminal_gui_utilities import print_terminal_page_header
+from validator_lib.utilities import is_marc_input_file
+
+
+# Titles whose WorldCat records are gathered at a time. With several workers
+# the batch is at least big enough to give each of them 50 OCLCs.
+PREFETCH_BATCH_SIZE = 1000
+PREFETCH_BATCH_SIZE_PER_WORKER = 50
 
 
 class ChecksRunner:
+    """
+    Run the checks on one input file. The run context holds the resources 
+    shared across input files; without one, a context is set up and closed 
+    just for this file.
+    """
     def __init__(
         self, input_file, input_fields, disqualifying_issue_categories, 
-        running_headless=False, papr_output=False):
+        running_headless=False, papr_output=False, run_context=None):
 
         self.running_headless = running_headless
         self.papr_output = papr_output
 
-        self.jstor = get_jstor_issns()
-
-        self.worldcat_data_getter = WorldCatMarcDataExtractor()
+        own_run_context = run_context is None
+        if own_run_context:
+            run_context = RunContext()
+        self.run_context = run_context
+        self.workers = run_context.workers
+        self.jstor = run_context.jstor
+        self.worldcat_data_getter = run_context.worldcat_data_getter
 
-        stc_runner = SpreadsheetTsvCsvRunner()
-        validator_issn_db = ValidatorIssnDb()
+        try:
+            self.run_checks(
+                input_file, input_fields, disqualifying_issue_categories)
+        finally:
+            if own_run_context:
+                run_context.close()
 
+    def run_checks(
+            self, input_file, input_fields, disqualifying_issue_categories):
         print_terminal_page_header('Processing {}'.format(input_file))
-        if input_file.endswith('mrk'):
-            mrk_runner = MrkProcessRunner(input_file, input_fields)
+        if is_marc_input_file(input_file):
+            mrk_runner = MrkProcessRunner(
+                input_file, input_fields, 
+                processes=self.run_context.marc_processes)
             input_file_data, line_583_validation_output = mrk_runner.get_data_from_marc()
         else:
-            input_file_data = stc_runner.get_input_data_from_file(
+            input_file_data = self.run_context.stc_runner.get_input_data_from_file(
                 input_file, input_fields)
             line_583_validation_output = None
         self.add_worldcat_data_to_input_file_data_dicts(
             input_file_data, input_file)
-        validator_issn_db.process_title_dicts(input_file_data, input_file)
+        self.run_context.validator_issn_db.process_title_dicts(
+            input_file_data, input_file)
 
         InputDataProcessor(
             input_file_data, input_fields, disqualifying_issue_categories, 
@@ -51,7 +80,12 @@ class ChecksRunner:
 
     def add_worldcat_data_to_input_file_data_dicts(self, input_file_data, input_file):
         print("Getting {}.".format(colored('WorldCat data', 'cyan')))
+        batch_size = max(
+            PREFETCH_BATCH_SIZE, self.workers * PREFETCH_BATCH_SIZE_PER_WORKER)
         for i in range(0, len(input_file_data)):
+            if i % batch_size == 0:
+                self.worldcat_data_getter.prefetch_marc_for_oclcs(
+                    [title_dict['local_oclc'] for title_dict in input_file_data[i:i + batch_size]])
             pct_done = colored(
                 str('{0:.1%}'.format(i/len(input_file_data))), 'yellow')
             sys.stdout.write('\r{}'.format(pct_done))
@@ -64,3 +98,64 @@ class ChecksRunner:
                 input_file_data[i][data_cat] = worldcat_data[data_cat]
         print()
         self.worldcat_data_getter.log_worldcat_data_not_found()
+
+
+def get_input_file_log_location(input_file):
+    """Log file for one input file checked in its own process."""
+    log_file_name = 'validator_log_{:%Y-%m-%d}_{}.log'.format(
+        datetime.datetime.now(), input_file)
+    return os.path.join(VALIDATOR_LOGS_FOLDER, log_file_name)
+
+
+def init_checks_process(shared_rate_limiter, key_rate_limiters):
+    """
+    Process pool initializer. Every process draws its WorldCat requests from 
+    the rate limiters made by the parent, so together they keep to one budget.
+    """
+    use_shared_rate_limiters(shared_rate_limiter, key_rate_limiters)
+
+
+def run_checks_in_process(
+        input_file, input_fields, disqualifying_issue_categories, 
+        papr_output=False, workers=1, not_found_ttl_days=NOT_FOUND_TTL_DAYS, 
+        use_all_keys=False, marc_processes=1):
+    """
+    Check one input file in a process pool worker, in headless mode. Logging 
+    goes to the file's own log (see get_input_file_log_location) and terminal 
+    output is dropped, since several files are checked at once. 
+
+    Returns the number of seconds the checks took.
+    """
+    root_logger = logging.getLogger()
+    main_log_handlers = root_logger.handlers[:]
+    for handler in main_log_handlers:
+        root_logger.removeHandler(handler)
+    file_log_handler = logging.FileHandler(
+        get_input_file_log_location(input_file), encoding='utf8')
+    file_log_handler.setFormatter(
+        logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+    root_logger.addHandler(file_log_handler)
+
+    start_time = time.monotonic()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            logging.info('Checking input file {}'.format(input_file))
+            run_context = RunContext(
+                workers=workers, not_found_ttl_days=not_found_ttl_days, 
+                use_all_keys=use_all_keys, marc_processes=marc_processes)
+            try:
+                ChecksRunner(
+                    input_file, input_fields, disqualifying_issue_categories, 
+                    running_headless=True, papr_output=papr_output, 
+                    run_context=run_context)
+            finally:
+                run_context.close()
+    except Exception:
+        logging.exception('Checks failed for {}'.format(input_file))
+        raise
+    finally:
+        root_logger.removeHandler(file_log_handler)
+        file_log_handler.close()
+        for handler in main_log_handlers:
+            root_logger.addHandler(handler)
+    return time.monotonic() - start_time
@@ -0,0 +1,57 @@
+from crl_lib.local_marc_db import NOT_FOUND_TTL_DAYS
+
+from validator_lib.utilities import get_jstor_issns
+from validator_lib.validator_config import ValidatorConfig
+from validator_lib.get_worldcat_data import (
+    WorldCatDataCache, WorldCatMarcDataExtractor)
+from validator_lib.validator_issn_db import ValidatorIssnDb
+from validator_lib.run_spreadsheet_tsv_csv_process import SpreadsheetTsvCsvRunner
+
+
+class RunContext:
+    """
+    The long-lived resources of a validation run, set up once and shared by
+    every input file: the JSTOR ISSNs, the validator config, the WorldCat data
+    cache, the WorldCat API session and local MARC database connection, and
+    the ISSN database connection.
+
+    Call close() at the end of the run to log the WorldCat counts, close the
+    API session, write collected records to the local MARC database and close
+    the ISSN database.
+    """
+    def __init__(
+        self, workers=1, not_found_ttl_days=NOT_FOUND_TTL_DAYS,
+        use_all_keys=False, marc_processes=1):
+
+        # number of simultaneous WorldCat requests
+        self.workers = max(int(workers), 1)
+        # number of processes checking the records of a large MARC file
+        self.marc_processes = max(int(marc_processes), 1)
+
+        self.jstor = get_jstor_issns()
+        self.validator_config = ValidatorConfig()
+
+        self.worldcat_data_cache = WorldCatDataCache()
+        self.worldcat_data_getter = WorldCatMarcDataExtractor(
+            workers=self.workers, worldcat_data_cache=self.worldcat_data_cache,
+            not_found_ttl_days=not_found_ttl_days, use_all_keys=use_all_keys)
+
+        self.validator_issn_db = ValidatorIssnDb()
+        self.stc_runner = SpreadsheetTsvCsvRunner()
+
+        self.closed = False
+
+    def get_input_fields(self, input_file):
+        return self.validator_config.get_input_fields(input_file)
+
+    def get_disqualifying_issue_categories(self, input_file):
+        return self.validator_config.get_disqualifying_issue_categories(
+            input_file)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.worldcat_data_cache.log_cache_counts()
+        self.worldcat_data_getter.close()
+        self.validator_issn_db.close()
@@ -2,12 +2,12 @@ import os
 import re
 import logging
 import datetime
+import concurrent.futures
 from pprint import pprint
 
-from crl_lib.marc_utilities import get_field_subfield, get_fields_subfields
-from crl_lib.line_85x86x import Convert85x86x
 from crl_lib.marc_fields import MarcFields
-from crl_lib.marc_file_reader import MarcFileReader
+from crl_lib.mrk_record import MrkRecord
+from crl_lib.marc_file_reader import open_marc_file
 from crl_lib.crl_utilities import clean_oclc
 
 from validator_lib.validate_583s import Line583Validator
@@ -17,14 +17,23 @@ from validator_lib.validator_title_dict import get_immutable_title_dict
 from validator_lib import VALIDATOR_INPUT_FOLDER
 
 
+# Files smaller than this are always read in one process
+MIN_FILE_SIZE_FOR_PROCESSES = 8 * 1024 * 1024
+# Each process gets about this many chunks of the file, to even out the load
+CHUNKS_PER_PROCESS = 4
+
+
 class MrkProcessRunner:
     """
     Get and check data from an input MARC record. These can be LHRs or regular
     MARC files with holdings data included.
     """
-    def __init__(self, input_file, input_fields):
+    def __init__(self, input_file, input_fields, processes=1):
         
         self.input_file = input_file
+        # number of processes checking records, for large files; more than 
+        # there are CPUs would only add overhead
+        self.processes = max(min(int(processes), os.cpu_count() or 1), 1)
         self.input_file_location = os.path.join(
             VALIDATOR_INPUT_FOLDER, self.input_file)
 
@@ -65,49 +74,133 @@ class MrkProcessRunner:
             '\t'.join(self.error_log_header_list) + '\n')
 
     def get_data_from_marc(self):
+        mfr = open_marc_file(self.input_file_location)
+        chunks = [(0, mfr.eof)]
+        if self.processes > 1 and mfr.eof >= MIN_FILE_SIZE_FOR_PROCESSES:
+            chunks = mfr.get_chunk_offsets(self.processes * CHUNKS_PER_PROCESS)
+        if len(chunks) > 1:
+            mfr.close()
+            return self.get_data_from_marc_in_processes(chunks)
+
         seqnum = 0
         input_file_data = []
-        mfr = MarcFileReader(self.input_file_location)
         for record in mfr:
             seqnum += 1
-            if seqnum % 5000 == 0:
-                logging.info('   ...reached record {} in {}'.format(
-                    seqnum, self.input_file))
-            record_dict = self.get_data_from_record(record, seqnum)
-            if '583' in self.input_fields and self.input_fields['583']:
-                record_dict['583_in_file'] = True
-                self.line_583_validator.validate_583_lines_in_record(
-                    record, record_dict)
-                if record_dict['line_583_error']:
-                    record_dict['errors'].append('line_583_error')
-                    self.log_583_errors(seqnum, record_dict)
-                    record_dict['line_583_error'] = True
-                    record_dict['583_lines_validate'] = False
-                elif '=583  ' in record:
-                    record_dict['line_583_error'] = False
-                    record_dict['583_lines_validate'] = True
-            else:
-                record_dict['583_in_file'] = False
+            self.log_progress(seqnum)
+            record_dict, errors_583, marc_errors = self.check_record(
+                record, seqnum)
             input_file_data.append(record_dict)
-            self.log_marc_errors(seqnum, record_dict)
+            self.log_record_errors(seqnum, record_dict, errors_583, marc_errors)
+        line_583_validation_output = self.line_583_validator.get_output_data()
+        return input_file_data, line_583_validation_output
+
+    def get_data_from_marc_in_processes(self, chunks):
+        """
+        Check the records in each chunk of the file in a process pool, then 
+        put the results back together in file order. Records are numbered 
+        within their chunk by the workers and renumbered here, and the error 
+        logs are written here, so the output is the same as from a single 
+        process.
+        """
+        logging.info('Reading {} in {} chunks with {} processes'.format(
+            self.input_file, len(chunks), self.processes))
+        seqnum = 0
+        input_file_data = []
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.processes) as executor:
+            chunk_results = executor.map(
+                get_data_from_marc_chunk, 
+                [self.input_file] * len(chunks), 
+                [self.input_fields] * len(chunks), 
+                [chunk[0] for chunk in chunks], 
+                [chunk[1] for chunk in chunks])
+            for checked_records, line_583_output in chunk_results:
+                seqnum_offset = seqnum
+                for record_dict, errors_583, marc_errors in checked_records:
+                    seqnum += 1
+                    self.log_progress(seqnum)
+                    record_dict['seqnum'] = seqnum
+                    input_file_data.append(record_dict)
+                    self.log_record_errors(
+                        seqnum, record_dict, errors_583, marc_errors)
+                for output_row in line_583_output:
+                    # seqnum column
+                    output_row[1] += seqnum_offset
+                self.line_583_validator.output_lines.extend(line_583_output)
         line_583_validation_output = self.line_583_validator.get_output_data()
         return input_file_data, line_583_validation_output
 
-    def get_data_from_record(self, record, seqnum):
+    def get_data_from_marc_range(self, start, end):
+        """
+        Check the records between two byte offsets in the file, numbering 
+        them from 1. Returns (record_dict, 583 errors, MARC errors) for each 
+        record, and the rows they added to the 583 validation output. Nothing 
+        is written to the error logs.
+        """
+        checked_records = []
+        mfr = open_marc_file(self.input_file_location)
+        seqnum = 0
+        for _, _, record in mfr.iter_records_in_range(start, end):
+            seqnum += 1
+            checked_records.append(self.check_record(record, seqnum))
+        mfr.close()
+        return checked_records, self.line_583_validator.output_lines[1:]
+
+    def log_progress(self, seqnum):
+        if seqnum % 5000 == 0:
+            logging.info('   ...reached record {} in {}'.format(
+                seqnum, self.input_file))
+
+    def check_record(self, record, seqnum):
+        """
+        Get the data and errors from one record. Returns the record dict, the 
+        583 errors and the MARC errors, for log_record_errors.
+        """
+        # split up once, for all of the lookups below
+        mrk_record = MrkRecord(record)
+        record_dict = self.get_data_from_record(record, seqnum, mrk_record)
+        errors_583 = []
+        if '583' in self.input_fields and self.input_fields['583']:
+            record_dict['583_in_file'] = True
+            self.line_583_validator.validate_583_lines_in_record(
+                record, record_dict, mrk_record)
+            if record_dict['line_583_error']:
+                record_dict['errors'].append('line_583_error')
+                errors_583 = record_dict['line_583_error']
+                record_dict['line_583_error'] = True
+                record_dict['583_lines_validate'] = False
+            elif '=583  ' in record:
+                record_dict['line_583_error'] = False
+                record_dict['583_lines_validate'] = True
+        else:
+            record_dict['583_in_file'] = False
+        marc_errors = self.errors_this_record
+        if marc_errors:
+            record_dict['marc_validation_error'] = True
+            record_dict['errors'].append('marc_validation_error')
+        return record_dict, errors_583, marc_errors
+
+    def log_record_errors(self, seqnum, record_dict, errors_583, marc_errors):
+        self.log_583_errors(seqnum, record_dict, errors_583)
+        self.log_marc_errors(seqnum, record_dict, marc_errors)
+
+    def get_data_from_record(self, record, seqnum, mrk_record=None):
+        if mrk_record is None:
+            mrk_record = MrkRecord(record)
         self.errors_this_record = []
         mf = MarcFields(record, log_warnings=True, debug_info='from {}'.format(
             self.input_file))
         record_dict = get_immutable_title_dict()
 
         record_dict['marc'] = record
-        record_dict['bib_id'] = self.get_field_from_marc('bib_id', record)
-        record_dict['field_852a'] = get_field_subfield(record, '852a')
-        record_dict['field_852b'] = get_field_subfield(record, '852b')
+        record_dict['bib_id'] = self.get_field_from_marc('bib_id', mrk_record)
+        record_dict['field_852a'] = mrk_record.get_field_subfield('852a')
+        record_dict['field_852b'] = mrk_record.get_field_subfield('852b')
         record_dict['filename'] = self.input_file
         record_dict['holdings_id'] = self.get_field_from_marc(
-            'holdings_id', record)
+            'holdings_id', mrk_record)
         record_dict['local_issn'] = mf.issn_a
-        record_dict['local_oclc'] = self.get_oclc_from_marc(mf, record)
+        record_dict['local_oclc'] = self.get_oclc_from_marc(mf, mrk_record)
         record_dict['local_title'] = mf.title
         record_dict['seqnum'] = seqnum
 
@@ -116,12 +209,11 @@ class MrkProcessRunner:
         if '=583  ' in record:
             record_dict['field_583'] = True
 
-        self.get_holdings_from_marc(record, record_dict)
+        self.get_holdings_from_marc(mrk_record, record_dict)
 
-        self.check_for_bad_863(record, record_dict)
+        self.check_for_bad_863(mrk_record, record_dict)
 
-        marc_lines = record.split("\n")
-        for marc_line in marc_lines:
+        for marc_line in mrk_record.lines:
             self.validate_line(marc_line.strip(), record_dict)
         return record_dict
 
@@ -144,7 +236,7 @@ class MrkProcessRunner:
                 self.errors_this_record.append(msg)
                 record_dict['dangling_subfield'] = True
 
-    def get_oclc_from_marc(self, mf, record):
+    def get_oclc_from_marc(self, mf, mrk_record):
         """
         OCLC from MARC, based on user's indication of its location.
         """
@@ -153,26 +245,27 @@ class MrkProcessRunner:
             if self.input_fields['oclc'] == '035':
                 oclc = mf.oclc_035
                 if not oclc:
-                    oclc = get_field_subfield(record, '035', 'a')
+                    oclc = mrk_record.get_field_subfield('035', 'a')
             else:
-                oclc = get_field_subfield(record, self.input_fields['oclc'])
+                oclc = mrk_record.get_field_subfield(self.input_fields['oclc'])
         oclc = clean_oclc(oclc)
         return oclc
 
-    def get_field_from_marc(self, field, record):
+    def get_field_from_marc(self, field, mrk_record):
         if field and field in self.input_fields and self.input_fields[field]:
-            field_data = get_field_subfield(record, self.input_fields[field])
+            field_data = mrk_record.get_field_subfield(self.input_fields[field])
             return field_data
         return ''
 
-    def get_holdings_from_marc(self, record, record_dict):
+    def get_holdings_from_marc(self, mrk_record, record_dict):
+        record = mrk_record.record
         regular_holdings_list = []
         holdings = []
         holdings_nonpublic_notes = []
         holdings_public_notes = []
 
         if '863' in self.input_fields and self.input_fields['863']:
-            c = Convert85x86x(record)
+            c = mrk_record.holdings_converter
             holdings.extend(c.output_strings)
             for output_string in c.output_strings:
                 if 'supp' not in output_string.lower() and 'ind' not in output_string.lower():
@@ -185,7 +278,7 @@ class MrkProcessRunner:
     
         if '866' in self.input_fields and self.input_fields['866']:
             for field in ['866', '867', '868']:
-                field_holdings = get_fields_subfields(record, field, "a")
+                field_holdings = mrk_record.get_fields_subfields(field, "a")
                 holdings.extend(field_holdings)
                 if field == '866':
                     regular_holdings_list.extend(field_holdings)
@@ -198,7 +291,7 @@ class MrkProcessRunner:
                 holdings_public_notes.extend(public_notes)
 
         for other_holdings_field in self.other_holdings_fields:
-            field_holdings = get_fields_subfields(record, other_holdings_field)
+            field_holdings = mrk_record.get_fields_subfields(other_holdings_field)
             holdings.extend(field_holdings)
             for output_string in field_holdings:
                 regular_holdings, _, _ = remove_supplements_from_holdings(output_string)
@@ -213,9 +306,9 @@ class MrkProcessRunner:
             record_dict['holdings_have_no_years'] = '1'
         record_dict['local_holdings'] = '; '.join(holdings)
 
-    def check_for_bad_863(self, record, record_dict):
+    def check_for_bad_863(self, mrk_record, record_dict):
         if '863' in self.input_fields:
-            c = Convert85x86x(record)
+            c = mrk_record.holdings_converter
             if len(c.output_strings_with_notes) > len(c.output_strings):
                 for output_tuple in c.output_strings_with_notes:
                     bad_863 = True
@@ -227,21 +320,18 @@ class MrkProcessRunner:
                         self.errors_this_record.append('Bad 863/864/865 line')
                         return
 
-    def log_marc_errors(self, seqnum, record_dict):
-        if self.errors_this_record:
+    def log_marc_errors(self, seqnum, record_dict, marc_errors):
+        if marc_errors:
             if not self.error_log_fout['marc']:
                 self.open_error_log_file('marc')
-            record_dict['marc_validation_error'] = True
-            record_dict['errors'].append('marc_validation_error')
-
-            for error_str in self.errors_this_record:
+            for error_str in marc_errors:
                 self.write_error_to_log(seqnum, record_dict, 'marc', error_str)
 
-    def log_583_errors(self, seqnum, record_dict):
-        if record_dict['line_583_error']:
+    def log_583_errors(self, seqnum, record_dict, errors_583):
+        if errors_583:
             if not self.error_log_fout['583']:
                 self.open_error_log_file('583')
-            for error_str in record_dict['line_583_error']:
+            for error_str in errors_583:
                 self.write_error_to_log(seqnum, record_dict, '583', error_str)
 
     def write_error_to_log(self, seqnum, record_dict, log_type, error_str):
@@ -254,3 +344,12 @@ class MrkProcessRunner:
             error_str
         ]
         self.error_log_fout[log_type].write('\t'.join(output_list) + '\n')
+
+
+def get_data_from_marc_chunk(input_file, input_fields, start, end):
+    """
+    Process pool worker for MrkProcessRunner.get_data_from_marc_in_processes: 
+    check the records in one chunk of a MARC file.
+    """
+    mrk_runner = MrkProcessRunner(input_file, input_fields)
+    return mrk_runner.get_data_from_marc_range(start, end)
@@ -7,12 +7,20 @@ from pprint import pprint
 import logging
 from termcolor import cprint, colored
 
-from validator_lib.utilities import get_first_last_year_from_regular_holdings
+from crl_lib.compressed_files import open_input_file
+from crl_lib.encoding_sniffer import check_file_encoding, find_undecodable_lines
+
+from validator_lib.utilities import (
+    get_first_last_year_from_regular_holdings, get_input_file_format)
 from validator_lib.supplements_and_indexes_functions import (
     remove_indexes_from_holdings, remove_supplements_from_holdings)
 from validator_lib.validator_title_dict import get_immutable_title_dict
 
 
+# Lines with encoding problems logged per file; the rest are only counted
+MAX_LOGGED_ENCODING_ERRORS = 20
+
+
 class SpreadsheetTsvCsvRunner:
 
     string_only_cats = {
@@ -41,45 +49,69 @@ class SpreadsheetTsvCsvRunner:
 
     def get_input_data_from_file(self, input_file, input_fields):
         input_file_location = os.path.join(self.input_folder, input_file)
-        if input_file.endswith('xlsx'):
-            wb = openpyxl.load_workbook(input_file_location)
-            iterator = wb.active
+        # gzipped and zipped files are read without extracting them
+        input_format = get_input_file_format(input_file)
+        if input_format == 'xlsx':
+            with open_input_file(input_file_location) as fin:
+                wb = openpyxl.load_workbook(fin)
+                try:
+                    input_data = self.extract_data_from_spreadsheet_file(
+                        wb.active, input_file, input_fields)
+                finally:
+                    wb.close()
         else:
-            if input_file.endswith('csv'):
+            if input_format == 'csv':
                 delimiter = ','
-            elif input_file.endswith('txt') or input_file.endswith('tsv'):
+            elif input_format == 'txt' or input_format == 'tsv':
                 delimiter = '\t'
             else:
                 raise Exception('Invalid input file?\n{}'.format(input_file))
             my_encoding = self.get_text_file_encoding(
                 input_file, input_file_location)
-            fin = open(
-                input_file_location, 'r', newline='', encoding=my_encoding)
-            iterator = csv.reader(fin, delimiter=delimiter)
-
-        input_data = self.extract_data_from_spreadsheet_file(
-            iterator, input_file, input_fields)
+            with open_input_file(
+                    input_file_location, 'r', newline='', encoding=my_encoding) as fin:
+                iterator = csv.reader(fin, delimiter=delimiter)
+                input_data = self.extract_data_from_spreadsheet_file(
+                    iterator, input_file, input_fields)
         return input_data
 
     def get_text_file_encoding(self, input_file, input_file_location):
         """
         Find encoding for text files. Right now only works with UTF8 and cp1252 
-        (Windows standard) as well as plain ASCII files. This will probably fail 
-        on any malformed input files, but those would likely fail in the data 
-        extraction step anyway.
+        (Windows standard), which covers plain ASCII files too. The encoding is 
+        picked from a sample of the file, then the whole file is checked 
+        against it. A UTF-8 file with some lines that are only good as cp1252 
+        is read as cp1252, as before, but those lines are logged; if its UTF-8 
+        lines aren't all good as cp1252 too, the file can't be read.
         """
-        encodings = ['utf8', 'cp1252', 'ascii']
-        for my_encoding in encodings:
-            try:
-                with open(input_file_location, 'r', encoding=my_encoding) as fin:
-                    for line in fin.readlines():
-                        pass
-                print('Will use encoding {} for file.'.format(
-                    colored(my_encoding, 'cyan')))
-                return my_encoding
-            except UnicodeDecodeError:
-                pass
+        file_encoding = check_file_encoding(
+            input_file_location, fallback_codec='cp1252')
+        my_encoding = file_encoding.codec
+        if file_encoding.undecodable_line_offsets:
+            self.exit_on_unknown_encoding(
+                input_file, file_encoding.undecodable_line_offsets, 'UTF-8 or cp1252')
+        if file_encoding.mixed_line_offsets:
+            # the UTF-8 lines have to be good as cp1252 as well
+            non_cp1252_line_offsets = find_undecodable_lines(
+                input_file_location, 'cp1252')
+            if non_cp1252_line_offsets:
+                self.exit_on_unknown_encoding(
+                    input_file, non_cp1252_line_offsets, 'cp1252')
+            logging.warning('{} has {} lines that are not UTF-8; reading it as cp1252'.format(
+                input_file, len(file_encoding.mixed_line_offsets)))
+            for offset in file_encoding.mixed_line_offsets[:MAX_LOGGED_ENCODING_ERRORS]:
+                logging.warning('Line at byte {} of {} is not UTF-8'.format(
+                    offset, input_file))
+            my_encoding = 'cp1252'
+        print('Will use encoding {} for file.'.format(
+            colored(my_encoding, 'cyan')))
+        return my_encoding
+
+    def exit_on_unknown_encoding(self, input_file, bad_line_offsets, encoding_names):
         cprint("Can't find text encoding of input file. Please convert it to UTF-8 or Windows text format.")
+        for offset in bad_line_offsets[:MAX_LOGGED_ENCODING_ERRORS]:
+            logging.error('Line at byte {} of {} is not {}'.format(
+                offset, input_file, encoding_names))
         sys.exit()
 
     def extract_data_from_spreadsheet_file(self, iterator, input_file, input_fields):
@@ -88,6 +120,7 @@ class SpreadsheetTsvCsvRunner:
         input_data = []
         n = 0
         c = Counter()
+        input_is_xlsx = get_input_file_format(input_file) == 'xlsx'
         for row in iterator:
             if row_locations['header_to_skip'] is True:
                 row_locations['header_to_skip'] = False
@@ -102,7 +135,7 @@ class SpreadsheetTsvCsvRunner:
             regular_holdings = []
             for cat in self.input_cats:
                 if cat in row_locations:
-                    if input_file.endswith('xlsx'):
+                    if input_is_xlsx:
                         cat_data = row[row_locations[cat]].value
                     else:
                         cat_data = row[row_locations[cat]]
@@ -21,8 +21,9 @@ from termcolor import colored
 from crl_lib.marc_utilities import get_field_subfield
 
 from validator_lib.terminal_gui_utilities import print_terminal_page_header
+from validator_lib.utilities import get_input_file_format, is_marc_input_file
 
-from crl_lib.marc_file_reader import MarcFileReader
+from crl_lib.marc_file_reader import open_marc_file
 from crl_lib.marc_fields import MarcFields
 
 
@@ -46,12 +47,12 @@ class InputFileScanner:
     def scan_input_files(self):
         logging.debug("Scanning input files.")
         for input_file in self.input_files:
-            if input_file.endswith(".mrk"):
+            if is_marc_input_file(input_file):
                 logging.debug("Scanning {}".format(input_file))
                 self.marc_scanner(input_file)
-            elif input_file.endswith(".xlsx"):
+            elif get_input_file_format(input_file) == "xlsx":
                 logging.info("Skipping {}".format(input_file))
-            elif input_file.endswith(".txt") or input_file.endswith(".tsv") or input_file.endswith(".csv"):
+            elif get_input_file_format(input_file) in {"txt", "tsv", "csv"}:
                 logging.info("Skipping {}".format(input_file))
             else:
                 logging.warning("Unknown file type in input directory: {}".format(input_file))
@@ -59,10 +60,10 @@ class InputFileScanner:
     def marc_scanner(self, input_file):
         input_file_loc = os.path.join(self.input_dir, input_file)
         file_data = Counter()
-        mfr = MarcFileReader(input_file_loc)
+        mfr = open_marc_file(input_file_loc)
         for marc in mfr:
             file_data["Total records"] += 1
-            mf = MarcFields(marc)
+            mf = MarcFields(marc, lazy=True)
             field_001 = get_field_subfield(marc, '001')
             field_004 = get_field_subfield(marc, '004')
             if field_001:
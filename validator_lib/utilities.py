@@ -1,10 +1,30 @@
 import re
 import os
+import contextlib
 from termcolor import cprint, colored
 
 from crl_lib.year_utilities import find_years_first_last
+from crl_lib.compressed_files import get_uncompressed_name
 
-from validator_lib import CRL_FOLDER
+from validator_lib import CRL_FOLDER, VALIDATOR_INPUT_FOLDER
+
+
+# Input file endings read as MARC: MRK text, binary MARC and MARCXML
+MARC_INPUT_FORMATS = {'mrk', 'mrc', 'xml'}
+
+
+def get_input_file_format(input_file):
+    """
+    Get the file ending of an input file, without the dot, or of the file 
+    inside it for gzipped and zipped files ("mrk" for "holdings.mrk.gz").
+    """
+    file_name = get_uncompressed_name(
+        os.path.join(VALIDATOR_INPUT_FOLDER, input_file))
+    return file_name.split('.')[-1].lower()
+
+
+def is_marc_input_file(input_file):
+    return get_input_file_format(input_file) in MARC_INPUT_FORMATS
 
 
 def get_unused_filename(file_location):
@@ -32,6 +52,43 @@ def get_unused_filename(file_location):
             raise Exception("At least 1000 files with the base name {}. Runaway process?".format(full_filename))
 
 
+def reserve_unused_filename(file_location):
+    """
+    Like get_unused_filename, but also creates an empty file at the name found, 
+    so that another process writing to the same folder can't pick it too.
+    """
+    while True:
+        file_location = get_unused_filename(file_location)
+        try:
+            os.close(os.open(file_location, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return file_location
+        except FileExistsError:
+            continue
+
+
+@contextlib.contextmanager
+def atomic_output_file(file_location, reserved=False):
+    """
+    Yield a temporary location to write an output file to, in the same folder. 
+    When the block finishes the temporary file replaces file_location in one 
+    step, so a half-written output is never seen there. If the block fails the 
+    temporary file is removed, and so is file_location if it's the empty 
+    placeholder left by reserve_unused_filename (reserved=True).
+    """
+    path_base, full_filename = os.path.split(file_location)
+    temp_location = os.path.join(
+        path_base, '~{}.{}'.format(os.getpid(), full_filename))
+    try:
+        yield temp_location
+        os.replace(temp_location, file_location)
+    except BaseException:
+        if os.path.isfile(temp_location):
+            os.remove(temp_location)
+        if reserved and os.path.isfile(file_location):
+            os.remove(file_location)
+        raise
+
+
 def get_abbrev_from_input_filename(input_file):
     if '_AUTOGENERATED_FILE.tsv' in input_file:
         return input_file.replace('_AUTOGENERATED_FILE.tsv', '')
@@ -1,5 +1,4 @@
-import re
-from crl_lib.marc_utilities import get_field_subfield, get_fields_subfields
+from crl_lib.mrk_record import MrkRecord, get_all_subfields, get_last_subfield, get_line_subfields
 import logging
 
 
@@ -24,14 +23,20 @@ class Line583Validator:
     def get_output_data(self):
         return self.output_lines.copy()
 
-    def validate_583_lines_in_record(self, record, record_dict):
+    def validate_583_lines_in_record(self, record, record_dict, mrk_record=None):
+        """
+        Check the record's 583 lines. Pass the record's MrkRecord if there 
+        already is one, so the record isn't split up again.
+        """
+        if mrk_record is None:
+            mrk_record = MrkRecord(record)
         record_dict['lines_583_data'] = []
         if record_dict['field_852a']:
             record_dict['record_contains_852a'] = True
         else:
             record_dict['record_contains_852a'] = False
             record_dict['errors'].append('missing_field_852a')
-        lines_583 = re.findall(r"(=583\s\s[^\r\n]+)", record)
+        lines_583 = mrk_record.get_lines('583')
         record_dict['line_583_error'] = []
         record_dict['line_583_error_details'] = []
         saw_committed_to_retain = False
@@ -44,9 +49,9 @@ class Line583Validator:
             record_dict['line_583_error'].append('no_committed_to_retain_in_583')
             record_dict['line_583_error_details'].append('no_committed_to_retain_in_583')
 
-        line_561_3s = get_fields_subfields(record, '561', '3')
-        line_561_as = get_fields_subfields(record, '561', 'a')
-        line_561_5s = get_fields_subfields(record, '561', '5')
+        line_561_3s = mrk_record.get_fields_subfields('561', '3')
+        line_561_as = mrk_record.get_fields_subfields('561', 'a')
+        line_561_5s = mrk_record.get_fields_subfields('561', '5')
         
         record_dict['line_561_3s'] = '|$3'.join(line_561_3s)
         record_dict['line_561_as'] = '|$a'.join(line_561_as)
@@ -59,19 +64,20 @@ class Line583Validator:
         delimiter_2 = line[7]
         self.validate_delimiters(delimiter_1, delimiter_2, errors)
 
-        subfield_3 = get_field_subfield(line, '583', '3')
-        subfield_a = get_field_subfield(line, '583', 'a')
-        subfield_c = get_field_subfield(line, '583', 'c')
-        subfield_d = get_field_subfield(line, '583', 'd')
-        subfields_f = get_fields_subfields(line, '583', 'f')
-        subfield_u = get_field_subfield(line, '583', 'u')
-        subfield_i = get_field_subfield(line, '583', 'i')
-        subfields_l = get_fields_subfields(line, '583', 'l')
-        subfields_z = get_fields_subfields(line, '583', 'z')
-        subfields_x = get_fields_subfields(line, '583', 'x')
-        subfield_j = get_field_subfield(line, '583', 'j')
-        subfield_2 = get_field_subfield(line, '583', '2')
-        subfield_5 = get_field_subfield(line, '583', '5')
+        subfields = get_line_subfields(line)
+        subfield_3 = get_last_subfield(subfields, '3')
+        subfield_a = get_last_subfield(subfields, 'a')
+        subfield_c = get_last_subfield(subfields, 'c')
+        subfield_d = get_last_subfield(subfields, 'd')
+        subfields_f = get_all_subfields(subfields, 'f')
+        subfield_u = get_last_subfield(subfields, 'u')
+        subfield_i = get_last_subfield(subfields, 'i')
+        subfields_l = get_all_subfields(subfields, 'l')
+        subfields_z = get_all_subfields(subfields, 'z')
+        subfields_x = get_all_subfields(subfields, 'x')
+        subfield_j = get_last_subfield(subfields, 'j')
+        subfield_2 = get_last_subfield(subfields, '2')
+        subfield_5 = get_last_subfield(subfields, '5')
 
         line_583_data = {
             'a': subfield_a,
@@ -89,7 +95,7 @@ class Line583Validator:
 
         other_subfield_data = []
         for unsearched_subfield in UNSEARCHED_LEGAL_583_SUBFIELDS:
-            subfields_data = get_fields_subfields(line, '583', unsearched_subfield)
+            subfields_data = get_all_subfields(subfields, unsearched_subfield)
             if subfields_data:
                 for subfield_data in subfields_data:
                     subfield_data = '$' + subfield_data
@@ -6,6 +6,7 @@ from pprint import pprint
 import logging
 
 from validator_lib import VALIDATOR_CONFIG_FOLDER
+from validator_lib.utilities import is_marc_input_file
 
 class ValidatorConfig:
 
@@ -110,7 +111,7 @@ class ValidatorConfig:
             cat_data = self.config[input_file][cat]
             cat_data = str(cat_data)
             cat_data = cat_data.strip()
-            if input_file.endswith('mrk'):
+            if is_marc_input_file(input_file):
                 cat_data = self.zero_fill_marc_fields(cat_data)
             input_fields[cat] = cat_data
         if not input_fields:
@@ -128,7 +129,7 @@ class ValidatorConfig:
                     continue
                 cat_data = self.config['programs'][short_filename]['input_fields'][cat]
                 cat_data = cat_data.strip()
-                if input_file.endswith('mrk'):
+                if is_marc_input_file(input_file):
                     cat_data = self.zero_fill_marc_fields(cat_data)
                 input_fields[cat] = cat_data
         return input_fields
@@ -5,24 +5,32 @@ import webbrowser
 import sys
 import gc
 import re
+import concurrent.futures
 from termcolor import cprint, colored
 
 from validator_lib import (
     CRL_FOLDER, ISSN_DB_LOCATION, MARC_DB_LOCATION, DOCS_URL, 
     VALIDATOR_INPUT_FOLDER, VALIDATOR_CONFIG_FOLDER, 
-    VALIDATOR_OUTPUT_FOLDER, LOG_FILE_LOCATION)
+    VALIDATOR_OUTPUT_FOLDER, LOG_FILE_LOCATION, DEBUG_MODE)
 from validator_lib.choose_input_file_fields import InputFieldsChooser
 from validator_lib.scan_input_files import InputFileScanner
-from validator_lib.run_checks_process import ChecksRunner
+from validator_lib.run_checks_process import (
+    ChecksRunner, init_checks_process, run_checks_in_process, 
+    get_input_file_log_location)
 from validator_lib.choose_disqualifying_issues import IssuesChooser
 from validator_lib.validator_config import ValidatorConfig
+from validator_lib.run_context import RunContext
+from validator_lib.utilities import MARC_INPUT_FORMATS, get_input_file_format
 
 from crl_lib.api_key_setter import ApiKeySetter
+from crl_lib.local_marc_db import NOT_FOUND_TTL_DAYS
 from crl_lib.api_keys import OclcApiKeys
+from crl_lib.api_rate_limiter import ProcessSharedRateLimiter
+from crl_lib.worldcat_api_token import get_metadata_api_keys
 
 
 # List of input file extensions the process can currently handle
-VIABLE_INPUT_FORMATS = {'txt', 'xlsx', 'tsv', 'csv', 'mrk'}
+VIABLE_INPUT_FORMATS = {'txt', 'xlsx', 'tsv', 'csv'} | MARC_INPUT_FORMATS
 
 
 class ValidatorController:
@@ -31,12 +39,25 @@ class ValidatorController:
     end.
     """
 
-    def __init__(self, headless_mode=False, papr_output=False):
+    def __init__(
+        self, headless_mode=False, papr_output=False, workers=1, 
+        not_found_ttl_days=NOT_FOUND_TTL_DAYS, use_all_keys=False, 
+        processes=1, marc_processes=1):
 
         super().__init__()
 
         self.headless_mode = headless_mode
         self.papr_output = papr_output
+        # number of simultaneous WorldCat requests
+        self.workers = max(int(workers), 1)
+        # days before OCLCs not found in WorldCat are requested again
+        self.not_found_ttl_days = not_found_ttl_days
+        # spread WorldCat requests over every Metadata API key
+        self.use_all_keys = use_all_keys
+        # number of input files checked at once, in headless mode
+        self.processes = max(int(processes), 1)
+        # number of processes checking the records of a large MARC file
+        self.marc_processes = max(int(marc_processes), 1)
 
         self.log_file_location_results()
 
@@ -67,8 +88,8 @@ class ValidatorController:
         for input_file in all_input_files:
             if input_file.startswith('~'):
                 continue
-            file_extension = input_file.split('.')[-1]
-            if not file_extension.lower() in VIABLE_INPUT_FORMATS:
+            file_extension = get_input_file_format(input_file)
+            if not file_extension in VIABLE_INPUT_FORMATS:
                 continue
             self.input_files.append(input_file)
 
@@ -91,11 +112,11 @@ class ValidatorController:
             logging.warning('No input files found.')
         for input_file in self.input_files:
             logging.info('Found input file {}'.format(input_file))
-            for input_format in VIABLE_INPUT_FORMATS:
-                if input_file.lower().endswith(input_format):
-                    self.input_files_seen = True
-                    if input_format == 'mrk':
-                        self.marc_input_seen = True
+            input_format = get_input_file_format(input_file)
+            if input_format in VIABLE_INPUT_FORMATS:
+                self.input_files_seen = True
+                if input_format in MARC_INPUT_FORMATS:
+                    self.marc_input_seen = True
 
     def open_project_docs(self):
         webbrowser.open(DOCS_URL)
@@ -129,27 +150,95 @@ class ValidatorController:
             sys.exit()
 
         self.clear_output_folder()
-        x = 0
+        if self.headless_mode is True and self.processes > 1 and len(self.input_files) > 1:
+            self.run_checks_in_processes()
+            return
+        run_context = RunContext(
+            workers=self.workers, not_found_ttl_days=self.not_found_ttl_days, 
+            use_all_keys=self.use_all_keys, marc_processes=self.marc_processes)
+        try:
+            for input_file in self.input_files:
+                input_fields = run_context.get_input_fields(input_file)
+                disqualifying_issue_categories = run_context.get_disqualifying_issue_categories(input_file)
+
+                if not input_fields:
+                    warning_message = 'No input fields set for file {}. Skipping.'.format(input_file)
+                    logging.warning(warning_message)
+                    input(colored(warning_message, 'yellow'))
+                    continue
+
+                ChecksRunner(
+                    input_file,
+                    input_fields,
+                    disqualifying_issue_categories,
+                    running_headless=self.headless_mode,
+                    papr_output=self.papr_output,
+                    run_context=run_context)
+        finally:
+            run_context.close()
+
+    def run_checks_in_processes(self):
+        """
+        Check up to self.processes input files at once, each in its own 
+        process with its own log file. The processes share one WorldCat rate 
+        budget (per key, with use_all_keys). Only used in headless mode.
+        """
+        validator_config_object = ValidatorConfig()
+        files_to_check = []
         for input_file in self.input_files:
-            x += 1
-            validator_config_object = ValidatorConfig()
-
-            input_fields = validator_config_object.get_input_fields(input_file)       
-            disqualifying_issue_categories = validator_config_object.get_disqualifying_issue_categories(input_file)
-
+            input_fields = validator_config_object.get_input_fields(input_file)
             if not input_fields:
-                warning_message = 'No input fields set for file {}. Skipping.'.format(input_file)
-                logging.warning(warning_message)
-                input(colored(warning_message, 'yellow'))
+                logging.warning('No input fields set for file {}. Skipping.'.format(input_file))
                 continue
-            del(validator_config_object)
-
-            ChecksRunner(
-                input_file,
-                input_fields,
-                disqualifying_issue_categories,
-                running_headless=self.headless_mode,
-                papr_output=self.papr_output)
+            disqualifying_issue_categories = validator_config_object.get_disqualifying_issue_categories(input_file)
+            files_to_check.append(
+                (input_file, input_fields, disqualifying_issue_categories))
+        del(validator_config_object)
+
+        shared_rate_limiter = ProcessSharedRateLimiter()
+        key_rate_limiters = {}
+        if self.use_all_keys is True:
+            api_key_tuples = get_metadata_api_keys()
+            if len(api_key_tuples) > 1:
+                for api_key, _ in api_key_tuples:
+                    key_rate_limiters[api_key] = ProcessSharedRateLimiter(
+                        shared_rate_limiter.max_rate)
+
+        processes = min(self.processes, len(files_to_check)) or 1
+        logging.info('Checking {} input files with {} processes.'.format(
+            len(files_to_check), processes))
+        files_done = 0
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes, initializer=init_checks_process, 
+                initargs=(shared_rate_limiter, key_rate_limiters)) as executor:
+            futures = {}
+            for input_file, input_fields, disqualifying_issue_categories in files_to_check:
+                future = executor.submit(
+                    run_checks_in_process, input_file, input_fields, 
+                    disqualifying_issue_categories, papr_output=self.papr_output, 
+                    workers=self.workers, 
+                    not_found_ttl_days=self.not_found_ttl_days, 
+                    use_all_keys=self.use_all_keys, 
+                    marc_processes=self.marc_processes)
+                futures[future] = input_file
+                cprint('Started {}'.format(input_file), 'cyan')
+            for future in concurrent.futures.as_completed(futures):
+                input_file = futures[future]
+                files_done += 1
+                progress = '[{}/{}]'.format(files_done, len(files_to_check))
+                log_file_location = get_input_file_log_location(input_file)
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    logging.error('Checks failed for {}: {!r}. See {}'.format(
+                        input_file, e, log_file_location))
+                    cprint('{} Failed {}; see {}'.format(
+                        progress, input_file, log_file_location), 'red')
+                    continue
+                logging.info('Checked {} in {:.1f} seconds; log at {}'.format(
+                    input_file, seconds, log_file_location))
+                cprint('{} Finished {} in {:.1f} seconds'.format(
+                    progress, input_file, seconds), 'green')
 
     def log_file_location_results(self):
         if os.path.isfile(MARC_DB_LOCATION):
@@ -8,12 +8,22 @@ from crl_lib.crl_utilities import check_for_valid_issn
 from crl_lib.issn_db import IssnDb
 from crl_lib.marc_utilities import get_field_subfield
 from crl_lib.date_utilities import check_year_between
-from crl_lib.marc_fields import MarcFields
+from crl_lib.marc_fields import MarcFields, MarcFieldsExtractor
 
 from validator_lib.utilities import get_valid_forms, get_valid_serial_types
 from validator_lib import ISSN_DB_LOCATION
 
 
+IssnDbTuple = namedtuple(
+    "IssnDbTuple", 
+    "marc issn year_1 year_2 publisher form serial_type bib_lvl title_a title_b")
+
+# the MarcFields data for an IssnDbTuple, by field name
+ISSN_DB_DATA_EXTRACTOR = MarcFieldsExtractor({
+    'year_1': 'year_1', 'year_2': 'year_2', 'publisher': 'imprint', 
+    'form': 'form', 'serial_type': 'serial_type', 'bib_lvl': 'bib_lvl'})
+
+
 class ValidatorIssnDb:
     def __init__(self):
 
@@ -24,6 +34,10 @@ class ValidatorIssnDb:
         self.valid_forms = get_valid_forms()
         self.valid_serial_types = get_valid_serial_types()
 
+    def close(self):
+        if self.issn_db.found_issn_db is True:
+            self.issn_db.close_db()
+
     def process_title_dicts(self, title_dicts, input_file):
         logging.debug("Getting ISSN database data for " + input_file)
         if self.issn_db.found_issn_db is False:
@@ -143,11 +157,11 @@ class ValidatorIssnDb:
         if not marc:
             return
 
-        issn_data_tuple = namedtuple("IssnDbTuple",
-                                     "marc issn year_1 year_2 publisher form serial_type bib_lvl title_a title_b")
-        mf = MarcFields(marc, log_warnings=True, debug_info='from ISSN database')
+        mf = MarcFields(marc, log_warnings=True, debug_info='from ISSN database', lazy=True)
         title_a, title_b = self.issn_db.get_titles_from_issn_marc(marc)
-        return_data = issn_data_tuple(marc, issn, mf.year_1, mf.year_2, mf.imprint, mf.form, mf.serial_type, mf.bib_lvl, title_a, title_b)
+        return_data = IssnDbTuple(
+            marc=marc, issn=issn, title_a=title_a, title_b=title_b, 
+            **ISSN_DB_DATA_EXTRACTOR.extract(mf))
         return return_data
 
     @staticmethod